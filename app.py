@@ -1,27 +1,38 @@
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Blueprint, Flask, Response, render_template, request, jsonify, send_file
 import json
 import csv
 import os
 from datetime import datetime
 import io
-import csv
-import openpyxl
 from werkzeug.utils import secure_filename
-from reportlab.lib.pagesizes import A4
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import mm
-from reportlab.lib import colors
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.pdfbase.cidfonts import UnicodeCIDFont
-import difflib
-import unicodedata
-from datetime import datetime
 from data_persistence import persistence_manager
+from backup_scheduler import backup_scheduler
+import zengin_format
+from transfer_validation import transfer_validator
+from tabular_reader import detect_encoding_and_read_csv, read_excel_rows
+from bank_master import bank_master
+from metrics import metrics
+from app_logging import logging_manager, get_logger
+from profiling import request_profiler
+from warmup import warmup
+from static_assets import static_assets
+from vendor_journal import vendor_journal
+from event_stream import event_stream, EventStreamFull
+from worker_pool import worker_pool, WorkerPoolBusy, WorkerPoolTimeout
+import payment_exports
+from payment_columns import PaymentColumns
+from duplicate_index import duplicate_index
+from payment_store import payment_store
+from export_jobs import export_jobs
+from payment_import import payment_importer
+from upload_cache import upload_cache
+
+# 画面・APIのルート（create_app でアプリケーションに登録）
+bp = Blueprint('main', __name__)
 
-app = Flask(__name__)
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+# ログ出力（debug.log へはバックグラウンドスレッドで書き込む）
+logging_manager.setup()
+storage_logger = get_logger('storage')
 
 # ファイルパス設定
 VENDORS_FILE = 'vendors.json'
@@ -34,6 +45,13 @@ ALLOWED_EXTENSIONS = {'csv', 'xlsx', 'xls'}
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 
+# バックアップアーカイブに含めるデータ
+persistence_manager.register_archive_source('payments', PAYMENTS_FILE)
+persistence_manager.register_archive_source('vendors', VENDORS_FILE)
+persistence_manager.register_archive_source('companies', COMPANIES_FILE)
+persistence_manager.register_archive_source('uploads', UPLOAD_FOLDER)
+
+@metrics.timed('json_load')
 def load_vendors():
     """業者データを読み込み"""
     if os.path.exists(VENDORS_FILE):
@@ -41,15 +59,37 @@ def load_vendors():
             return json.load(f)
     return []
 
+@metrics.timed('json_save')
 def save_vendors(vendors):
-    """業者データを保存"""
-    with open(VENDORS_FILE, 'w', encoding='utf-8') as f:
-        json.dump(vendors, f, ensure_ascii=False, indent=2)
+    """業者データを保存（保存前との差分を変更履歴に記録）"""
+    with vendor_journal.lock():
+        previous = load_vendors()
+        with open(VENDORS_FILE, 'w', encoding='utf-8') as f:
+            json.dump(vendors, f, ensure_ascii=False, indent=2)
+        version = vendor_journal.record(previous, vendors)
+    if version is not None:
+        # ブラウザは差分同期（/api/vendors/changes）で変更を取得する
+        event_stream.publish('vendors_changed', {'version': version})
+
+def payments_state_file():
+    """支払データの変更の検知に使うファイル（分割保存の場合はマニフェスト）"""
+    return payment_store.manifest_path if payment_store.in_use() else PAYMENTS_FILE
 
-def load_payments():
-    """支払データを読み込み（自動復元付き）"""
+@metrics.timed('json_load')
+def load_payments(remittance_company=None, date_from='', date_to=''):
+    """支払データを読み込み（自動復元付き）
+    分割保存の場合、送金会社・支払日を指定すると該当する分割ファイルのみ読み込む
+    （支払日は支払月単位の絞り込みのため、呼び出し元で確認する）"""
+    use_store = payment_store.in_use()  # 移行を確定するまでは payments.json を使う
+    if use_store:
+        try:
+            data = payment_store.load(remittance_company, date_from, date_to)
+            if data or payment_store.has_payments():
+                return data
+        except Exception as e:
+            print(f"支払データ読み込みエラー: {e}")
     # 通常のファイルから読み込みを試行
-    if os.path.exists(PAYMENTS_FILE):
+    elif os.path.exists(PAYMENTS_FILE):
         try:
             with open(PAYMENTS_FILE, 'r', encoding='utf-8') as f:
                 data = json.load(f)
@@ -64,6 +104,9 @@ def load_payments():
         if restored_data:
             print(f"バックアップから支払データを復元しました: {len(restored_data)}件")
             # 復元したデータをメインファイルに保存
+            if use_store:
+                payment_store.save_all(restored_data)
+                return payment_store.load(remittance_company, date_from, date_to)
             with open(PAYMENTS_FILE, 'w', encoding='utf-8') as f:
                 json.dump(restored_data, f, ensure_ascii=False, indent=2)
             return restored_data
@@ -72,23 +115,87 @@ def load_payments():
     
     return []
 
+def _serialize_stored_payments():
+    """分割保存した支払データ全体の (JSON, データ)（バックアップの実行時に読み込む）"""
+    payments = payment_store.load()
+    return json.dumps(payments, ensure_ascii=False, indent=2), payments
+
 def save_payments(payments):
-    """支払データを保存（自動バックアップ付き）"""
-    # 通常の保存
-    with open(PAYMENTS_FILE, 'w', encoding='utf-8') as f:
-        json.dump(payments, f, ensure_ascii=False, indent=2)
+    """支払データを保存（自動バックアップ付き）
+    分割保存の場合は内容が変わった分割ファイルだけを書き換える"""
+    if payment_store.in_use():
+        with metrics.stage('json_save'):
+            payment_store.save_all(payments)
+        # バックアップはバックグラウンドで実行する時点の内容を読み込む（連続した保存はまとめて1回）
+        serialized, data = _serialize_stored_payments, None
+    else:
+        # 通常の保存（JSON化は1回だけ行い、同じ文字列とデータをバックアップにも使う）
+        with metrics.stage('json_save'):
+            serialized, data = json.dumps(payments, ensure_ascii=False, indent=2), payments
+            with open(PAYMENTS_FILE, 'w', encoding='utf-8') as f:
+                f.write(serialized)
     
-    # 自動バックアップ実行
+    # 自動バックアップ（バックグラウンドで一定間隔ごとにまとめて実行）
+    try:
+        backup_scheduler.submit('payments', serialized, data)
+    except Exception as e:
+        print(f"バックアップエラー: {e}")
+
+def _backup_stored_payments():
+    """分割保存した支払データの自動バックアップを依頼（バックグラウンドで実行する時点の内容を読み込む）"""
     try:
-        persistence_manager.auto_backup_payments(payments)
-        print(f"支払データのバックアップを作成しました: {len(payments)}件")
+        backup_scheduler.submit('payments', _serialize_stored_payments)
     except Exception as e:
         print(f"バックアップエラー: {e}")
 
-def load_companies():
+def append_payments(new_payments):
+    """支払表を履歴に追加して保存（分割保存の場合は追加先の分割ファイルだけを書き換え、全件を読み込まない）"""
+    if not payment_store.in_use():
+        save_payments(load_payments() + list(new_payments))
+        return
+    with metrics.stage('json_save'):
+        payment_store.append(new_payments)
+    _backup_stored_payments()
+
+def remove_payment(payment_id):
+    """支払表を削除して保存（削除した支払表。ない場合は None）
+    分割保存の場合は該当する分割ファイルだけを読み書きし、他のワーカーが同時に追加した支払表を上書きしない"""
+    if not payment_store.in_use():
+        payments = load_payments()
+        for index, payment in enumerate(payments):
+            if payment['id'] == payment_id:
+                del payments[index]
+                save_payments(payments)
+                return payment
+        return None
+    with metrics.stage('json_save'):
+        removed = payment_store.remove(payment_id)
+    if removed is not None:
+        _backup_stored_payments()
+    return removed
+
+def replace_payment(payment):
+    """同じIDの支払表を置き換えて保存（ない場合は末尾に追加）
+    分割保存の場合は置き換え前・後の分割ファイルだけを読み書きする"""
+    if not payment_store.in_use():
+        payments = load_payments()
+        for index, current in enumerate(payments):
+            if str(current.get('id')) == str(payment.get('id')):
+                payments[index] = payment
+                break
+        else:
+            payments.append(payment)
+        save_payments(payments)
+        return
+    with metrics.stage('json_save'):
+        payment_store.replace(payment)
+    _backup_stored_payments()
+
+def load_companies(vendors=None):
     """送金会社データを業者マスターデータから取得"""
     # 業者マスターデータを送金会社として使用
-    vendors = load_vendors()
+    if vendors is None:
+        vendors = load_vendors()
     
     # 業者データを送金会社形式に変換
     companies = []
@@ -96,15 +203,19 @@ def load_companies():
         company = {
             "id": i,
             "name": vendor.get('name', ''),
-            "bank_code": vendor.get('bank_code', '0177'),  # デフォルト：福岡銀行
-            "bank_name": vendor.get('bank_name', 'フクオカギンコウ'),
-            "branch_code": vendor.get('branch_code', '001'),
-            "branch_name": vendor.get('branch_name', 'ホンテン'),
+            # 未入力の金融機関・支店のコード・名称は金融機関マスターから補完する（既定値は入れない）
+            "bank_code": vendor.get('bank_code', ''),
+            "bank_name": vendor.get('bank_name', ''),
+            "branch_code": vendor.get('branch_code', ''),
+            "branch_name": vendor.get('branch_name', ''),
             "account_type": vendor.get('account_type', 1),  # 1=普通口座、2=当座口座
             "account_number": vendor.get('account_number', ''),
             "account_holder": vendor.get('account_holder', ''),  # I列：口座振込名義人カナ
-            "client_code": "1234567890"  # デフォルト委託者コード
+            "client_code": "1234567890",  # デフォルト委託者コード
+            "transfer_format": vendor.get('transfer_format', 'csv')  # 振込ファイル形式（csv/fixed/fixed_crlf）
         }
+        # 金融機関マスターから未入力のコード・名称と銀行名・支店名のカナを補完
+        bank_master.fill_vendor(company)
         companies.append(company)
     
     return companies
@@ -114,449 +225,14 @@ def save_companies(companies):
     with open(COMPANIES_FILE, 'w', encoding='utf-8') as f:
         json.dump(companies, f, ensure_ascii=False, indent=2)
 
-def to_halfwidth_kana(text):
-    """全角カナを半角カナに変換"""
-    if not text:
-        return ''
-    
-    # デバッグ：関数呼び出しをログ出力
-    with open('debug.log', 'a', encoding='shift_jis', errors='replace') as f:
-        f.write(f"DEBUG: to_halfwidth_kana呼び出し - 入力: '{text}'\n")
-    print(f"DEBUG: to_halfwidth_kana呼び出し - 入力: '{text}'")
-    
-    # unicodedataを使用して正規化し、手動で変換マップを適用
-    # NFKC正規化で一部の全角文字を半角に変換
-    normalized = unicodedata.normalize('NFKC', text)
-    
-    # 全角カタカナから半角カタカナへの変換マップ
-    zenkaku_to_hankaku = {
-        # 基本カタカナ
-        'ア': 'ｱ', 'イ': 'ｲ', 'ウ': 'ｳ', 'エ': 'ｴ', 'オ': 'ｵ',
-        'カ': 'ｶ', 'キ': 'ｷ', 'ク': 'ｸ', 'ケ': 'ｹ', 'コ': 'ｺ',
-        'サ': 'ｻ', 'シ': 'ｼ', 'ス': 'ｽ', 'セ': 'ｾ', 'ソ': 'ｿ',
-        'タ': 'ﾀ', 'チ': 'ﾁ', 'ツ': 'ﾂ', 'テ': 'ﾃ', 'ト': 'ﾄ',
-        'ナ': 'ﾅ', 'ニ': 'ﾆ', 'ヌ': 'ﾇ', 'ネ': 'ﾈ', 'ノ': 'ﾉ',
-        'ハ': 'ﾊ', 'ヒ': 'ﾋ', 'フ': 'ﾌ', 'ヘ': 'ﾍ', 'ホ': 'ﾎ',
-        'マ': 'ﾏ', 'ミ': 'ﾐ', 'ム': 'ﾑ', 'メ': 'ﾒ', 'モ': 'ﾓ',
-        'ヤ': 'ﾔ', 'ユ': 'ﾕ', 'ヨ': 'ﾖ',
-        'ラ': 'ﾗ', 'リ': 'ﾘ', 'ル': 'ﾙ', 'レ': 'ﾚ', 'ロ': 'ﾛ',
-        'ワ': 'ﾜ', 'ヲ': 'ｦ', 'ン': 'ﾝ',
-        # 濁音・半濁音
-        'ガ': 'ｶﾞ', 'ギ': 'ｷﾞ', 'グ': 'ｸﾞ', 'ゲ': 'ｹﾞ', 'ゴ': 'ｺﾞ',
-        'ザ': 'ｻﾞ', 'ジ': 'ｼﾞ', 'ズ': 'ｽﾞ', 'ゼ': 'ｾﾞ', 'ゾ': 'ｿﾞ',
-        'ダ': 'ﾀﾞ', 'ヂ': 'ﾁﾞ', 'ヅ': 'ﾂﾞ', 'デ': 'ﾃﾞ', 'ド': 'ﾄﾞ',
-        'バ': 'ﾊﾞ', 'ビ': 'ﾋﾞ', 'ブ': 'ﾌﾞ', 'ベ': 'ﾍﾞ', 'ボ': 'ﾎﾞ',
-        'パ': 'ﾊﾟ', 'ピ': 'ﾋﾟ', 'プ': 'ﾌﾟ', 'ペ': 'ﾍﾟ', 'ポ': 'ﾎﾟ',
-        # 小文字
-        'ァ': 'ｧ', 'ィ': 'ｨ', 'ゥ': 'ｩ', 'ェ': 'ｪ', 'ォ': 'ｫ',
-        'ッ': 'ｯ', 'ャ': 'ｬ', 'ュ': 'ｭ', 'ョ': 'ｮ',
-        # 記号類
-        'ー': 'ｰ', '・': '･', '　': ' ',
-        # ピリオド関連（さまざまな種類に対応）
-        '.': '.', '．': '.', '․': '.', '‥': '.', '…': '.',
-        # ハイフン・マイナス記号
-        '-': '-', '－': '-', '−': '-', '–': '-', '—': '-',
-        # その他の記号
-        '(': '(', '（': '(', ')': ')', '）': ')',  # 括弧
-        ' ': ' ', '　': ' ',  # スペース
-        # ひらがなも対応
-        'あ': 'ｱ', 'い': 'ｲ', 'う': 'ｳ', 'え': 'ｴ', 'お': 'ｵ',
-        'か': 'ｶ', 'き': 'ｷ', 'く': 'ｸ', 'け': 'ｹ', 'こ': 'ｺ',
-        'さ': 'ｻ', 'し': 'ｼ', 'す': 'ｽ', 'せ': 'ｾ', 'そ': 'ｿ',
-        'た': 'ﾀ', 'ち': 'ﾁ', 'つ': 'ﾂ', 'て': 'ﾃ', 'と': 'ﾄ',
-        'な': 'ﾅ', 'に': 'ﾆ', 'ぬ': 'ﾇ', 'ね': 'ﾈ', 'の': 'ﾉ',
-        'は': 'ﾊ', 'ひ': 'ﾋ', 'ふ': 'ﾌ', 'へ': 'ﾍ', 'ほ': 'ﾎ',
-        'ま': 'ﾏ', 'み': 'ﾐ', 'む': 'ﾑ', 'め': 'ﾒ', 'も': 'ﾓ',
-        'や': 'ﾔ', 'ゆ': 'ﾕ', 'よ': 'ﾖ',
-        'ら': 'ﾗ', 'り': 'ﾘ', 'る': 'ﾙ', 'れ': 'ﾚ', 'ろ': 'ﾛ',
-        'わ': 'ﾜ', 'を': 'ｦ', 'ん': 'ﾝ',
-        # ひらがな濁音・半濁音
-        'が': 'ｶﾞ', 'ぎ': 'ｷﾞ', 'ぐ': 'ｸﾞ', 'げ': 'ｹﾞ', 'ご': 'ｺﾞ',
-        'ざ': 'ｻﾞ', 'じ': 'ｼﾞ', 'ず': 'ｽﾞ', 'ぜ': 'ｾﾞ', 'ぞ': 'ｿﾞ',
-        'だ': 'ﾀﾞ', 'ぢ': 'ﾁﾞ', 'づ': 'ﾂﾞ', 'で': 'ﾃﾞ', 'ど': 'ﾄﾞ',
-        'ば': 'ﾊﾞ', 'び': 'ﾋﾞ', 'ぶ': 'ﾌﾞ', 'べ': 'ﾍﾞ', 'ぼ': 'ﾎﾞ',
-        'ぱ': 'ﾊﾟ', 'ぴ': 'ﾋﾟ', 'ぷ': 'ﾌﾟ', 'ぺ': 'ﾍﾟ', 'ぽ': 'ﾎﾟ',
-        # ひらがな小文字
-        'ぁ': 'ｧ', 'ぃ': 'ｨ', 'ぅ': 'ｩ', 'ぇ': 'ｪ', 'ぉ': 'ｫ',
-        'っ': 'ｯ', 'ゃ': 'ｬ', 'ゅ': 'ｭ', 'ょ': 'ｮ'
-    }
-    
-    result = ''
-    for char in normalized:
-        if char in zenkaku_to_hankaku:
-            result += zenkaku_to_hankaku[char]
-        elif char.isascii():  # ASCII文字はそのまま
-            result += char
-        elif char.isspace():  # スペース文字は半角スペースに
-            result += ' '
-        else:
-            # その他の文字は半角スペースに置換（銀行システム対応）
-            print(f"DEBUG: 変換できない文字: '{char}' (Unicode: U+{ord(char):04X})")
-            result += ' '
-    
-    # デバッグ用：変換結果を出力
-    with open('debug.log', 'a', encoding='shift_jis', errors='replace') as f:
-        f.write(f"DEBUG: 入力テキスト: '{text}' -> 変換結果: '{result}'\n")
-    print(f"DEBUG: 入力テキスト: '{text}' -> 変換結果: '{result}'")
-    
-    # チェックリーシングの場合は詳細情報を表示
-    if 'ﾁｴﾂｸ' in text:
-        with open('debug.log', 'a', encoding='shift_jis', errors='replace') as f:
-            f.write(f"DEBUG: チェックリーシング関連文字列検出\n")
-        print(f"DEBUG: チェックリーシング関連文字列検出")
-        # 各文字のUnicodeコードポイントを表示
-        for i, char in enumerate(text):
-            debug_msg = f"  文字[{i}]: '{char}' (U+{ord(char):04X})"
-            with open('debug.log', 'a', encoding='shift_jis', errors='replace') as f:
-                f.write(debug_msg + "\n")
-            print(debug_msg)
-            if char not in zenkaku_to_hankaku and not char.isascii() and not char.isspace():
-                error_msg = f"    -> 変換マップにない文字！"
-                with open('debug.log', 'a', encoding='shift_jis', errors='replace') as f:
-                    f.write(error_msg + "\n")
-                print(error_msg)
-    
-    return result
-
-def to_halfwidth_alphanumeric(text):
-    """全角英数字を半角英数字に変換"""
-    if not text:
-        return ''
-    
-    # unicodedataを使用して全角文字を半角に変換
-    result = unicodedata.normalize('NFKC', text)
-    
-    # さらに確実に半角に変換
-    zenkaku_to_hankaku = {
-        '０': '0', '１': '1', '２': '2', '３': '3', '４': '4',
-        '５': '5', '６': '6', '７': '7', '８': '8', '９': '9',
-        'Ａ': 'A', 'Ｂ': 'B', 'Ｃ': 'C', 'Ｄ': 'D', 'Ｅ': 'E',
-        'Ｆ': 'F', 'Ｇ': 'G', 'Ｈ': 'H', 'Ｉ': 'I', 'Ｊ': 'J',
-        'Ｋ': 'K', 'Ｌ': 'L', 'Ｍ': 'M', 'Ｎ': 'N', 'Ｏ': 'O',
-        'Ｐ': 'P', 'Ｑ': 'Q', 'Ｒ': 'R', 'Ｓ': 'S', 'Ｔ': 'T',
-        'Ｕ': 'U', 'Ｖ': 'V', 'Ｗ': 'W', 'Ｘ': 'X', 'Ｙ': 'Y', 'Ｚ': 'Z',
-        'ａ': 'a', 'ｂ': 'b', 'ｃ': 'c', 'ｄ': 'd', 'ｅ': 'e',
-        'ｆ': 'f', 'ｇ': 'g', 'ｈ': 'h', 'ｉ': 'i', 'ｊ': 'j',
-        'ｋ': 'k', 'ｌ': 'l', 'ｍ': 'm', 'ｎ': 'n', 'ｏ': 'o',
-        'ｐ': 'p', 'ｑ': 'q', 'ｒ': 'r', 'ｓ': 's', 'ｔ': 't',
-        'ｕ': 'u', 'ｖ': 'v', 'ｗ': 'w', 'ｘ': 'x', 'ｙ': 'y', 'ｚ': 'z'
-    }
-    
-    converted = ''
-    for char in result:
-        if char in zenkaku_to_hankaku:
-            converted += zenkaku_to_hankaku[char]
-        else:
-            converted += char
-    
-    return converted
-
 def allowed_file(filename):
     """許可されたファイル拡張子かチェック"""
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def convert_to_ascii_safe(text):
-    """テキストを完全にASCII安全な文字に変換（クラウド環境対応）"""
-    if not text:
-        return ''
-    
-    # 日本語キーワードを英語に完全変換
-    conversion_map = {
-        '支払日': 'Payment Date',
-        '送金会社名': 'Remittance Company',
-        '作成日時': 'Created At',
-        '業者支払表': 'Vendor Payment List',
-        '業者名': 'Vendor Name',
-        '金額': 'Amount',
-        '摘要': 'Description',
-        '合計': 'Total',
-        '小計': 'Subtotal',
-        '不明': 'Unknown',
-        '円': 'JPY',
-        # 追加の変換ルール
-        '【': '[',
-        '】': ']',
-        '「': '"',
-        '」': '"',
-        '・': '-',
-        '、': ',',
-        '。': '.'
-    }
-    
-    result = text
-    # 日本語キーワードを先に変換
-    for japanese, english in conversion_map.items():
-        result = result.replace(japanese, english)
-    
-    # 非-ASCII文字を除去または置換
-    ascii_result = ''
-    for char in result:
-        if ord(char) < 128:  # ASCII文字のみ
-            ascii_result += char
-        else:
-            # 非-ASCII文字はスペースまたは'?'に置換
-            ascii_result += ' '
-    
-    # 連続するスペースを一つに統一
-    import re
-    ascii_result = re.sub(r'\s+', ' ', ascii_result).strip()
-    
-    return ascii_result
-
-def convert_for_pdf_display(text, is_header=False, max_length=None):
-    """テキストをPDF表示用に変換（全て日本語保持、問題文字のみ置換）"""
-    if not text:
-        return ''
-    
-    # 全ての文字で問題のある特殊文字や記号のみ置換
-    # 日本語は全て保持する
-    result = text
-    problem_chars = {
-        '【': '[',
-        '】': ']',
-        '「': '"',
-        '」': '"',
-        '・': '-',
-        '‐': '-',  # ハイフン
-        '–': '-',  # enダッシュ
-        '—': '-',  # emダッシュ
-        '～': '~',  # 全角チルダ
-    }
-    
-    for problem_char, replacement in problem_chars.items():
-        result = result.replace(problem_char, replacement)
-    
-    # 最大長が指定されている場合、改行を挿入
-    if max_length and len(result) > max_length:
-        # 適切な位置で改行を挿入
-        words = []
-        current_line = ''
-        for char in result:
-            if len(current_line) >= max_length:
-                words.append(current_line)
-                current_line = char
-            else:
-                current_line += char
-        if current_line:
-            words.append(current_line)
-        result = '\n'.join(words)
-    
-    return result
-
-def generate_payment_pdf(payment_data, vendors):
-    """支払表のPDFを生成（CIDフォントで日本語対応）"""
-    # CIDフォントで日本語を処理
-    try:
-        # ReportLabのCIDフォントを登録
-        pdfmetrics.registerFont(UnicodeCIDFont('HeiseiKakuGo-W5'))
-        japanese_font = 'HeiseiKakuGo-W5'
-        print("CIDフォント HeiseiKakuGo-W5 を使用してPDFを生成します")
-    except Exception as e:
-        try:
-            # 代替フォントを試行
-            pdfmetrics.registerFont(UnicodeCIDFont('HeiseiMin-W3'))
-            japanese_font = 'HeiseiMin-W3'
-            print("CIDフォント HeiseiMin-W3 を使用してPDFを生成します")
-        except Exception as e2:
-            try:
-                # さらに代替フォントを試行
-                pdfmetrics.registerFont(UnicodeCIDFont('STSong-Light'))
-                japanese_font = 'STSong-Light'
-                print("CIDフォント STSong-Light を使用してPDFを生成します")
-            except Exception as e3:
-                # 最終的なフォールバック
-                japanese_font = 'Helvetica'
-                print(f"CIDフォント登録失敗: {e}, {e2}, {e3}")
-                print("HelveticaフォントでPDFを生成します")
-    
-    # PDFファイル名を生成
-    pdf_filename = f"payment_list_{payment_data['id']}.pdf"
-    pdf_path = os.path.join('temp', pdf_filename)
-    
-    # tempディレクトリを作成
-    if not os.path.exists('temp'):
-        os.makedirs('temp')
-    
-    # 業者IDから業者情報を取得するマップを作成
-    vendor_map = {v['id']: v for v in vendors}
-    
-    # PDFドキュメントを作成
-    doc = SimpleDocTemplate(pdf_path, pagesize=A4)
-    elements = []
-    
-    # スタイルを設定（日本語フォント使用）
-    styles = getSampleStyleSheet()
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontName=japanese_font,
-        fontSize=16,
-        spaceAfter=30,
-        alignment=1  # 中央揃え
-    )
-    
-    # タイトル（日本語表示）
-    title = Paragraph(convert_for_pdf_display("業者支払表"), title_style)
-    elements.append(title)
-    elements.append(Spacer(1, 12))
-    
-    # 支払情報（全て日本語表示）
-    info_data = [
-        [convert_for_pdf_display('支払日'), payment_data['payment_date']],
-        [convert_for_pdf_display('送金会社名'), convert_for_pdf_display(payment_data['remittance_company'])],
-        [convert_for_pdf_display('作成日時'), payment_data['created_at'][:19].replace('T', ' ')]
-    ]
-    
-    info_table = Table(info_data, colWidths=[40*mm, 100*mm])
-    info_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (0, -1), colors.lightgrey),
-        ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('FONTNAME', (0, 0), (-1, -1), japanese_font),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black)
-    ]))
-    
-    elements.append(info_table)
-    elements.append(Spacer(1, 20))
-    
-    # 支払データを業者ごとにグループ化
-    vendor_groups = {}
-    for item in payment_data['items']:
-        vendor_id = item['vendor_id']
-        if vendor_id not in vendor_groups:
-            vendor_groups[vendor_id] = []
-        vendor_groups[vendor_id].append(item)
-    
-    # 支払明細テーブル（全て日本語表示）
-    table_data = [['No.', convert_for_pdf_display('業者名'), convert_for_pdf_display('金額'), convert_for_pdf_display('摘要')]]
-    
-    total_amount = 0
-    row_number = 1
-    
-    # 業者ごとにデータを追加
-    for vendor_id, items in vendor_groups.items():
-        vendor = vendor_map.get(vendor_id, {})
-        vendor_subtotal = 0
-        
-        # 同じ業者の支払い項目を追加
-        for item in items:
-            amount = int(item['amount'])
-            vendor_subtotal += amount
-            total_amount += amount
-            
-            table_data.append([
-                str(row_number),
-                convert_for_pdf_display(vendor.get('name', '不明'), max_length=15),  # 業者名は15文字で改行
-                f"{amount:,}",
-                convert_for_pdf_display(item.get('description', ''), max_length=20)  # 摘要は20文字で改行
-            ])
-            row_number += 1
-        
-        # 同じ業者に複数の支払いがある場合は小計行を追加
-        if len(items) > 1:
-            table_data.append([
-                '',
-                f"[{convert_for_pdf_display(vendor.get('name', '不明'), max_length=12)} {convert_for_pdf_display('小計')}]",  # 小計行は短めに
-                f"{vendor_subtotal:,}",
-                ''
-            ])
-    
-    # 合計行を追加
-    table_data.append(['', convert_for_pdf_display('合計'), f"{total_amount:,}", ''])
-    
-    # テーブルを作成（業者名列を拡大、バランス調整）
-    payment_table = Table(table_data, colWidths=[12*mm, 75*mm, 28*mm, 75*mm])
-    
-    # 基本スタイルを設定
-    table_style = [
-        # ヘッダー行のスタイル
-        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), japanese_font),
-        ('FONTSIZE', (0, 0), (-1, 0), 9),
-        
-        # データ行のスタイル
-        ('FONTNAME', (0, 1), (-1, -2), japanese_font),
-        ('FONTSIZE', (0, 1), (-1, -2), 8),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
-        
-        # 合計行のスタイル
-        ('BACKGROUND', (0, -1), (-1, -1), colors.lightgrey),
-        ('FONTNAME', (0, -1), (-1, -1), japanese_font),
-        ('FONTSIZE', (0, -1), (-1, -1), 9),
-        
-        # 罫線
-        ('GRID', (0, 0), (-1, -1), 1, colors.black),
-        
-        # 金額列を右揃え（第3列に変更）
-        ('ALIGN', (2, 1), (2, -1), 'RIGHT'),
-        
-        # テキスト折り返し設定（業者名列と摘要列）
-        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-        ('WORDWRAP', (1, 0), (1, -1), True),  # 業者名列
-        ('WORDWRAP', (3, 0), (3, -1), True),  # 摘要列
-    ]
-    
-    # 小計行のスタイルを追加（小計行を識別して背景色を設定）
-    for i, row in enumerate(table_data):
-        if len(row) > 1 and isinstance(row[1], str) and '小計' in row[1]:
-            table_style.extend([
-                ('BACKGROUND', (0, i), (-1, i), colors.Color(0.9, 0.9, 1.0)),  # 薄い青色
-                ('FONTNAME', (0, i), (-1, i), japanese_font),
-                ('FONTSIZE', (0, i), (-1, i), 8),
-                ('ALIGN', (1, i), (1, i), 'LEFT'),  # 業者名は左揃え
-            ])
-    
-    payment_table.setStyle(TableStyle(table_style))
-    
-    elements.append(payment_table)
-    
-    # PDFを生成
-    doc.build(elements)
-    
-    return pdf_path
-
+@metrics.timed('upload_parse')
 def process_uploaded_file(filepath):
     """アップロードされたファイルを処理して業者データに変換"""
-    def detect_encoding_and_read_csv(filepath):
-        """CSVファイルのエンコーディングを検出して読み込み"""
-        # 試行するエンコーディングのリスト
-        encodings = ['utf-8', 'shift_jis', 'cp932', 'euc-jp', 'iso-2022-jp', 'utf-8-sig']
-        
-        for encoding in encodings:
-            try:
-                with open(filepath, 'r', encoding=encoding, newline='') as csvfile:
-                    reader = csv.reader(csvfile)
-                    headers = next(reader)
-                    data_rows = list(reader)
-                    return headers, data_rows, None
-            except (UnicodeDecodeError, UnicodeError):
-                continue
-            except Exception as e:
-                continue
-        
-        # すべてのエンコーディングで失敗した場合、バイナリモードで読み込んでエラー文字を置換
-        try:
-            with open(filepath, 'rb') as f:
-                content = f.read()
-            
-            # UTF-8で読み込み、エラー文字は置換
-            text_content = content.decode('utf-8', errors='replace')
-            
-            # StringIOを使ってCSVとして解析
-            csv_content = io.StringIO(text_content)
-            reader = csv.reader(csv_content)
-            headers = next(reader)
-            data_rows = list(reader)
-            return headers, data_rows, "警告: 一部の文字が正しく読み込めませんでした"
-            
-        except Exception as e:
-            return None, None, f"ファイルの読み込みに失敗しました: {str(e)}"
-    
     try:
         # ファイル拡張子を確認
         file_ext = filepath.rsplit('.', 1)[1].lower()
@@ -572,16 +248,7 @@ def process_uploaded_file(filepath):
                 return None, warning_message
         else:
             # Excelファイルの場合
-            workbook = openpyxl.load_workbook(filepath)
-            worksheet = workbook.active
-            
-            # ヘッダー行を取得
-            headers = [cell.value for cell in worksheet[1]]
-            
-            # データ行を取得
-            for row in worksheet.iter_rows(min_row=2, values_only=True):
-                if any(cell is not None for cell in row):  # 空行をスキップ
-                    data_rows.append([str(cell) if cell is not None else '' for cell in row])
+            headers, data_rows = read_excel_rows(filepath)
         
         # 固定列位置でのデータ取得（B列～I列 = インデックス1～8）
         # B列(1): 金融機関コード
@@ -651,14 +318,24 @@ def process_uploaded_file(filepath):
                     'source': 'upload'  # アップロード由来であることを示す
                 }
                 
+                # 金融機関マスターから未入力の金融機関名・支店名・コードを補完
+                bank_master.fill_vendor(vendor)
+                
                 # 必須項目が空でない場合のみ追加
-                if company_name and bank_name and account_number and account_holder:
+                if company_name and vendor['bank_name'] and account_number and account_holder:
                     vendors.append(vendor)
                     
             except (IndexError, ValueError) as e:
                 # 行の処理でエラーが発生した場合はスキップ
                 continue
         
+        # 振込ファイル出力時と同じ検証を実施（結果はキャッシュされる）
+        issues = transfer_validator.validate_vendors(vendors)
+        error_count = sum(1 for issue in issues if issue['severity'] == 'error')
+        if error_count:
+            validation_message = f"警告: 口座情報の不備が{error_count}件あります（振込ファイル出力時にエラーになります）"
+            warning_message = f"{warning_message}\n{validation_message}" if warning_message else validation_message
+        
         return vendors, warning_message
         
     except Exception as e:
@@ -679,26 +356,143 @@ def get_uploaded_files():
                 })
     return files
 
-@app.route('/')
+@bp.route('/')
 def index():
     """メインページ"""
     return render_template('index.html')
 
-@app.route('/api/vendors')
+def vendor_etag(kind):
+    """業者データの変更履歴のバージョンから作るETag（送金会社は金融機関マスターの更新日時も含める）"""
+    version = vendor_journal.current_version()
+    if kind == 'companies':
+        return f"companies-{version}-{bank_master.revision() or 0}"
+    return f"{kind}-{version}"
+
+def cached_json(etag, build):
+    """ETagが一致すれば304を返し、異なれば build() の結果を返す（ブラウザには毎回再検証させる）"""
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(build())
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@bp.route('/api/vendors')
 def get_vendors():
     """業者一覧を取得"""
-    vendors = load_vendors()
-    return jsonify(vendors)
+    return cached_json(vendor_etag('vendors'), load_vendors)
 
-@app.route('/api/companies')
+@bp.route('/api/vendors/changes')
+def get_vendor_changes():
+    """指定したバージョン以降の業者データの差分を取得（?since=バージョン）
+    差分で追えない場合（未指定・古すぎる・不明なバージョン）は reset: true と全件を返す"""
+    since = request.args.get('since', type=int)
+    changes = vendor_journal.changes(since)
+    if changes is None:
+        version = vendor_journal.current_version()
+        return jsonify({'version': version, 'reset': True, 'vendors': load_vendors()})
+    
+    version, upserts, deletes = changes
+    return jsonify({'version': version, 'reset': False, 'upserts': upserts, 'deletes': deletes})
+
+@bp.route('/api/companies')
 def get_companies():
     """送金会社一覧を取得"""
-    companies = load_companies()
-    return jsonify(companies)
+    return cached_json(vendor_etag('companies'), load_companies)
 
-@app.route('/api/vendors/search')
+@bp.route('/api/companies/transfer-format', methods=['POST'])
+def update_company_transfer_format():
+    """送金会社ごとの振込ファイル形式を設定"""
+    data = request.json
+    name = data.get('name', '')
+    transfer_format = data.get('transfer_format', 'csv')
+    
+    if transfer_format not in zengin_format.TRANSFER_FORMATS:
+        return jsonify({'success': False, 'error': f'未対応の出力形式です: {transfer_format}'}), 400
+    
+    # 送金会社は業者マスターデータから取得しているため、該当する業者データに設定を保存
+    vendors = load_vendors()
+    updated = 0
+    for vendor in vendors:
+        if vendor.get('name') == name:
+            vendor['transfer_format'] = transfer_format
+            updated += 1
+    
+    if not updated:
+        return jsonify({'success': False, 'error': '送金会社が見つかりません'}), 404
+    
+    save_vendors(vendors)
+    return jsonify({'success': True, 'name': name, 'transfer_format': transfer_format})
+
+@bp.route('/api/banks/status')
+def get_bank_master_status():
+    """金融機関マスターの読み込み状態を取得"""
+    return jsonify(bank_master.status())
+
+@bp.route('/api/banks/import', methods=['POST'])
+def import_bank_master():
+    """金融機関・支店コード一覧ファイルを取り込み"""
+    if 'file' not in request.files:
+        return jsonify({'error': 'ファイルが選択されていません'}), 400
+    
+    file = request.files['file']
+    if file.filename == '' or not (allowed_file(file.filename) or file.filename.lower().endswith('.txt')):
+        return jsonify({'error': '許可されていないファイル形式です'}), 400
+    
+    # 一時ファイルに保存して取り込み
+    if not os.path.exists('temp'):
+        os.makedirs('temp')
+    filepath = os.path.join('temp', f"bank_master_{secure_filename(file.filename)}")
+    file.save(filepath)
+    try:
+        status = bank_master.import_file(filepath)
+    except Exception as e:
+        return jsonify({'success': False, 'error': f'金融機関マスターの取り込みに失敗しました: {str(e)}'}), 400
+    finally:
+        os.remove(filepath)
+    
+    return jsonify({
+        'success': True,
+        'message': f"金融機関{status['bank_count']}件・支店{status['branch_count']}件を取り込みました",
+        **status
+    })
+
+@bp.route('/api/banks/search')
+def search_banks():
+    """金融機関を検索（コード・カナ名の前方一致）"""
+    query = request.args.get('q', '').strip()
+    limit = min(request.args.get('limit', 10, type=int), 50)
+    return jsonify(bank_master.search_banks(query, limit))
+
+@bp.route('/api/banks/<bank_code>')
+def lookup_bank(bank_code):
+    """金融機関コードから金融機関情報を取得"""
+    bank = bank_master.lookup_bank(bank_code)
+    if bank is None:
+        return jsonify({'error': '金融機関が見つかりません'}), 404
+    return jsonify(bank)
+
+@bp.route('/api/banks/<bank_code>/branches/search')
+def search_branches(bank_code):
+    """支店を検索（コード・カナ名の前方一致）"""
+    query = request.args.get('q', '').strip()
+    limit = min(request.args.get('limit', 10, type=int), 50)
+    return jsonify(bank_master.search_branches(bank_code, query, limit))
+
+@bp.route('/api/banks/<bank_code>/branches/<branch_code>')
+def lookup_branch(bank_code, branch_code):
+    """金融機関コード・支店コードから支店情報を取得"""
+    branch = bank_master.lookup_branch(bank_code, branch_code)
+    if branch is None:
+        return jsonify({'error': '支店が見つかりません'}), 404
+    return jsonify(branch)
+
+@bp.route('/api/vendors/search')
 def search_vendors():
     """業者検索（部分一致・あいまい検索）"""
+    from difflib import SequenceMatcher
+
     query = request.args.get('q', '').strip()
     if not query:
         return jsonify([])
@@ -716,7 +510,7 @@ def search_vendors():
             })
         # あいまい検索（類似度計算）
         else:
-            similarity = difflib.SequenceMatcher(None, query, vendor['name']).ratio()
+            similarity = SequenceMatcher(None, query, vendor['name']).ratio()
             if similarity > 0.3:  # 30%以上の類似度
                 results.append({
                     'vendor': vendor,
@@ -730,7 +524,7 @@ def search_vendors():
     # 上位10件まで返す
     return jsonify([r['vendor'] for r in results[:10]])
 
-@app.route('/api/vendors', methods=['POST'])
+@bp.route('/api/vendors', methods=['POST'])
 def add_vendor():
     """業者を追加"""
     data = request.json
@@ -745,19 +539,105 @@ def add_vendor():
         'account_number': data['account_number'],
         'account_holder': data['account_holder']
     }
+    if data.get('bank_code'):
+        new_vendor['bank_code'] = data['bank_code']
+    if data.get('branch_code'):
+        new_vendor['branch_code'] = data['branch_code']
+    
+    # 金融機関マスターから未入力の金融機関名・支店名・コードを補完
+    bank_master.fill_vendor(new_vendor)
     
     vendors.append(new_vendor)
     save_vendors(vendors)
     
     return jsonify({'success': True, 'vendor': new_vendor})
 
-@app.route('/api/payments', methods=['GET'])
+@bp.route('/api/payments', methods=['GET'])
 def get_payments():
     """支払一覧を取得"""
     payments = load_payments()
     return jsonify(payments)
 
-@app.route('/api/payments/<payment_id>', methods=['GET'])
+def filter_payments(args):
+    """支払履歴を支払日（from・to）・送金会社（company）で絞り込み（分割保存の場合は該当する分割ファイルのみ読み込む）"""
+    date_from = args.get('from', '')
+    date_to = args.get('to', '')
+    company = args.get('company', '')
+    return [
+        payment for payment in load_payments(company or None, date_from, date_to)
+        if (not date_from or payment.get('payment_date', '') >= date_from)
+        and (not date_to or payment.get('payment_date', '') <= date_to)
+        and (not company or payment.get('remittance_company') == company)
+    ]
+
+@bp.route('/api/payments/summary', methods=['GET'])
+def get_payment_summary():
+    """支払履歴の業者別集計（支払日・送金会社で絞り込み）"""
+    payments = filter_payments(request.args)
+    
+    columns = PaymentColumns.from_payments(payments, strict=False)
+    vendor_map = {vendor['id']: vendor for vendor in load_vendors()}
+    vendor_totals = [
+        {
+            'vendor_id': vendor_id,
+            'vendor_name': vendor_map.get(vendor_id, {}).get('name', '不明'),
+            'item_count': count,
+            'total_amount': amount
+        }
+        for vendor_id, (count, amount) in columns.totals_by_vendor().items()
+    ]
+    vendor_totals.sort(key=lambda entry: entry['total_amount'], reverse=True)
+    
+    return jsonify({
+        'payment_count': len(payments),
+        'item_count': len(columns),
+        'total_amount': columns.total(),
+        'vendors': vendor_totals
+    })
+
+@bp.route('/api/payments/export', methods=['GET'])
+def export_payments_excel():
+    """支払履歴をExcelで出力（支払日・送金会社で絞り込み）
+    明細が多い場合はバックグラウンドで作成し、202 とジョブIDを返す"""
+    payments = filter_payments(request.args)
+    if not payments:
+        return jsonify({'error': '該当する支払データがありません'}), 404
+    
+    # 口座情報のスナップショットがない以前の明細のみ業者マスターを参照する
+    vendors = []
+    if any('recipient' not in item for payment in payments for item in payment.get('items') or []):
+        vendors = load_vendors()
+    period = '_'.join(filter(None, [request.args.get('from', ''), request.args.get('to', '')])) or 'all'
+    download_name = f"payments_{period.replace('-', '')}.xlsx"
+    
+    if export_jobs.should_run_async(payments):
+        job_id = export_jobs.start(payments, vendors, download_name)
+        return jsonify({'job_id': job_id, 'status': 'running',
+                        'status_url': f'/api/payments/export/{job_id}'}), 202
+    
+    path = export_jobs.export(payments, vendors)
+    return send_file(os.path.abspath(path), as_attachment=True, download_name=download_name)
+
+@bp.route('/api/payments/export/<job_id>', methods=['GET'])
+def get_export_job(job_id):
+    """バックグラウンドで作成中のExcelの状態"""
+    job = export_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'エクスポートが見つかりません'}), 404
+    if job['status'] == 'done':
+        job['download_url'] = f'/api/payments/export/{job_id}/download'
+    return jsonify(job)
+
+@bp.route('/api/payments/export/<job_id>/download', methods=['GET'])
+def download_export_job(job_id):
+    """バックグラウンドで作成したExcelをダウンロード"""
+    job = export_jobs.get(job_id)
+    if job is None or job['status'] != 'done' or not os.path.exists(export_jobs.file_path(job_id)):
+        return jsonify({'error': 'エクスポートが見つかりません'}), 404
+    return send_file(os.path.abspath(export_jobs.file_path(job_id)), as_attachment=True,
+                     download_name=job['filename'])
+
+@bp.route('/api/payments/<payment_id>', methods=['GET'])
 def get_payment(payment_id):
     """個別の支払履歴を取得"""
     try:
@@ -774,21 +654,16 @@ def get_payment(payment_id):
         print(f"支払取得エラー: {e}")
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/payments/<payment_id>', methods=['DELETE'])
+@bp.route('/api/payments/<payment_id>', methods=['DELETE'])
 def delete_payment(payment_id):
     """支払履歴を削除"""
     try:
-        payments = load_payments()
-        
-        # 該当する支払データを検索
-        payment_to_delete = None
-        for payment in payments:
-            if payment['id'] == payment_id:
-                payment_to_delete = payment
-                break
-        
+        # 二重支払の索引を削除前の支払データに合わせてから、該当する支払データを削除
+        duplicate_index.sync(payments_state_file(), load_payments, load_vendors)
+        payment_to_delete = remove_payment(payment_id)
         if not payment_to_delete:
             return jsonify({'success': False, 'error': '支払データが見つかりません'}), 404
+        duplicate_index.remove_payment(payment_to_delete, payments_state_file())
         
         # 関連するPDFファイルを削除
         pdf_filename = f"payment_{payment_id}.pdf"
@@ -800,9 +675,7 @@ def delete_payment(payment_id):
             except Exception as e:
                 print(f"PDFファイル削除エラー: {e}")
         
-        # 支払データを削除
-        payments.remove(payment_to_delete)
-        save_payments(payments)
+        event_stream.publish('payment_deleted', {'id': payment_id})
         
         return jsonify({'success': True, 'message': '支払データを削除しました'})
         
@@ -810,7 +683,41 @@ def delete_payment(payment_id):
         print(f"支払削除エラー: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/api/payments', methods=['POST'])
+def select_payment_vendors(payment_data, vendors=None):
+    """支払表で使用する業者のみを抽出（ワーカープールへ渡すデータを減らす）
+    受取人スナップショットのある明細の業者は不要なため、全明細にある場合は業者マスターを読み込まない"""
+    vendor_ids = {item['vendor_id'] for item in payment_data['items'] if 'recipient' not in item}
+    if not vendor_ids:
+        return []
+    if vendors is None:
+        vendors = load_vendors()
+    return [vendor for vendor in vendors if vendor['id'] in vendor_ids]
+
+def snapshot_payment_accounts(payment_data, vendors):
+    """支払表に送金会社・受取人の口座情報のスナップショットを保存
+    業者マスターの変更・番号の振り直し後も、作成時の口座情報で出力できるようにする
+    業者・送金会社がマスターデータにない場合は None を保存する"""
+    vendor_map = {v['id']: v for v in vendors}
+    for item in payment_data['items']:
+        vendor = vendor_map.get(item.get('vendor_id'))
+        item['recipient'] = payment_exports.recipient_snapshot(vendor) if vendor else None
+    
+    # 同名の業者が複数ある場合は load_transfer_context と同じく最後のものを使う
+    remitters = [v for v in vendors if v.get('name') == payment_data['remittance_company']]
+    payment_data['remitter'] = payment_exports.remitter_snapshot(load_companies(remitters[-1:])[0]) if remitters else None
+
+def payment_event_data(payment_data):
+    """支払表作成の通知内容（支払履歴の一覧の1行分）"""
+    return {
+        'id': payment_data['id'],
+        'payment_date': payment_data['payment_date'],
+        'remittance_company': payment_data['remittance_company'],
+        'created_at': payment_data['created_at'],
+        'item_count': len(payment_data['items']),
+        'total_amount': PaymentColumns.from_items(payment_data['items'], strict=False).total()
+    }
+
+@bp.route('/api/payments', methods=['POST'])
 def create_payment_list():
     """支払表を作成"""
     data = request.json
@@ -822,38 +729,145 @@ def create_payment_list():
         'items': data['items'],
         'created_at': datetime.now().isoformat()
     }
+    vendors = load_vendors()
+    snapshot_payment_accounts(payment_data, vendors)
     
-    payments = load_payments()
-    payments.append(payment_data)
-    save_payments(payments)
+    # 同じ支払日・口座・金額の支払いが既存の支払表にないか確認（警告のみで作成は行う）
+    duplicate_index.sync(payments_state_file(), load_payments, lambda: vendors)
+    duplicates = duplicate_index.find(payment_data)
     
-    # PDFを生成
-    vendors = load_vendors()
+    append_payments([payment_data])
+    duplicate_index.add_payment(payment_data, payments_state_file())
+    event_stream.publish('payment_created', payment_event_data(payment_data))
+    
+    result = {'success': True, 'payment_id': payment_data['id'], 'duplicates': duplicates}
+    if duplicates:
+        result['warning'] = f'同じ支払日・振込先・金額の支払いが既存の支払表に{len(duplicates)}件あります'
+    
+    # PDFを生成（ワーカープールで実行。混雑時はダウンロード時に生成する）
     try:
-        pdf_path = generate_payment_pdf(payment_data, vendors)
-        return jsonify({
-            'success': True, 
-            'payment_id': payment_data['id'],
+        pdf_path = worker_pool.run(payment_exports.generate_payment_pdf, payment_data,
+                                   select_payment_vendors(payment_data, vendors))
+        result.update({
             'pdf_generated': True,
             'pdf_filename': os.path.basename(pdf_path)
         })
+        event_stream.publish('pdf_ready', {'payment_id': payment_data['id']})
     except Exception as e:
         # PDF生成に失敗しても支払データは保存される
-        return jsonify({
-            'success': True, 
-            'payment_id': payment_data['id'],
+        result.update({
             'pdf_generated': False,
             'error': f'PDF生成エラー: {str(e)}'
         })
+    return jsonify(result)
 
-@app.route('/api/payments/<payment_id>/pdf')
+@bp.route('/api/payments/import', methods=['POST'])
+def import_payment_lists():
+    """会計システムの支払データ（CSV/Excel）から支払表を一括作成
+
+    フォーム: file, payment_date・remittance_company（ファイルに列がない場合の既定値）,
+    dry_run（1 の場合は保存せずに作成内容と取り込めない行を返す）
+    業者を特定できた行のみ取り込み、特定できない行は理由とともに返す
+    """
+    if 'file' not in request.files:
+        return jsonify({'error': 'ファイルが選択されていません'}), 400
+    file = request.files['file']
+    if file.filename == '' or not allowed_file(file.filename):
+        return jsonify({'error': '許可されていないファイル形式です'}), 400
+    
+    # 一時ファイルに保存して読み込み（アップロードファイル一覧には含めない）
+    os.makedirs('temp', exist_ok=True)
+    filepath = os.path.join('temp', f"payment_import_{os.getpid()}_{datetime.now().strftime('%H%M%S%f')}."
+                                    f"{file.filename.rsplit('.', 1)[1].lower()}")
+    file.save(filepath)
+    try:
+        rows, warning_message = payment_importer.read_rows(filepath)
+    except Exception as e:
+        return jsonify({'success': False, 'error': f'ファイル処理エラー: {str(e)}'}), 400
+    finally:
+        os.remove(filepath)
+    
+    vendors = load_vendors()
+    new_payments, unmatched = payment_importer.build_payments(
+        rows, vendors, request.form.get('payment_date', ''), request.form.get('remittance_company', ''))
+    result = {
+        'success': True,
+        'row_count': len(rows),
+        'imported_count': len(rows) - len(unmatched),
+        'unmatched': unmatched,
+    }
+    if warning_message:
+        result['warning'] = warning_message
+    
+    if request.form.get('dry_run') == '1' or not new_payments:
+        result['payments'] = [
+            {'payment_date': p['payment_date'], 'remittance_company': p['remittance_company'],
+             'item_count': len(p['items']),
+             'total_amount': PaymentColumns.from_items(p['items']).total()}
+            for p in new_payments
+        ]
+        return jsonify(result)
+    
+    # 全支払表をまとめて1回で保存する（支払表ごとにファイルを書き直さない）
+    payments = load_payments()
+    duplicate_index.sync(payments_state_file(), lambda: payments, lambda: vendors)
+    base_id = datetime.now().strftime('%Y%m%d_%H%M%S')
+    existing_ids = {payment['id'] for payment in payments}
+    created_at = datetime.now().isoformat()
+    duplicate_count = 0
+    for number, payment_data in enumerate(new_payments, 1):
+        payment_id = base_id if len(new_payments) == 1 else f"{base_id}_{number:03d}"
+        while payment_id in existing_ids:
+            payment_id += '_1'
+        existing_ids.add(payment_id)
+        payment_data.update({'id': payment_id, 'created_at': created_at})
+        snapshot_payment_accounts(payment_data, vendors)
+        duplicate_count += len(duplicate_index.find(payment_data))
+    
+    append_payments(new_payments)
+    for payment_data in new_payments:
+        duplicate_index.add_payment(payment_data, payments_state_file())
+        event_stream.publish('payment_created', payment_event_data(payment_data))
+    
+    result['payments'] = [payment_event_data(payment_data) for payment_data in new_payments]
+    result['duplicate_count'] = duplicate_count
+    if duplicate_count:
+        result['duplicate_warning'] = f'同じ支払日・振込先・金額の支払いが既存の支払表に{duplicate_count}件あります'
+    return jsonify(result)
+
+@bp.route('/api/payments/duplicates', methods=['POST'])
+def check_payment_duplicates():
+    """支払表の明細のうち、同じ支払日・振込先口座・金額の支払いが既存の支払表にあるものを取得
+
+    {"payment_date": ..., "items": [...]} で作成前の明細を、{"payment_id": ...} で保存済みの支払表を確認する
+    """
+    data = request.json or {}
+    payment_id = data.get('payment_id')
+    if payment_id:
+        payment = next((p for p in load_payments() if p['id'] == payment_id), None)
+        if payment is None:
+            return jsonify({'error': '支払データが見つかりません'}), 404
+    elif data.get('payment_date') and isinstance(data.get('items'), list):
+        payment = {'payment_date': data['payment_date'], 'items': data['items']}
+    else:
+        return jsonify({'error': 'payment_id または payment_date と items を指定してください'}), 400
+    
+    duplicate_index.sync(payments_state_file(), load_payments, load_vendors)
+    # 作成前の明細（スナップショットなし）は業者マスターから振込先口座を求める
+    vendor_map = {}
+    if any('recipient' not in item for item in payment['items']):
+        vendor_map = {v['id']: v for v in load_vendors()}
+    duplicates = duplicate_index.find(payment, vendor_map, exclude_payment_id=payment_id)
+    return jsonify({'duplicate_count': len(duplicates), 'duplicates': duplicates})
+
+@bp.route('/api/payments/<payment_id>/pdf')
 def download_payment_pdf(payment_id):
     """支払表PDFをダウンロード"""
     pdf_filename = f"payment_list_{payment_id}.pdf"
     pdf_path = os.path.join('temp', pdf_filename)
     
     if os.path.exists(pdf_path):
-        return send_file(pdf_path, as_attachment=True, download_name=pdf_filename)
+        return send_file(os.path.abspath(pdf_path), as_attachment=True, download_name=pdf_filename)
     else:
         # PDFが存在しない場合は再生成を試みる
         payments = load_payments()
@@ -864,22 +878,25 @@ def download_payment_pdf(payment_id):
                 break
         
         if payment_data:
-            vendors = load_vendors()
             try:
-                pdf_path = generate_payment_pdf(payment_data, vendors)
-                return send_file(pdf_path, as_attachment=True, download_name=pdf_filename)
+                pdf_path = worker_pool.run(payment_exports.generate_payment_pdf, payment_data,
+                                           select_payment_vendors(payment_data))
+                event_stream.publish('pdf_ready', {'payment_id': payment_id})
+                return send_file(os.path.abspath(pdf_path), as_attachment=True, download_name=pdf_filename)
+            except (WorkerPoolBusy, WorkerPoolTimeout):
+                raise
             except Exception as e:
                 return jsonify({'error': f'PDF生成エラー: {str(e)}'}), 500
         else:
             return jsonify({'error': '支払データが見つかりません'}), 404
 
-@app.route('/api/upload-files', methods=['GET'])
+@bp.route('/api/upload-files', methods=['GET'])
 def get_upload_files():
     """アップロードファイル一覧を取得"""
     files = get_uploaded_files()
     return jsonify(files)
 
-@app.route('/api/upload-file', methods=['POST'])
+@bp.route('/api/upload-file', methods=['POST'])
 def upload_file():
     """ファイルアップロード"""
     if 'file' not in request.files:
@@ -890,27 +907,58 @@ def upload_file():
         return jsonify({'error': 'ファイルが選択されていません'}), 400
     
     if file and allowed_file(file.filename):
-        filename = secure_filename(file.filename)
-        # 同名ファイルがある場合はタイムスタンプを付加
-        if os.path.exists(os.path.join(UPLOAD_FOLDER, filename)):
-            name, ext = os.path.splitext(filename)
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            filename = f"{name}_{timestamp}{ext}"
+        # 内容のハッシュを計算し、同じ内容のファイルがあれば保存せずにそのファイルを使う
+        temp_path, digest = upload_cache.receive(file)
+        duplicate_filename = upload_cache.find_file(digest, os.path.getsize(temp_path))
+        if duplicate_filename:
+            os.remove(temp_path)
+            filename = duplicate_filename
+        else:
+            filename = secure_filename(file.filename)
+            # 同名ファイルがある場合はタイムスタンプを付加
+            if os.path.exists(os.path.join(UPLOAD_FOLDER, filename)):
+                name, ext = os.path.splitext(filename)
+                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+                filename = f"{name}_{timestamp}{ext}"
+            os.replace(temp_path, os.path.join(UPLOAD_FOLDER, filename))
         
         filepath = os.path.join(UPLOAD_FOLDER, filename)
-        file.save(filepath)
         
-        # ファイルを処理して業者データに変換
-        vendors, message = process_uploaded_file(filepath)
-        
-        if vendors is None:
-            # エラーがある場合はファイルを削除
-            os.remove(filepath)
-            return jsonify({'error': message}), 400
+        # ファイルを処理して業者データに変換（同じ内容のファイルの読み込み結果があればそれを使う）
+        bank_revision = bank_master.revision()
+        cached = upload_cache.get(digest, bank_revision)
+        if cached:
+            vendors, message = cached
+        else:
+            vendors, message = process_uploaded_file(filepath)
+            
+            if vendors is None:
+                # エラーがある場合はファイルを削除
+                if not duplicate_filename:
+                    os.remove(filepath)
+                return jsonify({'error': message}), 400
+            upload_cache.put(digest, bank_revision, vendors, message)
+        if not duplicate_filename:
+            upload_cache.record_file(digest, filename)
         
         # 既存の業者データを読み込み
         existing_vendors = load_vendors()
         
+        imported = [v for v in existing_vendors if v.get('upload_source') == filename]
+        if duplicate_filename and len(imported) == len(vendors):
+            # 同じ内容のファイルの業者データが読み込み済みの場合は何もしない
+            upload_cache.note_duplicate()
+            return jsonify({
+                'success': True,
+                'filename': filename,
+                'vendor_count': len(imported),
+                'duplicate': True,
+                'message': f'同じ内容のファイル（{filename}）は読み込み済みです（{len(imported)}件）',
+                'validation_errors': [
+                    issue for issue in transfer_validator.validate_vendors(imported) if issue['severity'] == 'error'
+                ]
+            })
+        
         # 同じファイルからの既存データのみを削除（重複を避けるため）
         existing_vendors = [v for v in existing_vendors if v.get('upload_source') != filename]
         
@@ -922,6 +970,8 @@ def upload_file():
         # 新しいデータを追加
         all_vendors = existing_vendors + vendors
         save_vendors(all_vendors)
+        if not duplicate_filename:
+            event_stream.publish('files_changed', {'files': get_uploaded_files()})
         
         # 成功メッセージを作成（警告がある場合は含める）
         success_message = f'{len(vendors)}件の業者データを読み込みました'
@@ -932,12 +982,16 @@ def upload_file():
             'success': True,
             'filename': filename,
             'vendor_count': len(vendors),
-            'message': success_message
+            'duplicate': bool(duplicate_filename),
+            'message': success_message,
+            'validation_errors': [
+                issue for issue in transfer_validator.validate_vendors(vendors) if issue['severity'] == 'error'
+            ]
         })
     
     return jsonify({'error': '許可されていないファイル形式です'}), 400
 
-@app.route('/api/delete-file/<filename>', methods=['DELETE'])
+@bp.route('/api/delete-file/<filename>', methods=['DELETE'])
 def delete_file(filename):
     """アップロードファイルを削除"""
     filepath = os.path.join(UPLOAD_FOLDER, secure_filename(filename))
@@ -954,6 +1008,7 @@ def delete_file(filename):
             vendor['id'] = i + 1
         
         save_vendors(filtered_vendors)
+        event_stream.publish('files_changed', {'files': get_uploaded_files()})
         
         return jsonify({
             'success': True,
@@ -962,213 +1017,210 @@ def delete_file(filename):
     
     return jsonify({'error': 'ファイルが見つかりません'}), 404
 
-@app.route('/api/payments/<payment_id>/transfer', methods=['GET'])
-def generate_transfer_file(payment_id):
+def has_account_snapshots(payment):
+    """送金会社・全明細の受取人の口座情報のスナップショットがあるか（作成時に保存したものか）"""
+    return 'remitter' in payment and all('recipient' in item for item in payment['items'])
+
+def load_transfer_context(payment_id):
+    """振込ファイル出力に必要なデータを取得（支払表, 業者マップ, 送金会社）"""
     # 支払表データを取得
     payments = load_payments()
     payment = next((p for p in payments if p['id'] == payment_id), None)
     
     if not payment:
-        return jsonify({'error': '支払表が見つかりません'}), 404
+        return None
+    
+    # 作成時の口座情報のスナップショットがあれば業者マスターを読み込まない
+    if has_account_snapshots(payment):
+        return payment, {}, payment['remitter']
     
     # 業者データを取得
     vendors = load_vendors()
     vendor_map = {v['id']: v for v in vendors}
     
     # 送金会社データを取得
-    companies = load_companies()
+    companies = load_companies(vendors)
     company_map = {c['name']: c for c in companies}
     
     # 選択された送金会社の情報を取得
-    selected_company = company_map.get(payment['remittance_company'])
-    if not selected_company:
-        # デフォルトの送金会社情報を使用
-        selected_company = {
-            "bank_code": "0177",
-            "bank_name": "フクオカギンコウ",
-            "branch_code": "001",
-            "branch_name": "ホンテン",
-            "account_type": 1,
-            "account_number": "0000000",
-            "client_code": "0000000000"
-        }
+    return payment, vendor_map, company_map.get(payment['remittance_company'])
+
+def build_transfer_file(payment_id, transfer_format=None, context=None, force=False):
+    """総合振込ファイルをShift-JISバイト列で生成（内容, 出力形式, フィールド変換レポート, エラー）
+    組み立てはワーカープール（別プロセス）で実行する
+    数字項目の桁あふれはエラーとする（force=True の場合は出力）"""
+    if context is None:
+        context = load_transfer_context(payment_id)
+    if context is None:
+        return None, None, [], '支払表が見つかりません'
+    
+    # 別プロセスへ渡すデータを支払表で使用する業者に絞る
+    payment, vendor_map, selected_company = context
+    used_vendors = {item['vendor_id']: vendor_map[item['vendor_id']]
+                    for item in payment['items']
+                    if 'recipient' not in item and item['vendor_id'] in vendor_map}
+    return worker_pool.run(payment_exports.build_transfer_file, payment_id, transfer_format,
+                           (payment, used_vendors, selected_company), force)
+
+def has_overflow(rejections):
+    """フィールド変換レポートに数字項目の桁あふれがあるか"""
+    return any(rejection['reason'] == 'overflow' for rejection in rejections)
+
+@bp.route('/api/payments/<payment_id>/transfer', methods=['GET'])
+def generate_transfer_file(payment_id):
+    """総合振込ファイルをダウンロード（?format=csv|fixed|fixed_crlf で形式を指定可能）"""
+    context = load_transfer_context(payment_id)
+    if context is None:
+        return jsonify({'error': '支払表が見つかりません'}), 404
     
-    # 振込データの準備
-    transfer_data = []
-    total_amount = 0
-    
-    for item in payment['items']:
-        vendor = vendor_map.get(item['vendor_id'])
-        if vendor:
-            # マスターデータから取得される時点でのaccount_holderをデバッグ出力
-            with open('debug.log', 'a', encoding='shift_jis', errors='replace') as f:
-                f.write(f"DEBUG: マスターデータから取得 - vendor_id: {item['vendor_id']}, account_holder: '{vendor['account_holder']}'\n")
-            print(f"DEBUG: マスターデータから取得 - vendor_id: {item['vendor_id']}, account_holder: '{vendor['account_holder']}'")
-            
-            transfer_data.append({
-                'bank_code': vendor.get('bank_code', '0000'),
-                'bank_name': vendor['bank_name'],
-                'branch_code': vendor.get('branch_code', '000'),
-                'branch_name': vendor['branch_name'],
-                'account_type': vendor.get('account_type', 1),
-                'account_number': vendor['account_number'],
-                'account_holder': vendor['account_holder'],
-                'amount': item['amount']
-            })
-            total_amount += item['amount']
+    # 出力前に振込データを検証（?force=1 の場合はエラーがあっても出力）
+    force = request.args.get('force') == '1'
+    validation = transfer_validator.validate_payment(*context)
+    if not validation['valid'] and not force:
+        return jsonify({'error': '振込データに不備があります', 'validation': validation}), 422
     
-    # 同一口座番号の項目を合算（銀行システムエラー回避のため）
-    consolidated_data = {}
-    for data in transfer_data:
-        # 口座を一意に識別するキー（銀行コード+支店コード+口座番号）
-        account_key = f"{data['bank_code']}-{data['branch_code']}-{data['account_number']}"
-        
-        if account_key in consolidated_data:
-            # 既存の口座がある場合は金額を合算
-            consolidated_data[account_key]['amount'] += data['amount']
-            print(f"DEBUG: 口座番号合算 - {account_key}: {consolidated_data[account_key]['amount']}円")
-        else:
-            # 新しい口座の場合はそのまま追加
-            consolidated_data[account_key] = data.copy()
-            print(f"DEBUG: 新規口座追加 - {account_key}: {data['amount']}円")
-    
-    # 合算後のデータをリストに変換
-    transfer_data = list(consolidated_data.values())
-    print(f"DEBUG: 合算前項目数: {len(payment['items'])}, 合算後項目数: {len(transfer_data)}")
-    
-    # 銀行振込ファイル仕様に準拠したCSV生成
-    output = io.StringIO()
-    
-    # 取組日（MMDD形式）
-    payment_date = datetime.strptime(payment['payment_date'], '%Y-%m-%d')
-    toritsuke_date = payment_date.strftime('%m%d')
-    
-    # ヘッダーレコード（データ区分：1）
-    # 委託者名をマスターデータのI列（account_holder）から取得し、半角カナに変換
-    remittance_company_kana = ''
-    if selected_company and selected_company.get('account_holder'):
-        remittance_company_kana = to_halfwidth_kana(selected_company['account_holder'])
-    
-    if not remittance_company_kana.strip():  # 変換後が空の場合はデフォルト値
-        remittance_company_kana = 'イライシャ'
-    
-    header_record = [
-        '1',  # データ区分
-        '21',  # 種別コード（総合振込）
-        '0',  # コード区分（JISコード）
-        selected_company.get('client_code', '0000000000').zfill(10),  # 委託者コード（10桁）
-        remittance_company_kana.ljust(40)[:40],  # 委託者名（40桁・半角カナ）
-        toritsuke_date,  # 取組日（MMDD）
-        selected_company.get('bank_code', '0177').zfill(4),  # 仕向銀行番号
-        to_halfwidth_kana(selected_company.get('bank_name', 'フクオカギンコウ')).ljust(15)[:15],  # 仕向銀行名（15桁・半角カナ）
-        selected_company.get('branch_code', '001').zfill(3),  # 仕向支店番号（3桁）
-        to_halfwidth_kana(selected_company.get('branch_name', 'ホンテン')).ljust(15)[:15],  # 仕向支店名（15桁・半角カナ）
-        str(selected_company.get('account_type', 1)),  # 預金種目
-        to_halfwidth_alphanumeric(selected_company.get('account_number', '0000000')).zfill(7),  # 口座番号（7桁・半角数字）
-        ' ' * 17  # ダミー（17桁）
-    ]
-    output.write(','.join(header_record) + '\r\n')
-    
-    # データレコード（データ区分：2）
-    for data in transfer_data:
-        # 受取人名を半角カナに変換
-        with open('debug.log', 'a', encoding='shift_jis', errors='replace') as f:
-            f.write(f"DEBUG: 元の受取人名: '{data['account_holder']}'\n")
-        print(f"DEBUG: 元の受取人名: '{data['account_holder']}'")
-        account_holder_kana = to_halfwidth_kana(data['account_holder'])
-        with open('debug.log', 'a', encoding='shift_jis', errors='replace') as f:
-            f.write(f"DEBUG: 変換後の受取人名: '{account_holder_kana}'\n")
-        print(f"DEBUG: 変換後の受取人名: '{account_holder_kana}'")
-        if not account_holder_kana.strip():  # 変換後が空の場合はデフォルト値
-            account_holder_kana = 'ウケトリニン'
-            with open('debug.log', 'a', encoding='shift_jis', errors='replace') as f:
-                f.write(f"DEBUG: デフォルト値を使用: '{account_holder_kana}'\n")
-            print(f"DEBUG: デフォルト値を使用: '{account_holder_kana}'")
-        
-        # 銀行コード・支店コードを半角数字に変換し、必須でない場合は0で埋める
-        bank_code = to_halfwidth_alphanumeric(str(data.get('bank_code', '0000'))).zfill(4)
-        branch_code = to_halfwidth_alphanumeric(str(data.get('branch_code', '000'))).zfill(3)
-        account_number = to_halfwidth_alphanumeric(str(data.get('account_number', '0000000'))).zfill(7)
-        
-        # 銀行名・支店名を半角カナに変換
-        bank_name_kana = to_halfwidth_kana(data.get('bank_name', 'ギンコウ'))
-        branch_name_kana = to_halfwidth_kana(data.get('branch_name', 'シテン'))
-        
-        # 最終的な受取人名をデバッグ出力
-        final_account_holder = account_holder_kana.ljust(30)[:30]
-        print(f"DEBUG: 最終的な受取人名(30桁): '{final_account_holder}'")
-        
-        data_record = [
-            '2',  # データ区分
-            bank_code,  # 被仕向銀行番号（4桁・半角数字）
-            bank_name_kana.ljust(15)[:15],  # 被仕向銀行名（15桁・半角カナ）
-            branch_code,  # 被仕向支店番号（3桁・半角数字）
-            branch_name_kana.ljust(15)[:15],  # 被仕向支店名（15桁・半角カナ）
-            '0000',  # 手形交換所番号（未使用・半角数字）
-            str(data.get('account_type', 1)),  # 預金種目（半角数字）
-            account_number,  # 口座番号（7桁・半角数字）
-            final_account_holder,  # 受取人名（30桁・半角カナ）
-            str(data['amount']).zfill(10),  # 振込金額（10桁・半角数字）
-            ' ',  # 新規コード（未使用・半角スペース）
-            ' ' * 10,  # 顧客コード1（10桁・半角スペース）
-            ' ' * 10,  # 顧客コード2（10桁・半角スペース）
-            '7',  # 振込区分（電信振込・半角数字）
-            ' ',  # 識別表示（半角スペース）
-            ' ' * 7  # ダミー（7桁・半角スペース）
-        ]
-        output.write(','.join(data_record) + '\r\n')
-    
-    # トレーラレコード（データ区分：8）
-    trailer_record = [
-        '8',  # データ区分
-        str(len(transfer_data)).zfill(6),  # 合計件数（6桁）
-        str(total_amount).zfill(12),  # 合計金額（12桁）
-        ' ' * 101  # ダミー（101桁）
-    ]
-    output.write(','.join(trailer_record) + '\r\n')
-    
-    # エンドレコード（データ区分：9）
-    end_record = [
-        '9',  # データ区分
-        ' ' * 119  # ダミー（119桁）
-    ]
-    output.write(','.join(end_record) + '\r\n')
+    encoded_content, transfer_format, rejections, error = build_transfer_file(
+        payment_id, request.args.get('format'), context, force
+    )
+    if error:
+        # 数字項目の桁あふれは422、支払表が見つからない場合は404、出力形式の指定誤りは400
+        if has_overflow(rejections):
+            return jsonify({'error': error, 'rejections': rejections}), 422
+        return jsonify({'error': error}), 404 if transfer_format is None else 400
+    
+    if transfer_format == 'csv':
+        response = send_file(
+            io.BytesIO(encoded_content),
+            mimetype='text/csv',
+            as_attachment=True,
+            download_name=f"transfer_{payment_id}.csv"
+        )
+    else:
+        response = Response(encoded_content, mimetype='application/octet-stream')
+        response.headers['Content-Disposition'] = f'attachment; filename=transfer_{payment_id}.txt'
+    response.headers['X-Transfer-Rejections'] = str(len(rejections))
+    return response
+
+@bp.route('/api/payments/<payment_id>/validate', methods=['GET'])
+def validate_payment_transfer(payment_id):
+    """支払表の振込データを検証"""
+    context = load_transfer_context(payment_id)
+    if context is None:
+        return jsonify({'error': '支払表が見つかりません'}), 404
     
-    # ファイルを返す
-    output.seek(0)
-    filename = f"transfer_{payment_id}.csv"
+    return jsonify(transfer_validator.validate_payment(*context))
+
+@bp.route('/api/payments/validate', methods=['POST'])
+def validate_payments_batch():
+    """複数の支払表の振込データを一括検証（payment_ids未指定の場合は全件）"""
+    data = request.json or {}
+    payment_ids = data.get('payment_ids')
     
-    # Shift-JISエンコードとCR+LF改行コードで出力
-    csv_content = output.getvalue()
+    payments = load_payments()
+    if payment_ids is not None:
+        payment_ids = set(payment_ids)
+        payments = [p for p in payments if p['id'] in payment_ids]
     
-    # デバッグ用：変換結果をログ出力
-    print(f"DEBUG: CSVコンテンツの一部: {csv_content[:200]}")
+    # 口座情報のスナップショットがない（古い）支払表がある場合のみ業者マスターを読み込む
+    vendor_map, company_map = {}, {}
+    if not all(has_account_snapshots(p) for p in payments):
+        vendors = load_vendors()
+        vendor_map = {v['id']: v for v in vendors}
+        company_map = {c['name']: c for c in load_companies(vendors)}
+    
+    results = [
+        transfer_validator.validate_payment(
+            p, vendor_map, p['remitter'] if has_account_snapshots(p) else company_map.get(p['remittance_company'])
+        )
+        for p in payments
+    ]
     
-    # 半角カナがShift-JISで正しくエンコードされるように処理
-    try:
-        # まず通常のエンコードを試行
-        encoded_content = csv_content.encode('shift_jis')
-        print("DEBUG: Shift-JISエンコード成功")
-    except UnicodeEncodeError as e:
-        print(f"DEBUG: エンコードエラー: {e}")
-        # エンコードできない文字を半角スペースに置換
-        safe_content = ''
-        for char in csv_content:
-            try:
-                char.encode('shift_jis')
-                safe_content += char
-            except UnicodeEncodeError:
-                safe_content += ' '  # 半角スペースに置換
-        encoded_content = safe_content.encode('shift_jis')
-    
-    return send_file(
-        io.BytesIO(encoded_content),
-        mimetype='text/csv',
-        as_attachment=True,
-        download_name=filename
+    return jsonify({
+        'valid': all(r['valid'] for r in results),
+        'error_count': sum(r['error_count'] for r in results),
+        'warning_count': sum(r['warning_count'] for r in results),
+        'results': results
+    })
+
+@bp.route('/api/payments/<payment_id>/transfer/report', methods=['GET'])
+def transfer_file_report(payment_id):
+    """総合振込ファイルのフィールド変換レポートを取得（桁あふれも含めて一覧にする）"""
+    encoded_content, transfer_format, rejections, error = build_transfer_file(
+        payment_id, request.args.get('format'), force=True
     )
+    if error:
+        return jsonify({'error': error}), 404 if transfer_format is None else 400
+    
+    return jsonify({
+        'payment_id': payment_id,
+        'transfer_format': transfer_format,
+        'byte_size': len(encoded_content),
+        'overflow': has_overflow(rejections),
+        'rejection_count': len(rejections),
+        'rejections': rejections
+    })
 
-@app.route('/api/backup/create', methods=['POST'])
+@bp.route('/api/events')
+def events():
+    """変更通知（Server-Sent Events）。再接続時は Last-Event-ID 以降の通知を送る"""
+    if not event_stream.enabled:
+        return jsonify({'error': '変更通知は無効です'}), 404
+    last_id = request.headers.get('Last-Event-ID', request.args.get('last_event_id'))
+    try:
+        last_id = int(last_id) if last_id else None
+    except ValueError:
+        last_id = None
+    try:
+        stream = event_stream.open(last_id)
+    except EventStreamFull:
+        # ブラウザは時間をおいて再接続し、それまでは一覧を再取得して更新する
+        response = jsonify({'error': '接続数が上限に達しています'})
+        response.status_code = 503
+        response.headers['Retry-After'] = '30'
+        return response
+    
+    response = Response(stream, mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # リバースプロキシでのバッファリングを無効化
+    return response
+
+@bp.route('/api/health')
+def health():
+    """稼働確認（データファイルを読まずに応答し、ウォームアップの状況を返す）"""
+    return jsonify({'status': 'ok', 'warmup': warmup.status(), 'worker_pool': worker_pool.status(),
+                    'events': event_stream.status()})
+
+@bp.route('/metrics')
+def metrics_endpoint():
+    """計測値をPrometheusテキスト形式で出力（METRICS_ENABLED=1 の場合のみ）"""
+    if not metrics.enabled:
+        return jsonify({'error': 'メトリクスは無効です（METRICS_ENABLED=1 で有効化）'}), 404
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+@bp.route('/api/profiles', methods=['GET'])
+def list_profiles():
+    """保存済みプロファイル一覧（管理者トークンが必要）"""
+    if not request_profiler.is_admin():
+        return jsonify({'error': '管理者トークンが必要です'}), 403
+    return jsonify({
+        'profiles': request_profiler.list_profiles(),
+        'max_profiles': request_profiler.max_profiles,
+        'slow_ms': request_profiler.slow_ms
+    })
+
+@bp.route('/api/profiles/<profile_id>', methods=['GET'])
+def download_profile(profile_id):
+    """プロファイルのダウンロード（?format=text で cProfile の集計結果をテキスト表示）"""
+    if not request_profiler.is_admin():
+        return jsonify({'error': '管理者トークンが必要です'}), 403
+    meta, path = request_profiler.get_profile(profile_id)
+    if not meta or not os.path.exists(path):
+        return jsonify({'error': 'プロファイルが見つかりません'}), 404
+    if request.args.get('format') == 'text' and meta['kind'] == 'cprofile':
+        return Response(request_profiler.render_text(path), mimetype='text/plain; charset=utf-8')
+    return send_file(path, as_attachment=True, download_name=meta['file'])
+
+@bp.route('/api/backup/create', methods=['POST'])
 def create_manual_backup():
     """手動バックアップ作成"""
     try:
@@ -1192,7 +1244,7 @@ def create_manual_backup():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/api/backup/restore', methods=['POST'])
+@bp.route('/api/backup/restore', methods=['POST'])
 def restore_manual_backup():
     """手動バックアップから復元"""
     try:
@@ -1206,6 +1258,7 @@ def restore_manual_backup():
         if restored_vendors:
             save_vendors(restored_vendors)
         
+        event_stream.publish('reset', {'reason': 'restore'})
         return jsonify({
             'success': True,
             'message': 'バックアップから復元しました',
@@ -1215,46 +1268,258 @@ def restore_manual_backup():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/api/backup/status', methods=['GET'])
+# バックアップ系列と復元先のデータ
+BACKUP_SERIES_TARGETS = {
+    'payments': 'payments',
+    'manual_payments': 'payments',
+    'manual_vendors': 'vendors',
+}
+
+def summarize_backup_record(record, target):
+    """バックアップ比較用のレコード概要"""
+    if target == 'payments':
+        items = record.get('items', [])
+        return {
+            'id': record.get('id'),
+            'payment_date': record.get('payment_date'),
+            'remittance_company': record.get('remittance_company'),
+            'item_count': len(items),
+            'total_amount': PaymentColumns.from_items(items, strict=False).total()
+        }
+    return {'id': record.get('id'), 'name': record.get('name')}
+
+def resolve_backup_point(series, data):
+    """リクエストの entry_id / timestamp からバックアップの位置を取得（位置, エラー, ステータスコード）"""
+    if series not in BACKUP_SERIES_TARGETS:
+        return None, f'未対応のバックアップ系列です: {series}', 400
+    try:
+        position = persistence_manager.find_entry(series, timestamp=data.get('timestamp'), entry_id=data.get('entry_id'))
+    except ValueError:
+        return None, '日時の形式が不正です（例: 2025-01-31T17:00:00）', 400
+    if position is None:
+        return None, '指定した時点のバックアップが見つかりません', 404
+    return position, None, 200
+
+@bp.route('/api/backup/history', methods=['GET'])
+def backup_history():
+    """バックアップ履歴（件数・合計金額・日時）をインデックスから取得"""
+    series = request.args.get('series', 'payments')
+    if series not in BACKUP_SERIES_TARGETS:
+        return jsonify({'error': f'未対応のバックアップ系列です: {series}'}), 400
+    entries = persistence_manager.list_entries(series)
+    return jsonify({
+        'series': series,
+        'available_series': [name for name in persistence_manager.list_series() if name in BACKUP_SERIES_TARGETS],
+        'entries': [{
+            'entry_id': entry['id'],
+            'timestamp': entry['timestamp'],
+            'kind': entry['kind'],
+            'count': entry.get('count'),
+            'total_amount': entry.get('total_amount'),
+            'size': entry['size']
+        } for entry in reversed(entries)]
+    })
+
+@bp.route('/api/backup/history/preview', methods=['GET'])
+def backup_history_preview():
+    """指定時点のバックアップと現在のデータの差分（復元した場合の変更内容）"""
+    series = request.args.get('series', 'payments')
+    position, error, status = resolve_backup_point(series, request.args)
+    if error:
+        return jsonify({'error': error}), status
+    target = BACKUP_SERIES_TARGETS[series]
+    entry = persistence_manager.list_entries(series)[position]
+    backup_data = persistence_manager.load_entry(series, position)
+    current_data = load_payments() if target == 'payments' else load_vendors()
+    
+    current_map = {str(record.get('id')): record for record in current_data}
+    backup_map = {str(record.get('id')): record for record in backup_data}
+    added = [summarize_backup_record(record, target) for key, record in backup_map.items() if key not in current_map]
+    removed = [summarize_backup_record(record, target) for key, record in current_map.items() if key not in backup_map]
+    changed = [
+        {'current': summarize_backup_record(current_map[key], target), 'backup': summarize_backup_record(record, target)}
+        for key, record in backup_map.items()
+        if key in current_map and current_map[key] != record
+    ]
+    return jsonify({
+        'series': series,
+        'entry_id': entry['id'],
+        'timestamp': entry['timestamp'],
+        'backup_count': len(backup_data),
+        'current_count': len(current_data),
+        'added': added,
+        'removed': removed,
+        'changed': changed,
+        'unchanged_count': len(backup_map) - len(added) - len(changed)
+    })
+
+@bp.route('/api/backup/history/restore', methods=['POST'])
+def restore_backup_point():
+    """指定時点のバックアップから復元（payment_id 指定時はその支払表のみ）"""
+    try:
+        data = request.get_json(silent=True) or {}
+        series = data.get('series', 'payments')
+        position, error, status = resolve_backup_point(series, data)
+        if error:
+            return jsonify({'success': False, 'error': error}), status
+        target = BACKUP_SERIES_TARGETS[series]
+        entry = persistence_manager.list_entries(series)[position]
+        
+        # 現在のデータを先にバックアップに反映し、復元を取り消せるようにする
+        backup_scheduler.flush()
+        
+        payment_id = data.get('payment_id')
+        if payment_id is not None:
+            if target != 'payments':
+                return jsonify({'success': False, 'error': '支払表単位の復元は支払データのみ対応しています'}), 400
+            record = persistence_manager.find_record(series, position, payment_id)
+            if record is None:
+                return jsonify({'success': False, 'error': '指定した時点にその支払表はありません'}), 404
+            replace_payment(record)
+            event_stream.publish('reset', {'reason': 'restore'})
+            return jsonify({
+                'success': True,
+                'message': '支払表を復元しました',
+                'entry_id': entry['id'],
+                'timestamp': entry['timestamp'],
+                'payment_id': payment_id
+            })
+        
+        restored = persistence_manager.load_entry(series, position)
+        if target == 'payments':
+            save_payments(restored)
+        else:
+            save_vendors(restored)
+        event_stream.publish('reset', {'reason': 'restore'})
+        return jsonify({
+            'success': True,
+            'message': 'バックアップから復元しました',
+            'entry_id': entry['id'],
+            'timestamp': entry['timestamp'],
+            'restored_count': len(restored)
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@bp.route('/api/backup/archive', methods=['GET'])
+def download_backup_archive():
+    """バックアップアーカイブ（業者・支払・アップロードファイル）のダウンロード"""
+    archive_path = os.path.abspath(persistence_manager.archive_path)
+    if not os.path.exists(archive_path):
+        return jsonify({'error': 'アーカイブがまだ作成されていません'}), 404
+    return send_file(archive_path, as_attachment=True, download_name=os.path.basename(archive_path))
+
+@bp.route('/api/backup/archive/restore', methods=['POST'])
+def restore_backup_archive():
+    """バックアップアーカイブから復元（sections 未指定の場合はすべて）"""
+    try:
+        data = request.get_json(silent=True) or {}
+        sections = data.get('sections')
+        if not os.path.exists(persistence_manager.archive_path):
+            return jsonify({'success': False, 'error': 'アーカイブがまだ作成されていません'}), 404
+        restored = persistence_manager.restore_archive(sections)
+        if 'payments' in restored and payment_store.in_use():
+            # 分割保存の場合は復元した payments.json をここで取り込む（読み込み時には取り込まない）
+            payment_store.restore_file(PAYMENTS_FILE)
+        event_stream.publish('reset', {'reason': 'restore'})
+        return jsonify({
+            'success': True,
+            'message': 'アーカイブから復元しました',
+            'restored': restored
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@bp.route('/api/backup/status', methods=['GET'])
 def backup_status():
     """バックアップ状態確認"""
     try:
-        backup_dir = persistence_manager.backup_dir
-        backup_files = []
-        
-        if os.path.exists(backup_dir):
-            for filename in os.listdir(backup_dir):
-                if filename.endswith('.backup'):
-                    filepath = os.path.join(backup_dir, filename)
-                    stat = os.stat(filepath)
-                    backup_files.append({
-                        'filename': filename,
-                        'size': stat.st_size,
-                        'modified': datetime.fromtimestamp(stat.st_mtime).isoformat()
-                    })
+        # バックアップ一覧はインデックスから取得（ディレクトリは走査しない）
+        backup_files, series = persistence_manager.backup_status()
         
         return jsonify({
             'success': True,
             'backup_files': backup_files,
-            'backup_count': len(backup_files)
+            'backup_count': len(backup_files),
+            'series': series,
+            'scheduler': backup_scheduler.status(),
+            'archive': persistence_manager.archive_status(),
+            'payment_store': payment_store.status(),
+            'upload_cache': upload_cache.status()
         })
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
-if __name__ == '__main__':
-    import os
-    
-    # Render環境対応: 必要なディレクトリを作成
-    os.makedirs('uploads', exist_ok=True)
+@bp.errorhandler(WorkerPoolBusy)
+def handle_worker_pool_busy(e):
+    """PDF生成・振込ファイル出力の処理待ちが上限に達した場合は 503 で再試行を促す"""
+    response = jsonify({'error': str(e), 'retry_after': e.retry_after})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+@bp.errorhandler(WorkerPoolTimeout)
+def handle_worker_pool_timeout(e):
+    """PDF生成・振込ファイル出力が時間内に終わらなかった場合"""
+    return jsonify({'error': str(e)}), 504
+
+# 起動後のウォームアップ（待ち受け開始後にバックグラウンドで実行し、最初のリクエストを待たせない）
+def _warmup_pdf():
+    """ワーカープールのプロセス起動とCIDフォントの登録"""
+    worker_pool.prestart(payment_exports.warm_up)
+
+def _warmup_excel():
+    """openpyxlの読み込み"""
+    import openpyxl  # noqa: F401
+
+def _warmup_vendors():
+    """業者データの読み込みと検証結果キャッシュの作成"""
+    transfer_validator.validate_vendors(load_vendors())
+
+warmup.register('pdf', _warmup_pdf)
+warmup.register('excel', _warmup_excel)
+warmup.register('bank_master', bank_master.ensure_loaded)
+warmup.register('vendors', _warmup_vendors)
+warmup.register('assets', static_assets.build)
+warmup.register('payment_shards', payment_store.compact_cold)
+
+def prepare_data_files():
+    """必要なディレクトリとデータファイルを作成（Render環境対応）"""
+    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
     os.makedirs('static/pdfs', exist_ok=True)
     
     # データファイルの初期化確認
-    if not os.path.exists('vendors.json'):
+    if not os.path.exists(VENDORS_FILE):
         save_vendors([])
-    if not os.path.exists('payments.json'):
+    if payment_store.enabled and not payment_store.in_use():
+        storage_logger.warning('PAYMENT_SHARDS が指定されていますが、payments.json の分割保存への移行が確定していないため '
+                               'payments.json を使います（python payment_store.py migrate）')
+    elif not payment_store.enabled and payment_store.has_payments() and not os.path.exists(PAYMENTS_FILE):
+        storage_logger.warning('payment_shards/ に支払データがありますが PAYMENT_SHARDS=off のため使用しません')
+    if not os.path.exists(payments_state_file()) and not os.path.exists(PAYMENTS_FILE):
         save_payments([])
-    if not os.path.exists('companies.json'):
+    if not os.path.exists(COMPANIES_FILE):
         save_companies([])
+
+def create_app(config=None):
+    """Flaskアプリケーションを作成（gunicorn では wsgi.py から呼び出す）"""
+    flask_app = Flask(__name__)
+    flask_app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+    if config:
+        flask_app.config.update(config)
+    metrics.init_app(flask_app)  # METRICS_ENABLED=1 の場合のみ計測
+    request_profiler.init_app(flask_app)  # PROFILE_TOKEN / PROFILE_SLOW_MS 設定時のみ記録
+    warmup.init_app(flask_app)  # 起動時にウォームアップしていない場合は最初のリクエスト時に開始
+    static_assets.init_app(flask_app)  # ハッシュ付きURL・圧縮済みの静的ファイル配信（テンプレートの asset_url）
+    flask_app.register_blueprint(bp)
+    return flask_app
+
+# 開発用サーバー・ベンチマーク用のアプリケーション
+app = create_app()
+
+if __name__ == '__main__':
+    prepare_data_files()
     
     port = int(os.environ.get('PORT', 5000))
+    warmup.start()  # WARMUP=0 の場合は行わない
     app.run(host='0.0.0.0', port=port, debug=False)
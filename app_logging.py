@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+ログ出力ユーティリティ
+ログはキュー経由でバックグラウンドスレッドが debug.log（Shift_JIS）へ書き込むため、リクエスト処理を待たせない
+debug.log はサイズでローテーションし、モジュールごとのログレベルと変換トレースの間引きを環境変数で設定する
+
+環境変数:
+    LOG_LEVEL          全体のログレベル（既定: INFO）
+    LOG_LEVELS         モジュールごとのログレベル（例: kana=DEBUG,transfer=DEBUG）
+    LOG_CONSOLE_LEVEL  コンソール出力のログレベル（既定: WARNING）
+    LOG_FILE           ログファイル（既定: debug.log）
+    LOG_MAX_BYTES      ローテーションするサイズ（既定: 5MB）
+    LOG_BACKUP_COUNT   保持する世代数（既定: 5）
+    LOG_SAMPLE_EVERY   変換トレースを何件に1件出力するか（既定: 100）
+    LOG_SAMPLE_MAX_PER_SECOND  変換トレースの1秒あたりの最大出力件数（既定: 50）
+"""
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+ROOT_LOGGER = 'keiri'
+LOG_ENCODING = 'shift_jis'
+LOG_FORMAT = '%(asctime)s %(levelname)s %(name)s [%(threadName)s] %(message)s'
+
+# 件数が多く間引き対象となる変換トレースのロガー
+SAMPLED_LOGGERS = ('keiri.kana',)
+
+_QUEUE_SIZE = 10000
+
+
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def parse_levels(text):
+    """'kana=DEBUG,transfer=INFO' 形式のログレベル指定を解析"""
+    levels = {}
+    for entry in (text or '').split(','):
+        name, _, level = entry.partition('=')
+        name, level = name.strip(), level.strip().upper()
+        if name and level in logging._nameToLevel:
+            levels[name] = level
+    return levels
+
+
+class SamplingFilter(logging.Filter):
+    """変換トレース（DEBUG）を間引く（N件に1件・1秒あたり最大件数）。INFO以上は常に出力"""
+
+    def __init__(self, prefixes=SAMPLED_LOGGERS, every=100, max_per_second=50):
+        super().__init__()
+        self.prefixes = prefixes
+        self.every = max(1, every)
+        self.max_per_second = max_per_second
+        self._lock = threading.Lock()
+        self._counts = {}
+        self._window = 0
+        self._window_count = 0
+        self.dropped = 0
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or not record.name.startswith(self.prefixes):
+            return True
+        with self._lock:
+            count = self._counts.get(record.name, 0)
+            self._counts[record.name] = count + 1
+            if count % self.every:
+                self.dropped += 1
+                return False
+            now = int(time.monotonic())
+            if now != self._window:
+                self._window = now
+                self._window_count = 0
+            if self.max_per_second and self._window_count >= self.max_per_second:
+                self.dropped += 1
+                return False
+            self._window_count += 1
+        return True
+
+
+class _AsyncQueueHandler(logging.handlers.QueueHandler):
+    """ログレコードをキューに積むハンドラ（書式化はバックグラウンドスレッドで行う）"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # 引数は文字列・数値のみを渡す前提のため、書式化せずにそのまま渡す
+        if record.exc_info:
+            return super().prepare(record)
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # キューが溢れた場合は破棄（リクエスト処理を待たせない）
+            self.dropped += 1
+
+
+class LoggingManager:
+    """ログ出力の設定管理クラス"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queue = None
+        self._queue_handler = None
+        self._listener = None
+        self._handlers = []
+        self.sampling_filter = None
+
+    def setup(self):
+        """ロガーを設定しバックグラウンドの書き込みスレッドを開始（複数回呼んでも1回だけ設定）"""
+        with self._lock:
+            if self._queue_handler is not None:
+                return
+
+            formatter = logging.Formatter(LOG_FORMAT)
+            file_handler = logging.handlers.RotatingFileHandler(
+                os.environ.get('LOG_FILE', 'debug.log'),
+                maxBytes=_env_int('LOG_MAX_BYTES', 5 * 1024 * 1024),
+                backupCount=_env_int('LOG_BACKUP_COUNT', 5),
+                encoding=LOG_ENCODING,
+                errors='replace',
+                delay=True,
+            )
+            file_handler.setFormatter(formatter)
+            console_handler = logging.StreamHandler(sys.stderr)
+            console_handler.setLevel(os.environ.get('LOG_CONSOLE_LEVEL', 'WARNING').upper())
+            console_handler.setFormatter(formatter)
+            self._handlers = [file_handler, console_handler]
+
+            self._queue = queue.Queue(_QUEUE_SIZE)
+            self._queue_handler = _AsyncQueueHandler(self._queue)
+            self.sampling_filter = SamplingFilter(
+                every=_env_int('LOG_SAMPLE_EVERY', 100),
+                max_per_second=_env_int('LOG_SAMPLE_MAX_PER_SECOND', 50),
+            )
+            self._queue_handler.addFilter(self.sampling_filter)
+
+            root = logging.getLogger(ROOT_LOGGER)
+            root.setLevel(os.environ.get('LOG_LEVEL', 'INFO').upper())
+            root.addHandler(self._queue_handler)
+            root.propagate = False
+            for name, level in parse_levels(os.environ.get('LOG_LEVELS')).items():
+                logging.getLogger(f'{ROOT_LOGGER}.{name}').setLevel(level)
+
+            self._start_listener()
+            atexit.register(self.shutdown)
+            if hasattr(os, 'register_at_fork'):
+                # fork後の子プロセスには書き込みスレッドが引き継がれないため再開する
+                os.register_at_fork(after_in_child=self._restart_in_child)
+
+    def _start_listener(self):
+        self._listener = logging.handlers.QueueListener(
+            self._queue, *self._handlers, respect_handler_level=True
+        )
+        self._listener.start()
+
+    def _restart_in_child(self):
+        self._lock = threading.Lock()
+        if self._queue_handler is not None:
+            # 親プロセスのキューは待機中だった書き込みスレッドの状態を引き継いでおり、
+            # 子プロセスでは通知が届かないため新しいキューに置き換える
+            self._queue = queue.Queue(_QUEUE_SIZE)
+            self._queue_handler.queue = self._queue
+            self._start_listener()
+
+    def shutdown(self):
+        """未出力のログを書き出して書き込みスレッドを停止"""
+        listener, self._listener = self._listener, None
+        if listener is not None:
+            listener.stop()
+            for handler in self._handlers:
+                handler.flush()
+
+    def status(self):
+        """ログ出力の状態を取得"""
+        return {
+            'queued': self._queue.qsize() if self._queue else 0,
+            'dropped_queue_full': self._queue_handler.dropped if self._queue_handler else 0,
+            'dropped_sampling': self.sampling_filter.dropped if self.sampling_filter else 0,
+        }
+
+
+def get_logger(name):
+    """モジュール用のロガーを取得（例: get_logger('kana') -> keiri.kana）"""
+    return logging.getLogger(f'{ROOT_LOGGER}.{name}')
+
+
+# グローバルインスタンス
+logging_manager = LoggingManager()
@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+"""
+バックアップアーカイブ（業者・支払・アップロードファイルを1ファイルにまとめた圧縮形式）
+データは json の iterencode で少しずつ書き出しながら圧縮し、復元時も少しずつ展開してファイルへ書き込む
+セクションごとに SHA-256 を記録し、展開時に検証する
+
+ファイル構成:
+    ヘッダー    : MAGIC(8) + バージョン(1)
+    セクション  : b'S' + 名前長(2) + 名前 + 種別長(1) + 種別
+                  + 圧縮データのチャンク（長さ(4) + gzipデータ）の繰り返し + 終端(長さ0)
+                  + SHA-256(32) + 展開後サイズ(8)
+    マニフェスト: b'M' + 長さ(4) + JSON（セクションの一覧）
+    フッター    : マニフェストの位置(8) + END_MAGIC(8)
+
+使い方:
+    python backup_archive.py list backups/latest.kbak
+    python backup_archive.py verify backups/latest.kbak
+    python backup_archive.py extract backups/latest.kbak 出力先ディレクトリ
+"""
+import hashlib
+import io
+import json
+import os
+import struct
+import sys
+import zlib
+from datetime import datetime
+
+MAGIC = b'KEIRIBAK'
+END_MAGIC = b'KEIRIEND'
+VERSION = 1
+CHUNK_SIZE = 64 * 1024
+COMPRESS_LEVEL = 6
+
+_FOOTER = struct.Struct('>Q8s')
+_CHUNK = struct.Struct('>I')
+_TRAILER = struct.Struct('>32sQ')
+
+
+class ArchiveError(Exception):
+    """アーカイブの形式不正・チェックサム不一致"""
+
+
+def _json_chunks(data):
+    """データを JSON として少しずつ UTF-8 バイト列に変換"""
+    encoder = json.JSONEncoder(ensure_ascii=False, indent=2)
+    buffer = []
+    size = 0
+    for piece in encoder.iterencode(data):
+        encoded = piece.encode('utf-8')
+        buffer.append(encoded)
+        size += len(encoded)
+        if size >= CHUNK_SIZE:
+            yield b''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def _text_chunks(text):
+    """JSON化済みの文字列を少しずつ UTF-8 バイト列に変換"""
+    for start in range(0, len(text), CHUNK_SIZE):
+        yield text[start:start + CHUNK_SIZE].encode('utf-8')
+
+
+def _file_chunks(path):
+    """ファイルを少しずつ読み込み"""
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+
+def _write_section(out, name, kind, chunks):
+    """1セクションを圧縮して書き込み、マニフェスト用の情報を返す"""
+    offset = out.tell()
+    name_bytes = name.encode('utf-8')
+    kind_bytes = kind.encode('ascii')
+    out.write(b'S' + struct.pack('>H', len(name_bytes)) + name_bytes + struct.pack('>B', len(kind_bytes)) + kind_bytes)
+
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 31)  # gzip形式
+    digest = hashlib.sha256()
+    size = 0
+    compressed_size = 0
+    for chunk in chunks:
+        digest.update(chunk)
+        size += len(chunk)
+        compressed = compressor.compress(chunk)
+        if compressed:
+            out.write(_CHUNK.pack(len(compressed)) + compressed)
+            compressed_size += len(compressed)
+    compressed = compressor.flush()
+    if compressed:
+        out.write(_CHUNK.pack(len(compressed)) + compressed)
+        compressed_size += len(compressed)
+    out.write(_CHUNK.pack(0))
+    out.write(_TRAILER.pack(digest.digest(), size))
+    return {
+        'name': name,
+        'kind': kind,
+        'offset': offset,
+        'size': size,
+        'compressed_size': compressed_size,
+        'sha256': digest.hexdigest(),
+    }
+
+
+def write_archive(path, sections):
+    """アーカイブを作成（一時ファイルに書いてから置き換え）
+
+    sections: {'name': 名前, 'kind': 'json' または 'file', 以下のいずれか} の一覧
+              'data': データ（json の iterencode で書き出し）
+              'text': JSON化済みの文字列
+              'path': ファイルパス（そのまま書き出し）
+    """
+    tmp_path = path + '.tmp'
+    manifest = {'version': VERSION, 'created_at': datetime.now().isoformat(), 'sections': []}
+    with open(tmp_path, 'wb') as out:
+        out.write(MAGIC + struct.pack('>B', VERSION))
+        for section in sections:
+            if 'data' in section:
+                chunks = _json_chunks(section['data'])
+            elif 'text' in section:
+                chunks = _text_chunks(section['text'])
+            else:
+                chunks = _file_chunks(section['path'])
+            info = _write_section(out, section['name'], section['kind'], chunks)
+            if 'count' in section:
+                info['count'] = section['count']
+            elif isinstance(section.get('data'), list):
+                info['count'] = len(section['data'])
+            manifest['sections'].append(info)
+
+        manifest_offset = out.tell()
+        manifest_bytes = json.dumps(manifest, ensure_ascii=False).encode('utf-8')
+        out.write(b'M' + _CHUNK.pack(len(manifest_bytes)) + manifest_bytes)
+        out.write(_FOOTER.pack(manifest_offset, END_MAGIC))
+    os.replace(tmp_path, path)
+    return manifest
+
+
+class _SectionStream(io.RawIOBase):
+    """セクションの展開データを読み込むストリーム（読み終えた時点でチェックサムを検証）"""
+
+    def __init__(self, f, name):
+        self._f = f
+        self._name = name
+        self._decompressor = zlib.decompressobj(31)
+        self._digest = hashlib.sha256()
+        self._size = 0
+        self._buffer = b''
+        self._done = False
+
+    def readable(self):
+        return True
+
+    def _fill(self):
+        while not self._buffer and not self._done:
+            (length,) = _CHUNK.unpack(_read_exact(self._f, _CHUNK.size))
+            try:
+                if length:
+                    data = self._decompressor.decompress(_read_exact(self._f, length))
+                else:
+                    data = self._decompressor.flush()
+                    self._done = True
+            except zlib.error as e:
+                raise ArchiveError(f"圧縮データが壊れています: {self._name} ({e})")
+            self._digest.update(data)
+            self._size += len(data)
+            self._buffer = data
+            if self._done:
+                # 最後のチャンクを返す前にチェックサムを検証
+                expected_digest, expected_size = _TRAILER.unpack(_read_exact(self._f, _TRAILER.size))
+                if (self._digest.digest() != expected_digest or self._size != expected_size
+                        or not self._decompressor.eof):
+                    raise ArchiveError(f"チェックサムが一致しません: {self._name}")
+
+    def readinto(self, target):
+        self._fill()
+        length = min(len(target), len(self._buffer))
+        target[:length] = self._buffer[:length]
+        self._buffer = self._buffer[length:]
+        return length
+
+
+def member_path(dest, name):
+    """セクション名から展開先のパスを作成（展開先ディレクトリの外を指す名前は拒否）"""
+    path = os.path.normpath(os.path.join(dest, name))
+    if os.path.isabs(name) or os.path.relpath(path, dest).startswith(os.pardir):
+        raise ArchiveError(f"不正なセクション名です: {name}")
+    return path
+
+
+def _read_exact(f, length):
+    data = f.read(length)
+    if len(data) != length:
+        raise ArchiveError('アーカイブが途中で終わっています')
+    return data
+
+
+class ArchiveReader:
+    """アーカイブの読み込みクラス"""
+
+    def __init__(self, path):
+        self.path = path
+        self._f = open(path, 'rb')
+        if self._f.read(len(MAGIC)) != MAGIC:
+            self._f.close()
+            raise ArchiveError('バックアップアーカイブではありません')
+        self.manifest = self._read_manifest()
+
+    def _read_manifest(self):
+        self._f.seek(-_FOOTER.size, os.SEEK_END)
+        manifest_offset, end_magic = _FOOTER.unpack(_read_exact(self._f, _FOOTER.size))
+        if end_magic != END_MAGIC:
+            raise ArchiveError('アーカイブの終端が不正です（書き込み途中の可能性があります）')
+        self._f.seek(manifest_offset)
+        if self._f.read(1) != b'M':
+            raise ArchiveError('マニフェストが不正です')
+        (length,) = _CHUNK.unpack(_read_exact(self._f, _CHUNK.size))
+        return json.loads(_read_exact(self._f, length).decode('utf-8'))
+
+    def close(self):
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    @property
+    def sections(self):
+        return self.manifest['sections']
+
+    def find(self, name):
+        for section in self.sections:
+            if section['name'] == name:
+                return section
+        return None
+
+    def open_section(self, name):
+        """セクションの展開データを読み込むバイナリストリームを取得"""
+        section = self.find(name)
+        if section is None:
+            raise KeyError(name)
+        self._f.seek(section['offset'])
+        if self._f.read(1) != b'S':
+            raise ArchiveError(f"セクションが不正です: {name}")
+        (name_length,) = struct.unpack('>H', _read_exact(self._f, 2))
+        self._f.seek(name_length, os.SEEK_CUR)
+        (kind_length,) = struct.unpack('>B', _read_exact(self._f, 1))
+        self._f.seek(kind_length, os.SEEK_CUR)
+        return io.BufferedReader(_SectionStream(self._f, name), CHUNK_SIZE)
+
+    def load_json(self, name):
+        """JSONセクションを読み込み"""
+        with io.TextIOWrapper(self.open_section(name), encoding='utf-8') as stream:
+            return json.load(stream)
+
+    def extract(self, name, target_path):
+        """セクションをファイルへ展開（チェックサム検証後に置き換え）"""
+        os.makedirs(os.path.dirname(os.path.abspath(target_path)), exist_ok=True)
+        tmp_path = target_path + '.restore'
+        try:
+            with self.open_section(name) as stream, open(tmp_path, 'wb') as out:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    out.write(chunk)
+            os.replace(tmp_path, target_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def verify(self):
+        """全セクションのチェックサムを検証し、不一致のセクション名を返す"""
+        failed = []
+        for section in self.sections:
+            try:
+                with self.open_section(section['name']) as stream:
+                    while stream.read(CHUNK_SIZE):
+                        pass
+            except ArchiveError:
+                failed.append(section['name'])
+        return failed
+
+
+def main(argv):
+    if len(argv) < 3 or argv[1] not in ('list', 'verify', 'extract'):
+        print(__doc__)
+        return 1
+    command, path = argv[1], argv[2]
+    with ArchiveReader(path) as reader:
+        if command == 'list':
+            print(f"作成日時: {reader.manifest['created_at']}")
+            for section in reader.sections:
+                count = f" {section['count']}件" if 'count' in section else ''
+                print(f"{section['name']:<40} {section['kind']:<5} {section['size']:>12,}B "
+                      f"(圧縮後 {section['compressed_size']:,}B){count}")
+        elif command == 'verify':
+            failed = reader.verify()
+            print('チェックサム不一致: ' + ', '.join(failed) if failed else 'すべてのセクションが正常です')
+            return 1 if failed else 0
+        else:
+            dest = argv[3] if len(argv) > 3 else '.'
+            for section in reader.sections:
+                filename = section['name'] + ('.json' if section['kind'] == 'json' else '')
+                reader.extract(section['name'], member_path(dest, filename))
+                print(f"展開: {filename}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+バックアップのバックグラウンド実行ユーティリティ
+保存処理からはJSON化済みの文字列と保存したデータを受け取るだけにして、バックアップはバックグラウンドスレッドで実行する
+（文字列はアーカイブにそのまま使い、データは差分作成に使うため、バックアップ時にJSONを読み込み直さない）
+一定間隔（BACKUP_INTERVAL 秒）内の連続した保存はまとめて最新の内容を1回だけバックアップする
+
+環境変数:
+    BACKUP_INTERVAL  バックアップをまとめる間隔（秒、既定: 30。0 の場合は保存時にその場で実行）
+"""
+import atexit
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+from data_persistence import persistence_manager
+from metrics import metrics
+
+
+def _env_float(name, default):
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+class BackupScheduler:
+    """バックアップのバックグラウンド実行クラス"""
+
+    def __init__(self, interval=None):
+        self.interval = _env_float('BACKUP_INTERVAL', 30) if interval is None else interval
+        self._condition = threading.Condition()
+        self._pending = {}        # 系列名 -> (JSON文字列, データ)（最新の内容のみ保持）
+        self._first_pending = None  # 未実行のバックアップが最初に依頼された時刻
+        self._flush_requested = False
+        self._running = False
+        self._thread = None
+        self._pid = None
+        self._atexit_registered = False
+        self.submitted = 0
+        self.coalesced = 0
+        self.runs = 0
+        self.last_success = None
+        self.last_attempt = None
+        self.last_error = None
+        self.last_duration_ms = None
+
+    def submit(self, name, serialized, data=None):
+        """バックアップを依頼（同じ系列の未実行の依頼は最新の内容で置き換える）
+
+        serialized: JSON文字列、または実行時に (JSON文字列, データ) を返す関数（分割保存した支払データなど）
+        data: serialized のJSON化前のデータ（バックアップの実行まで変更しないこと。省略時は文字列から読み込む）
+        """
+        if self.interval <= 0:
+            self._run({name: (serialized, data)})
+            return
+        with self._condition:
+            self.submitted += 1
+            if name in self._pending:
+                self.coalesced += 1
+            self._pending[name] = (serialized, data)
+            if self._first_pending is None:
+                self._first_pending = time.time()
+            self._ensure_thread()
+            self._condition.notify_all()
+
+    def _ensure_thread(self):
+        # fork後の子プロセスにはスレッドが引き継がれないため、プロセスIDで判定して起動する
+        if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._worker, name='backup-scheduler', daemon=True)
+            self._thread.start()
+            if not self._atexit_registered:
+                # 終了時に未実行のバックアップを書き出す
+                atexit.register(self.flush)
+                self._atexit_registered = True
+
+    def _worker(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                # 最初の依頼から一定時間待ち、その間の依頼をまとめる
+                while self._pending and not self._flush_requested:
+                    remaining = self._first_pending + self.interval - time.time()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                if not self._pending:
+                    continue
+                batch, self._pending = self._pending, {}
+                self._first_pending = None
+                self._running = True
+            try:
+                self._run(batch)
+            finally:
+                with self._condition:
+                    self._running = False
+                    self._flush_requested = bool(self._pending) and self._flush_requested
+                    self._condition.notify_all()
+
+    def _run(self, batch):
+        """バックアップを実行"""
+        start = time.perf_counter()
+        self.last_attempt = datetime.now().isoformat()
+        try:
+            with metrics.stage('backup'):
+                for name, (serialized, data) in batch.items():
+                    if callable(serialized):
+                        serialized, data = serialized()
+                    if data is None:
+                        data = json.loads(serialized)
+                    if name == 'payments':
+                        backup_path = persistence_manager.auto_backup_payments(data, serialized)
+                    else:
+                        backup_path = persistence_manager.backup_to_file(data, name)
+                    if data and backup_path is None:
+                        raise RuntimeError(f"{name} のバックアップを作成できませんでした")
+            self.runs += 1
+            self.last_success = datetime.now().isoformat()
+            self.last_error = None
+        except Exception as e:
+            self.last_error = str(e)
+            print(f"バックアップエラー: {e}")
+        finally:
+            self.last_duration_ms = round((time.perf_counter() - start) * 1000, 2)
+
+    def flush(self, timeout=30):
+        """未実行のバックアップをすぐに実行して完了を待つ"""
+        deadline = time.time() + timeout
+        with self._condition:
+            if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+                # 書き込みスレッドがない（fork後など）場合はこのスレッドで実行
+                batch, self._pending = self._pending, {}
+                self._first_pending = None
+            else:
+                self._flush_requested = True
+                self._condition.notify_all()
+                while (self._pending or self._running) and time.time() < deadline:
+                    self._condition.wait(max(0.0, deadline - time.time()))
+                self._flush_requested = False
+                return not self._pending and not self._running
+        if batch:
+            self._run(batch)
+        return True
+
+    def status(self):
+        """バックアップの実行状況（最終成功時刻・未実行の依頼の待ち時間）"""
+        with self._condition:
+            lag = time.time() - self._first_pending if self._first_pending is not None else 0.0
+            return {
+                'interval_seconds': self.interval,
+                'pending': sorted(self._pending),
+                'running': self._running,
+                'lag_seconds': round(lag, 3),
+                'last_success': self.last_success,
+                'last_attempt': self.last_attempt,
+                'last_error': self.last_error,
+                'last_duration_ms': self.last_duration_ms,
+                'runs': self.runs,
+                'submitted': self.submitted,
+                'coalesced': self.coalesced,
+            }
+
+
+# グローバルインスタンス
+backup_scheduler = BackupScheduler()
@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+"""
+金融機関・支店コードマスター
+全銀協の金融機関・支店コード一覧を読み込み、コード・名称（カナ前方一致）で検索できる索引を保持する
+"""
+import bisect
+import csv
+import os
+import sys
+import threading
+import time
+import unicodedata
+
+from tabular_reader import read_tabular_file
+
+BANK_MASTER_FILE = 'bank_master.csv'
+
+# ヘッダー行がある場合の列名（いずれかに一致する列を使用）
+HEADER_ALIASES = {
+    'bank_code': ('金融機関コード', '銀行コード', 'bank_code'),
+    'branch_code': ('支店コード', '店舗コード', 'branch_code'),
+    'bank_kana': ('金融機関名カナ', '金融機関カナ', '銀行名カナ', 'bank_kana'),
+    'bank_name': ('金融機関名', '金融機関名漢字', '銀行名', 'bank_name'),
+    'branch_kana': ('支店名カナ', '店舗名カナ', 'branch_kana'),
+    'branch_name': ('支店名', '支店名漢字', '店舗名', 'branch_name'),
+}
+
+# ヘッダー行がない場合の列順（全銀協の金融機関・支店コード一覧と同じ並び）
+POSITIONAL_COLUMNS = ('bank_code', 'branch_code', 'bank_kana', 'bank_name', 'branch_kana', 'branch_name')
+
+# 名称検索時に省略できる末尾の語
+NAME_SUFFIXES = ('銀行', 'ギンコウ', '支店', 'シテン')
+
+RELOAD_CHECK_INTERVAL = 1.0  # マスターファイル更新確認の間隔（秒）
+
+
+def normalize_name_key(text):
+    """検索キー用に名称を正規化（半角カナ・ひらがなを全角カタカナに統一、空白除去、英字大文字化）"""
+    if not text:
+        return ''
+    chars = []
+    for char in unicodedata.normalize('NFKC', str(text)):
+        code = ord(char)
+        if 0x3041 <= code <= 0x3096:  # ひらがな -> カタカナ
+            char = chr(code + 0x60)
+        if not char.isspace():
+            chars.append(char)
+    return ''.join(chars).upper()
+
+
+def _name_keys(text):
+    """名称の検索キー（末尾の「銀行」「支店」などを省略したものを含む）"""
+    key = normalize_name_key(text)
+    if not key:
+        return []
+    keys = [key]
+    for suffix in NAME_SUFFIXES:
+        if key.endswith(suffix) and len(key) > len(suffix):
+            keys.append(key[:-len(suffix)])
+    return keys
+
+
+def _normalize_code(value, width):
+    """コードを半角数字・ゼロ埋めに正規化（数字以外を含む場合は空文字）"""
+    text = unicodedata.normalize('NFKC', str(value or '')).strip()
+    if not text.isdigit() or len(text) > width:
+        return ''
+    return text.zfill(width)
+
+
+def _prefix_search(index, prefix, limit):
+    """(キー, 値) の昇順リストから前方一致する値を取得"""
+    results = []
+    position = bisect.bisect_left(index, (prefix,))
+    while position < len(index) and len(results) < limit:
+        key, value = index[position]
+        if not key.startswith(prefix):
+            break
+        if value not in results:
+            results.append(value)
+        position += 1
+    return results
+
+
+class BankMaster:
+    """金融機関・支店コードマスター管理クラス"""
+
+    def __init__(self, filepath=BANK_MASTER_FILE):
+        self.filepath = filepath
+        self._lock = threading.Lock()
+        self._loaded_mtime = None
+        self._last_check = 0.0
+        self._set_index(*self._build_index([]))
+
+    def _build_index(self, rows):
+        """正規化済みの行データから索引を作成"""
+        banks = {}       # 金融機関コード -> (カナ名, 名称)
+        branches = {}    # 金融機関コード -> {支店コード -> (カナ名, 名称)}
+        for row in rows:
+            bank_code = row['bank_code']
+            if bank_code not in banks or (row['bank_kana'] and not banks[bank_code][0]):
+                banks[bank_code] = (sys.intern(row['bank_kana']), sys.intern(row['bank_name']))
+            if row['branch_code']:
+                branches.setdefault(bank_code, {})[row['branch_code']] = (row['branch_kana'], row['branch_name'])
+
+        # 名称の前方一致検索用の昇順リストと、名称完全一致用の辞書
+        bank_name_index = sorted(
+            {(key, code) for code, (kana, name) in banks.items() for text in (kana, name) for key in _name_keys(text)}
+        )
+        bank_codes = {key: code for key, code in reversed(bank_name_index)}
+        branch_name_index = {}
+        branch_codes = {}
+        for bank_code, branch_map in branches.items():
+            index = sorted(
+                {(key, code) for code, (kana, name) in branch_map.items() for text in (kana, name) for key in _name_keys(text)}
+            )
+            branch_name_index[bank_code] = index
+            branch_codes[bank_code] = {key: code for key, code in reversed(index)}
+
+        return banks, branches, bank_name_index, bank_codes, branch_name_index, branch_codes
+
+    def _set_index(self, banks, branches, bank_name_index, bank_codes, branch_name_index, branch_codes):
+        """索引を差し替え"""
+        self.banks = banks
+        self.branches = branches
+        self._bank_code_list = sorted(banks)
+        self._bank_name_index = bank_name_index
+        self._bank_codes = bank_codes
+        self._branch_name_index = branch_name_index
+        self._branch_codes = branch_codes
+
+    def parse_file(self, filepath):
+        """金融機関・支店コード一覧ファイル（CSV/Excel）を読み込んで正規化した行データを返す"""
+        headers, data_rows, message = read_tabular_file(filepath)
+        if headers is None:
+            raise ValueError(message)
+
+        # ヘッダー行の有無を判定（先頭列が数字ならヘッダーなし）
+        header_texts = [str(h or '').strip() for h in headers]
+        if header_texts and header_texts[0].isdigit():
+            data_rows = [header_texts] + data_rows
+            columns = {name: i for i, name in enumerate(POSITIONAL_COLUMNS)}
+        else:
+            columns = {}
+            for name, aliases in HEADER_ALIASES.items():
+                for i, header in enumerate(header_texts):
+                    if header in aliases:
+                        columns[name] = i
+                        break
+            if 'bank_code' not in columns:
+                raise ValueError('金融機関コードの列が見つかりません')
+
+        rows = []
+        for row_data in data_rows:
+            values = {
+                name: str(row_data[index] or '').strip() if index < len(row_data) else ''
+                for name, index in columns.items()
+            }
+            bank_code = _normalize_code(values.get('bank_code'), 4)
+            if not bank_code:
+                continue
+            rows.append({
+                'bank_code': bank_code,
+                'branch_code': _normalize_code(values.get('branch_code'), 3),
+                'bank_kana': values.get('bank_kana', ''),
+                'bank_name': values.get('bank_name', ''),
+                'branch_kana': values.get('branch_kana', ''),
+                'branch_name': values.get('branch_name', ''),
+            })
+        return rows
+
+    def load(self):
+        """保存済みのマスターファイルを読み込み"""
+        if not os.path.exists(self.filepath):
+            return 0
+        mtime = os.path.getmtime(self.filepath)
+        rows = self.parse_file(self.filepath)
+        index = self._build_index(rows)
+        with self._lock:
+            self._set_index(*index)
+            self._loaded_mtime = mtime
+        print(f"金融機関マスターを読み込みました: 金融機関{len(self.banks)}件")
+        return len(rows)
+
+    def ensure_loaded(self):
+        """マスターファイルが更新されていれば再読み込み"""
+        now = time.monotonic()
+        if now - self._last_check < RELOAD_CHECK_INTERVAL:
+            return
+        self._last_check = now
+        try:
+            if os.path.exists(self.filepath) and os.path.getmtime(self.filepath) != self._loaded_mtime:
+                self.load()
+        except Exception as e:
+            print(f"金融機関マスター読み込みエラー: {e}")
+
+    def import_file(self, filepath):
+        """金融機関・支店コード一覧を取り込み、正規化したCSVとして保存"""
+        rows = self.parse_file(filepath)
+        if not rows:
+            raise ValueError('金融機関データが見つかりません')
+
+        temp_path = self.filepath + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(POSITIONAL_COLUMNS)
+            for row in rows:
+                writer.writerow([row[name] for name in POSITIONAL_COLUMNS])
+        os.replace(temp_path, self.filepath)
+
+        index = self._build_index(rows)
+        with self._lock:
+            self._set_index(*index)
+            self._loaded_mtime = os.path.getmtime(self.filepath)
+        return self.status()
+
+    def _bank_info(self, code):
+        kana, name = self.banks[code]
+        return {'bank_code': code, 'bank_kana': kana, 'bank_name': name or kana,
+                'branch_count': len(self.branches.get(code, {}))}
+
+    def _branch_info(self, bank_code, branch_code):
+        kana, name = self.branches[bank_code][branch_code]
+        return {'bank_code': bank_code, 'branch_code': branch_code, 'branch_kana': kana, 'branch_name': name or kana}
+
+    def lookup_bank(self, bank_code):
+        """金融機関コードから金融機関情報を取得"""
+        self.ensure_loaded()
+        code = _normalize_code(bank_code, 4)
+        return self._bank_info(code) if code in self.banks else None
+
+    def lookup_branch(self, bank_code, branch_code):
+        """金融機関コード・支店コードから支店情報を取得"""
+        self.ensure_loaded()
+        bank_code = _normalize_code(bank_code, 4)
+        branch_code = _normalize_code(branch_code, 3)
+        if branch_code not in self.branches.get(bank_code, {}):
+            return None
+        return self._branch_info(bank_code, branch_code)
+
+    def search_banks(self, query, limit=10):
+        """金融機関をコード・名称（カナ・漢字）の前方一致で検索"""
+        self.ensure_loaded()
+        query = normalize_name_key(query)
+        if not query:
+            return []
+        if query.isdigit():
+            position = bisect.bisect_left(self._bank_code_list, query)
+            codes = [code for code in self._bank_code_list[position:position + limit] if code.startswith(query)]
+        else:
+            codes = _prefix_search(self._bank_name_index, query, limit)
+        return [self._bank_info(code) for code in codes]
+
+    def search_branches(self, bank_code, query, limit=10):
+        """支店をコード・名称（カナ・漢字）の前方一致で検索"""
+        self.ensure_loaded()
+        bank_code = _normalize_code(bank_code, 4)
+        branch_map = self.branches.get(bank_code, {})
+        query = normalize_name_key(query)
+        if query.isdigit():
+            codes = sorted(code for code in branch_map if code.startswith(query))[:limit]
+        else:
+            codes = _prefix_search(self._branch_name_index.get(bank_code, []), query, limit)
+        return [self._branch_info(bank_code, code) for code in codes]
+
+    def find_bank_code(self, bank_name):
+        """金融機関名（カナ・漢字）から金融機関コードを取得"""
+        for key in _name_keys(bank_name):
+            if key in self._bank_codes:
+                return self._bank_codes[key]
+        return None
+
+    def find_branch_code(self, bank_code, branch_name):
+        """支店名（カナ・漢字）から支店コードを取得"""
+        branch_codes = self._branch_codes.get(bank_code, {})
+        for key in _name_keys(branch_name):
+            if key in branch_codes:
+                return branch_codes[key]
+        return None
+
+    def fill_vendor(self, vendor):
+        """業者データの未入力の金融機関・支店の名称・コードをマスターから補完（補完した項目名を返す）"""
+        self.ensure_loaded()
+        if not self.banks:
+            return []
+
+        filled = []
+        bank_code = _normalize_code(vendor.get('bank_code'), 4)
+        if not bank_code and vendor.get('bank_name'):
+            bank_code = self.find_bank_code(vendor['bank_name'])
+            if bank_code:
+                vendor['bank_code'] = bank_code
+                filled.append('bank_code')
+        if bank_code not in self.banks:
+            return filled
+
+        bank_kana, bank_name = self.banks[bank_code]
+        if not vendor.get('bank_name'):
+            vendor['bank_name'] = bank_name or bank_kana
+            filled.append('bank_name')
+        if bank_kana:
+            vendor['bank_name_kana'] = bank_kana
+
+        branch_code = _normalize_code(vendor.get('branch_code'), 3)
+        if not branch_code and vendor.get('branch_name'):
+            branch_code = self.find_branch_code(bank_code, vendor['branch_name'])
+            if branch_code:
+                vendor['branch_code'] = branch_code
+                filled.append('branch_code')
+        branch = self.branches.get(bank_code, {}).get(branch_code)
+        if branch is None:
+            return filled
+
+        branch_kana, branch_name = branch
+        if not vendor.get('branch_name'):
+            vendor['branch_name'] = branch_name or branch_kana
+            filled.append('branch_name')
+        if branch_kana:
+            vendor['branch_name_kana'] = branch_kana
+        return filled
+
+    def revision(self):
+        """読み込み済みのマスターファイルの更新日時（内容が変わったかの判定用。未読み込みの場合は None）"""
+        self.ensure_loaded()
+        return self._loaded_mtime
+
+    def status(self):
+        """マスターの読み込み状態を取得"""
+        self.ensure_loaded()
+        return {
+            'loaded': bool(self.banks),
+            'bank_count': len(self.banks),
+            'branch_count': sum(len(branch_map) for branch_map in self.branches.values()),
+            'filepath': self.filepath,
+        }
+
+
+# グローバルインスタンス
+bank_master = BankMaster()
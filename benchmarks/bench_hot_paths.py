@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+リクエスト処理のホットパスのベンチマーク
+合成データ（業者N件, 支払表M件×明細K件）を一時ディレクトリに作成し、
+Flaskのテストクライアント経由で各処理のレイテンシ・ピークRSS・メモリ確保量を計測してJSONで出力する
+
+使い方:
+    python benchmarks/bench_hot_paths.py --scales small,medium --repeat 20 --output bench.json
+    python benchmarks/bench_hot_paths.py --compare before.json after.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import datagen  # noqa: E402
+
+
+def percentile(sorted_values, fraction):
+    """昇順リストからパーセンタイル値を取得（最近傍法）"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def peak_rss_kb():
+    """プロセスのピークRSS（KB）"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOSはバイト単位、Linuxはキロバイト単位
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def git_commit():
+    """計測対象のコミットID"""
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+
+def measure(func, setup=None, repeat=20, warmup=2):
+    """処理を繰り返し実行してレイテンシとメモリ確保量を計測"""
+    for _ in range(warmup):
+        if setup:
+            setup()
+        func()
+
+    latencies = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        func()
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    # メモリ確保量は計測のオーバーヘッドが大きいため別に1回だけ実行
+    if setup:
+        setup()
+    tracemalloc.start()
+    func()
+    _, peak_alloc = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        'latency_ms': {
+            'min': round(latencies[0], 3),
+            'p50': round(percentile(latencies, 0.50), 3),
+            'p90': round(percentile(latencies, 0.90), 3),
+            'p99': round(percentile(latencies, 0.99), 3),
+            'max': round(latencies[-1], 3),
+            'mean': round(sum(latencies) / len(latencies), 3),
+        },
+        'peak_alloc_kb': round(peak_alloc / 1024, 1),
+        'peak_rss_kb': peak_rss_kb(),
+    }
+
+
+def write_json(path, data):
+    """アプリケーションと同じ形式でJSONを保存"""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+def check(response):
+    """レスポンスが成功しているか確認"""
+    if response.status_code != 200:
+        raise RuntimeError(f"ベンチマーク対象がエラーを返しました: {response.status_code} {response.data[:200]!r}")
+    return response
+
+
+def run_scale(app_module, scale_name, params, repeat):
+    """1つの規模でベンチマークを実行"""
+    vendors = datagen.generate_vendors(params['vendors'])
+    payments = datagen.generate_payments(vendors, params['payment_lists'], params['items'])
+    write_json(app_module.VENDORS_FILE, vendors)
+    write_json(app_module.PAYMENTS_FILE, payments)
+    with open(app_module.VENDORS_FILE, 'rb') as f:
+        vendors_snapshot = f.read()
+    with open(app_module.PAYMENTS_FILE, 'rb') as f:
+        payments_snapshot = f.read()
+    upload_csv = datagen.generate_upload_csv(vendors)
+    upload_xlsx = datagen.generate_upload_xlsx(vendors)
+
+    client = app_module.app.test_client()
+    target = payments[len(payments) // 2]
+    pdf_path = os.path.join('temp', f"payment_list_{target['id']}.pdf")
+    search_query = vendors[len(vendors) // 2]['name'][-6:]
+
+    def restore_data():
+        with open(app_module.VENDORS_FILE, 'wb') as f:
+            f.write(vendors_snapshot)
+        with open(app_module.PAYMENTS_FILE, 'wb') as f:
+            f.write(payments_snapshot)
+        shutil.rmtree(app_module.UPLOAD_FOLDER, ignore_errors=True)
+        os.makedirs(app_module.UPLOAD_FOLDER, exist_ok=True)
+
+    def remove_pdf():
+        if os.path.exists(pdf_path):
+            os.remove(pdf_path)
+
+    def upload(content, filename):
+        return lambda: check(client.post(
+            '/api/upload-file', data={'file': (io.BytesIO(content), filename)},
+            content_type='multipart/form-data'
+        ))
+
+    new_payment = {
+        'payment_date': target['payment_date'],
+        'remittance_company': target['remittance_company'],
+        'items': target['items'],
+    }
+
+    benchmarks = [
+        ('search_vendors', lambda: check(client.get(f"/api/vendors/search?q={search_query}")), None),
+        ('generate_transfer_file', lambda: check(client.get(f"/api/payments/{target['id']}/transfer?force=1")), None),
+        ('generate_payment_pdf', lambda: check(client.get(f"/api/payments/{target['id']}/pdf")), remove_pdf),
+        ('process_uploaded_file_csv', upload(upload_csv, 'benchmark.csv'), restore_data),
+        ('process_uploaded_file_xlsx', upload(upload_xlsx, 'benchmark.xlsx'), restore_data),
+        ('save_payments', lambda: app_module.save_payments(payments), None),
+        ('create_payment_list', lambda: check(client.post('/api/payments', json=new_payment)), restore_data),
+    ]
+
+    results = []
+    for name, func, setup in benchmarks:
+        result = measure(func, setup, repeat=repeat)
+        restore_data()
+        results.append(dict(result, scale=scale_name, benchmark=name, params=params))
+        print(
+            f"{scale_name:>7} {name:<28} p50={result['latency_ms']['p50']:>9.2f}ms "
+            f"p99={result['latency_ms']['p99']:>9.2f}ms alloc={result['peak_alloc_kb']:>10.1f}KB",
+            file=sys.stderr
+        )
+    return results
+
+
+def run(scales, repeat):
+    """一時ディレクトリでアプリケーションを読み込みベンチマークを実行"""
+    workdir = tempfile.mkdtemp(prefix='keiri_bench_')
+    original_cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        # アプリケーションのデバッグ出力はベンチマーク結果から除外
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            import app as app_module
+            results = []
+            for scale_name in scales:
+                results.extend(run_scale(app_module, scale_name, datagen.SCALES[scale_name], repeat))
+            # バックグラウンドのバックアップを一時ディレクトリ内で完了させる
+            app_module.backup_scheduler.flush()
+    finally:
+        os.chdir(original_cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'repeat': repeat,
+        },
+        'results': results,
+    }
+
+
+def compare(before_path, after_path):
+    """2つの計測結果のp50レイテンシ・メモリ確保量を比較"""
+    with open(before_path, encoding='utf-8') as f:
+        before = json.load(f)
+    with open(after_path, encoding='utf-8') as f:
+        after = json.load(f)
+
+    baseline = {(r['scale'], r['benchmark']): r for r in before['results']}
+    print(f"{before['meta'].get('commit')} -> {after['meta'].get('commit')}")
+    for result in after['results']:
+        old = baseline.get((result['scale'], result['benchmark']))
+        if not old:
+            continue
+        old_p50 = old['latency_ms']['p50']
+        new_p50 = result['latency_ms']['p50']
+        ratio = new_p50 / old_p50 if old_p50 else float('inf')
+        alloc_ratio = result['peak_alloc_kb'] / old['peak_alloc_kb'] if old['peak_alloc_kb'] else float('inf')
+        print(
+            f"{result['scale']:>7} {result['benchmark']:<28} p50 {old_p50:>9.2f} -> {new_p50:>9.2f}ms "
+            f"(x{ratio:.2f})  alloc x{alloc_ratio:.2f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='リクエスト処理のホットパスのベンチマーク')
+    parser.add_argument('--scales', default='small,medium', help=f"実行する規模（{', '.join(datagen.SCALES)}）")
+    parser.add_argument('--repeat', type=int, default=20, help='1処理あたりの計測回数')
+    parser.add_argument('--output', help='結果を保存するJSONファイル（未指定の場合は標準出力）')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='2つの結果ファイルを比較')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    scales = [scale.strip() for scale in args.scales.split(',') if scale.strip()]
+    unknown = [scale for scale in scales if scale not in datagen.SCALES]
+    if unknown:
+        parser.error(f"未定義の規模です: {', '.join(unknown)}")
+
+    report = run(scales, args.repeat)
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
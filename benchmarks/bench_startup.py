@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+起動時間（コールドスタート）のベンチマーク
+毎回新しいPythonプロセスで、アプリケーションの読み込み時間と最初のレスポンスまでの時間を計測してJSONで出力する
+（Render等でスリープから復帰した直後の応答時間の目安）
+
+- import          : `import app` の所要時間と、重いモジュール（ReportLab・openpyxl）が読み込まれたか
+- first_response  : テストクライアントでの各エンドポイントの最初のレスポンス時間
+                    （cold: ウォームアップなし / warm: ウォームアップ完了後）
+- server          : `python app.py` を起動してから /api/health が応答するまでの時間と、ウォームアップ完了までの時間
+
+計測値が予算（--budget-*）を超えた場合は終了コード 1 を返す
+
+使い方:
+    python benchmarks/bench_startup.py --repeat 5 --output startup.json
+    python benchmarks/bench_startup.py --budget-import-ms 300 --budget-server-ms 2000
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import datagen  # noqa: E402
+from bench_hot_paths import git_commit, write_json  # noqa: E402
+
+HEAVY_MODULES = ('reportlab', 'openpyxl')
+
+# 新しいプロセスで実行する計測スクリプト（引数: 計測するエンドポイントのJSON, ウォームアップの有無）
+PROBE = r'''
+import contextlib, json, os, sys, time
+start = time.perf_counter()
+with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+    import app as app_module
+    import_ms = (time.perf_counter() - start) * 1000
+    heavy = {name: name in sys.modules for name in json.loads(sys.argv[3])}
+    module_count = len(sys.modules)
+    if sys.argv[2] == 'warm':
+        app_module.warmup.start()
+        app_module.warmup.wait()
+    client = app_module.app.test_client()
+    responses = {}
+    for name, path in json.loads(sys.argv[1]):
+        request_start = time.perf_counter()
+        status = client.get(path).status_code
+        responses[name] = {'ms': round((time.perf_counter() - request_start) * 1000, 2), 'status': status}
+    app_module.backup_scheduler.flush()
+print(json.dumps({'import_ms': round(import_ms, 2), 'modules': module_count,
+                  'heavy_modules_loaded': heavy, 'responses': responses}))
+'''
+
+
+def summarize(values):
+    """計測値の中央値・最小値・最大値"""
+    return {
+        'median': round(statistics.median(values), 2),
+        'min': round(min(values), 2),
+        'max': round(max(values), 2),
+    }
+
+
+def child_env(warmup):
+    env = dict(os.environ, PYTHONPATH=REPO_DIR, WARMUP='1' if warmup else '0',
+               BACKUP_INTERVAL='0', PYTHONDONTWRITEBYTECODE='1')
+    env.pop('METRICS_ENABLED', None)
+    env.pop('PROFILE_TOKEN', None)
+    env.pop('PROFILE_SLOW_MS', None)
+    return env
+
+
+def run_probe(workdir, endpoints, mode):
+    """新しいプロセスでアプリケーションを読み込み、最初のレスポンスまでを計測"""
+    output = subprocess.check_output(
+        [sys.executable, '-c', PROBE, json.dumps(endpoints), mode, json.dumps(HEAVY_MODULES)],
+        cwd=workdir, env=child_env(warmup=mode == 'warm'), stderr=subprocess.DEVNULL,
+    )
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def run_server(workdir, timeout=30):
+    """`python app.py` を起動し、最初のレスポンスとウォームアップ完了までの時間を計測"""
+    port = free_port()
+    env = dict(child_env(warmup=True), PORT=str(port))
+    url = f'http://127.0.0.1:{port}/api/health'
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, os.path.join(REPO_DIR, 'app.py')], cwd=workdir, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        first_response_ms = None
+        warmup_ms = None
+        while time.perf_counter() - start < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f"サーバーが終了しました: 終了コード {process.returncode}")
+            try:
+                with urllib.request.urlopen(url, timeout=1) as response:
+                    body = json.loads(response.read().decode('utf-8'))
+            except (urllib.error.URLError, ConnectionError, OSError):
+                time.sleep(0.005)
+                continue
+            elapsed = (time.perf_counter() - start) * 1000
+            if first_response_ms is None:
+                first_response_ms = elapsed
+            if body.get('warmup', {}).get('finished_at'):
+                warmup_ms = elapsed
+                break
+            time.sleep(0.01)
+        if first_response_ms is None:
+            raise RuntimeError('サーバーが時間内に応答しませんでした')
+        return {'first_response_ms': round(first_response_ms, 2),
+                'warmup_done_ms': round(warmup_ms, 2) if warmup_ms is not None else None}
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def run(repeat, scale):
+    """一時ディレクトリに合成データを作成し、起動時間を計測"""
+    params = datagen.SCALES[scale]
+    vendors = datagen.generate_vendors(params['vendors'])
+    payments = datagen.generate_payments(vendors, params['payment_lists'], params['items'])
+    target = payments[len(payments) // 2]
+    endpoints = [
+        ('index', '/'),
+        ('vendors', '/api/vendors'),
+        ('payment_pdf', f"/api/payments/{target['id']}/pdf"),
+    ]
+
+    workdir = tempfile.mkdtemp(prefix='keiri_startup_')
+    try:
+        write_json(os.path.join(workdir, 'vendors.json'), vendors)
+        write_json(os.path.join(workdir, 'payments.json'), payments)
+
+        def remove_generated():
+            # 生成済みのPDFがあると再生成されないため毎回削除
+            shutil.rmtree(os.path.join(workdir, 'temp'), ignore_errors=True)
+
+        probes = {'cold': [], 'warm': []}
+        servers = []
+        for _ in range(repeat):
+            for mode in probes:
+                remove_generated()
+                probes[mode].append(run_probe(workdir, endpoints, mode))
+            remove_generated()
+            servers.append(run_server(workdir))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    cold = probes['cold']
+    results = {
+        'import': {
+            'ms': summarize([probe['import_ms'] for probe in cold]),
+            'modules': cold[-1]['modules'],
+            'heavy_modules_loaded': cold[-1]['heavy_modules_loaded'],
+        },
+        'first_response': {
+            mode: {name: summarize([probe['responses'][name]['ms'] for probe in runs]) for name, _ in endpoints}
+            for mode, runs in probes.items()
+        },
+        'server': {
+            'first_response_ms': summarize([server['first_response_ms'] for server in servers]),
+            'warmup_done_ms': summarize([server['warmup_done_ms'] for server in servers
+                                         if server['warmup_done_ms'] is not None] or [0.0]),
+        },
+    }
+    failed = [f"{mode}:{name}" for mode, runs in probes.items() for probe in runs
+              for name, response in probe['responses'].items() if response['status'] != 200]
+    if failed:
+        raise RuntimeError(f"ベンチマーク対象がエラーを返しました: {', '.join(sorted(set(failed)))}")
+
+    return {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'repeat': repeat,
+            'scale': scale,
+        },
+        'results': results,
+    }
+
+
+def check_budget(report, budgets):
+    """計測値（中央値）が予算を超えていないか確認し、超過した項目を返す"""
+    results = report['results']
+    measured = {
+        'import_ms': results['import']['ms']['median'],
+        'first_response_ms': results['first_response']['cold']['index']['median'],
+        'server_ms': results['server']['first_response_ms']['median'],
+    }
+    exceeded = []
+    for name, budget in budgets.items():
+        if budget is not None and measured[name] > budget:
+            exceeded.append({'name': name, 'measured': measured[name], 'budget': budget})
+    return exceeded
+
+
+def main():
+    parser = argparse.ArgumentParser(description='起動時間（コールドスタート）のベンチマーク')
+    parser.add_argument('--repeat', type=int, default=5, help='プロセスを起動して計測する回数')
+    parser.add_argument('--scale', default='small', help=f"合成データの規模（{', '.join(datagen.SCALES)}）")
+    parser.add_argument('--output', help='結果を保存するJSONファイル（未指定の場合は標準出力）')
+    parser.add_argument('--budget-import-ms', type=float, default=400, help='import app の予算（ミリ秒）')
+    parser.add_argument('--budget-first-response-ms', type=float, default=100,
+                        help='読み込み後の最初のレスポンス（/）の予算（ミリ秒）')
+    parser.add_argument('--budget-server-ms', type=float, default=2000,
+                        help='python app.py 起動から最初のレスポンスまでの予算（ミリ秒）')
+    args = parser.parse_args()
+
+    if args.scale not in datagen.SCALES:
+        parser.error(f"未定義の規模です: {args.scale}")
+
+    report = run(args.repeat, args.scale)
+    report['budget_exceeded'] = check_budget(report, {
+        'import_ms': args.budget_import_ms,
+        'first_response_ms': args.budget_first_response_ms,
+        'server_ms': args.budget_server_ms,
+    })
+    results = report['results']
+    print(
+        f"import={results['import']['ms']['median']:.1f}ms "
+        f"first_response={results['first_response']['cold']['index']['median']:.1f}ms "
+        f"pdf cold={results['first_response']['cold']['payment_pdf']['median']:.1f}ms "
+        f"warm={results['first_response']['warm']['payment_pdf']['median']:.1f}ms "
+        f"server={results['server']['first_response_ms']['median']:.1f}ms",
+        file=sys.stderr
+    )
+    for item in report['budget_exceeded']:
+        print(f"予算超過: {item['name']} {item['measured']:.1f}ms > {item['budget']:.1f}ms", file=sys.stderr)
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+    sys.exit(1 if report['budget_exceeded'] else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+ベンチマーク用の合成データ生成
+業者マスター・支払表・アップロード用ファイルを乱数シード固定で生成する
+"""
+import csv
+import io
+import random
+from datetime import date, datetime, timedelta
+
+import openpyxl
+
+KANA = 'ｱｲｳｴｵｶｷｸｹｺｻｼｽｾｿﾀﾁﾂﾃﾄﾅﾆﾇﾈﾉﾊﾋﾌﾍﾎﾏﾐﾑﾒﾓﾔﾕﾖﾗﾘﾙﾚﾛﾜﾝ'
+NAME_WORDS = ['サンプル', 'テスト', '建設', '商事', '工業', '設備', '電気', '運輸', '企画', '不動産', '管理', 'サービス']
+COMPANY_PREFIXES = ['株式会社', '有限会社', '(株)', '(有)']
+BANKS = [
+    ('0177', '福岡銀行', 'ﾌｸｵｶｷﾞﾝｺｳ'),
+    ('0190', '西日本シティ銀行', 'ﾆｼﾆﾂﾎﾟﾝｼﾃｲｷﾞﾝｺｳ'),
+    ('0005', '三菱ＵＦＪ銀行', 'ﾐﾂﾋﾞｼﾕｰｴﾌｼﾞｪｲ'),
+    ('9900', 'ゆうちょ銀行', 'ﾕｳﾁﾖ'),
+]
+
+# ベンチマークの規模（業者数, 支払表数, 1支払表あたりの明細数）
+SCALES = {
+    'small': {'vendors': 100, 'payment_lists': 10, 'items': 10},
+    'medium': {'vendors': 1000, 'payment_lists': 100, 'items': 50},
+    'large': {'vendors': 5000, 'payment_lists': 500, 'items': 200},
+}
+
+
+def generate_vendors(count, seed=0):
+    """業者マスターデータを生成"""
+    rng = random.Random(seed)
+    vendors = []
+    for i in range(1, count + 1):
+        bank_code, bank_name, _ = rng.choice(BANKS)
+        name = f"{rng.choice(COMPANY_PREFIXES)}{rng.choice(NAME_WORDS)}{rng.choice(NAME_WORDS)}{i}"
+        holder = 'ｶ)' + ''.join(rng.choice(KANA) for _ in range(rng.randint(4, 20)))
+        vendors.append({
+            'id': i,
+            'name': name,
+            'bank_name': bank_name,
+            'branch_name': f"第{rng.randint(1, 99)}支店",
+            'account_type': rng.choice([1, 1, 1, 2]),
+            'account_number': f"{rng.randint(0, 9999999):07d}",
+            'account_holder': holder,
+            'bank_code': bank_code,
+            'branch_code': f"{rng.randint(1, 999):03d}",
+            'source': 'upload',
+            'upload_source': 'benchmark.csv',
+        })
+    return vendors
+
+
+def generate_payments(vendors, list_count, item_count, seed=0):
+    """支払表データを生成"""
+    rng = random.Random(seed + 1)
+    start = date(2025, 1, 1)
+    created = datetime(2025, 1, 1, 9, 0, 0)
+    payments = []
+    for i in range(list_count):
+        remitter = rng.choice(vendors)
+        items = []
+        for j in range(item_count):
+            vendor = rng.choice(vendors)
+            items.append({
+                'id': 1700000000000 + i * 10000 + j,
+                'vendor_id': vendor['id'],
+                'vendor_name': vendor['name'],
+                'amount': rng.randint(1, 5000) * 100,
+                'description': rng.choice(['工事代金', '外注費', '材料費', 'コンサルティング', '清掃代']),
+                'remarks': '',
+            })
+        payments.append({
+            'id': (created + timedelta(minutes=i)).strftime('%Y%m%d_%H%M%S'),
+            'payment_date': (start + timedelta(days=i % 365)).isoformat(),
+            'remittance_company': remitter['name'],
+            'items': items,
+            'created_at': (created + timedelta(minutes=i)).isoformat(),
+        })
+    return payments
+
+
+def _upload_rows(vendors):
+    """アップロードファイルの行データ（A列: 連番, B列～I列: 口座情報）"""
+    yield ['No', '金融機関コード', '支店コード', '預金種目', '口座番号', '企業名', '金融機関名', '支店名', '口座名義']
+    for vendor in vendors:
+        yield [
+            vendor['id'], vendor['bank_code'], vendor['branch_code'], vendor['account_type'],
+            vendor['account_number'], vendor['name'], vendor['bank_name'], vendor['branch_name'],
+            vendor['account_holder'],
+        ]
+
+
+def generate_upload_csv(vendors):
+    """マスターデータアップロード用のCSV（Shift_JIS）を生成"""
+    output = io.StringIO()
+    writer = csv.writer(output)
+    for row in _upload_rows(vendors):
+        writer.writerow(row)
+    return output.getvalue().encode('cp932')
+
+
+def generate_upload_xlsx(vendors):
+    """マスターデータアップロード用のExcelファイルを生成"""
+    workbook = openpyxl.Workbook(write_only=True)
+    worksheet = workbook.create_sheet()
+    for row in _upload_rows(vendors):
+        worksheet.append([str(value) for value in row])
+    output = io.BytesIO()
+    workbook.save(output)
+    return output.getvalue()
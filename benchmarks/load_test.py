@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+gunicorn のワーカー数ごとのスループット計測（負荷試験）
+合成データを一時ディレクトリに作成し、gunicorn.conf.py の設定でワーカー数を変えて起動して、
+業者検索・振込ファイル出力・PDF出力のエンドポイントに並行してリクエストを送り、
+1秒あたりの処理件数とレイテンシをJSONで出力する
+
+使い方:
+    python benchmarks/load_test.py --workers 1,4,8 --concurrency 16 --duration 10 --output load.json
+    python benchmarks/load_test.py --endpoints search --scale medium
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from urllib.parse import quote
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import datagen  # noqa: E402
+from bench_hot_paths import git_commit, percentile, write_json  # noqa: E402
+from bench_startup import free_port  # noqa: E402
+
+
+def build_endpoints(vendors, payments):
+    """計測対象のエンドポイント（名前 -> パスの一覧。順に巡回してリクエストする）"""
+    queries = [vendor['name'][-6:] for vendor in vendors[::max(1, len(vendors) // 20)]]
+    targets = payments[::max(1, len(payments) // 10)]
+    return {
+        'search': [f"/api/vendors/search?q={quote(query)}" for query in queries],
+        'transfer': [f"/api/payments/{payment['id']}/transfer?force=1" for payment in targets],
+        'pdf': [f"/api/payments/{payment['id']}/pdf" for payment in targets],
+    }
+
+
+def start_server(workdir, workers, threads, timeout=60):
+    """gunicorn を起動し、応答するまで待つ"""
+    port = free_port()
+    env = dict(os.environ, PYTHONPATH=REPO_DIR, PORT=str(port), WEB_CONCURRENCY=str(workers),
+               GUNICORN_THREADS=str(threads), BACKUP_INTERVAL='30')
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', os.path.join(REPO_DIR, 'gunicorn.conf.py'),
+         '--chdir', workdir, '--access-logfile', os.devnull, 'wsgi:app'],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn が終了しました: 終了コード {process.returncode}（gunicorn はインストール済みですか）")
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            connection.request('GET', '/api/health')
+            if connection.getresponse().status == 200:
+                connection.close()
+                return process, port
+        except OSError:
+            time.sleep(0.05)
+    stop_server(process)
+    raise RuntimeError('gunicorn が時間内に応答しませんでした')
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def run_load(port, paths, concurrency, duration):
+    """複数スレッドから一定時間リクエストを送り続けて計測"""
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client(index):
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+        local_latencies = []
+        local_errors = 0
+        position = index
+        while time.perf_counter() < deadline:
+            path = paths[position % len(paths)]
+            position += 1
+            start = time.perf_counter()
+            try:
+                try:
+                    connection.request('GET', path)
+                    response = connection.getresponse()
+                except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                    # サーバー側で閉じられたキープアライブ接続は再接続して送り直す
+                    connection.close()
+                    connection.request('GET', path)
+                    response = connection.getresponse()
+                response.read()
+                if response.status != 200:
+                    local_errors += 1
+                    continue
+            except (OSError, http.client.HTTPException):
+                local_errors += 1
+                connection.close()
+                continue
+            local_latencies.append((time.perf_counter() - start) * 1000)
+        connection.close()
+        with lock:
+            latencies.extend(local_latencies)
+            errors.append(local_errors)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': sum(errors),
+        'throughput_rps': round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        'latency_ms': {
+            'p50': round(percentile(latencies, 0.50), 2),
+            'p90': round(percentile(latencies, 0.90), 2),
+            'p99': round(percentile(latencies, 0.99), 2),
+            'max': round(latencies[-1], 2) if latencies else 0.0,
+        },
+    }
+
+
+def run(worker_counts, endpoint_names, scale, concurrency, duration, threads):
+    """ワーカー数ごとに gunicorn を起動して各エンドポイントの負荷試験を実行"""
+    params = datagen.SCALES[scale]
+    vendors = datagen.generate_vendors(params['vendors'])
+    payments = datagen.generate_payments(vendors, params['payment_lists'], params['items'])
+    endpoints = build_endpoints(vendors, payments)
+
+    results = []
+    for workers in worker_counts:
+        workdir = tempfile.mkdtemp(prefix='keiri_load_')
+        try:
+            write_json(os.path.join(workdir, 'vendors.json'), vendors)
+            write_json(os.path.join(workdir, 'payments.json'), payments)
+            process, port = start_server(workdir, workers, threads)
+            try:
+                for name in endpoint_names:
+                    # 最初の数件（ウォームアップ・PDFの初回生成）は計測から除外
+                    run_load(port, endpoints[name], concurrency, min(1.0, duration))
+                    result = run_load(port, endpoints[name], concurrency, duration)
+                    results.append(dict(result, workers=workers, threads=threads, endpoint=name,
+                                        concurrency=concurrency))
+                    print(
+                        f"workers={workers:<2} {name:<9} {result['throughput_rps']:>9.1f} req/s "
+                        f"p50={result['latency_ms']['p50']:>8.2f}ms p99={result['latency_ms']['p99']:>8.2f}ms "
+                        f"errors={result['errors']}",
+                        file=sys.stderr
+                    )
+            finally:
+                stop_server(process)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'scale': scale,
+            'duration_seconds': duration,
+        },
+        'results': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='gunicorn のワーカー数ごとのスループット計測')
+    parser.add_argument('--workers', default='1,4,8', help='計測するワーカー数（カンマ区切り）')
+    parser.add_argument('--threads', type=int, default=4, help='ワーカーあたりのスレッド数')
+    parser.add_argument('--endpoints', default='search,transfer,pdf', help='計測するエンドポイント（search, transfer, pdf）')
+    parser.add_argument('--scale', default='small', help=f"合成データの規模（{', '.join(datagen.SCALES)}）")
+    parser.add_argument('--concurrency', type=int, default=16, help='同時に送るリクエスト数')
+    parser.add_argument('--duration', type=float, default=10, help='1エンドポイントあたりの計測時間（秒）')
+    parser.add_argument('--output', help='結果を保存するJSONファイル（未指定の場合は標準出力）')
+    args = parser.parse_args()
+
+    try:
+        worker_counts = [int(value) for value in args.workers.split(',') if value.strip()]
+    except ValueError:
+        parser.error(f"ワーカー数が不正です: {args.workers}")
+    endpoint_names = [name.strip() for name in args.endpoints.split(',') if name.strip()]
+    unknown = [name for name in endpoint_names if name not in ('search', 'transfer', 'pdf')]
+    if unknown:
+        parser.error(f"未定義のエンドポイントです: {', '.join(unknown)}")
+    if args.scale not in datagen.SCALES:
+        parser.error(f"未定義の規模です: {args.scale}")
+
+    report = run(worker_counts, endpoint_names, args.scale, args.concurrency, args.duration, args.threads)
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,20 +2,148 @@
 """
 データ永続化ユーティリティ
 Render環境でのスリープ対策として、重要なデータを外部に保存・復元
+
+バックアップは系列（payments, manual_payments など）ごとに「スナップショット＋差分」の連鎖で保存する
+- 内容が前回と同じ場合は保存しない（内容ハッシュで重複排除）
+- id を持つレコードの一覧は、変更・追加・削除されたレコードだけを差分として保存
+- 保持ポリシー（直近N件・1時間ごと・1日ごと・1週間ごと）から外れたものは定期的に削除し、連鎖を詰め直す
+- backups/index.json に一覧を保持し、状態確認・復元時にディレクトリを走査しない
+- gunicorn の各ワーカーがそれぞれバックアップを実行するため、インデックスの読み書きはファイルロック
+  （index.json.lock）で排他し、別のワーカーが更新したインデックスはロックを取った時点で読み直す
+支払データの自動バックアップ時には、業者・送金会社・アップロードファイルを含めたアーカイブ（latest.kbak）も作成する
 """
 import json
 import os
 import base64
 import gzip
+import hashlib
+import threading
+import time
+from bisect import bisect_right
+from contextlib import contextmanager
 from datetime import datetime
 
+try:
+    import fcntl
+except ImportError:  # Windows ではプロセス間のロックを行わない
+    fcntl = None
+
+import backup_archive
+from payment_columns import PaymentColumns
+
+INDEX_FILENAME = "index.json"
+ARCHIVE_FILENAME = "latest.kbak"
+LEGACY_COMPRESSED_FILENAME = "payments_compressed.txt"  # 従来形式（復元のみ対応）
+INDEX_VERSION = 1
+
+SNAPSHOT_EVERY = 20          # 差分がこの件数続いたらスナップショットを作成
+SNAPSHOT_CHANGE_RATIO = 0.5  # 変更レコードの割合がこれを超えたらスナップショットを作成
+KEEP_RECENT = 10             # 常に保持する直近の件数
+RETENTION_POLICY = (         # (区分, 保持数): 区分ごとに最新の1件を保持
+    ('hourly', 24),
+    ('daily', 7),
+    ('weekly', 4),
+)
+RETENTION_INTERVAL = 600     # 保持ポリシーを適用する間隔（秒）
+MAX_ENTRIES = 200            # 系列あたりの件数がこれを超えたら間隔に関わらず適用
+
+
+def _dumps(data):
+    """保存用のJSON文字列（区切り文字を詰めて出力）"""
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+
+
+def _record_key(data):
+    """id を持つレコードの一覧であれば id の一覧を返す（それ以外は None）"""
+    if not isinstance(data, list):
+        return None
+    keys = []
+    for record in data:
+        if not isinstance(record, dict) or 'id' not in record:
+            return None
+        keys.append(str(record['id']))
+    if len(set(keys)) != len(keys):
+        return None
+    return keys
+
+
+def _file_signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def _local_timestamp(value):
+    """日時（ISO 8601 形式の文字列も可）をインデックスと同じタイムゾーンなしのローカル時刻にする
+    タイムゾーン付き（2025-01-31T08:00:00Z など）はローカル時刻に変換する。形式が不正な場合は ValueError"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    elif not isinstance(value, datetime):
+        raise ValueError(f"日時の形式が不正です: {value!r}")
+    if value.tzinfo is not None:
+        value = value.astimezone().replace(tzinfo=None)
+    return value
+
+
+def _bucket(timestamp, period):
+    """保持ポリシーの区分（同じ区分のバックアップは最新の1件のみ保持）"""
+    if period == 'hourly':
+        return timestamp.strftime('%Y%m%d%H')
+    if period == 'daily':
+        return timestamp.strftime('%Y%m%d')
+    year, week, _ = timestamp.isocalendar()
+    return f"{year}W{week:02d}"
+
+
+def _total_amount(data):
+    """支払表の一覧であれば明細金額の合計を返す（それ以外は None）"""
+    if not isinstance(data, list) or not data or not all(isinstance(record, dict) and 'items' in record for record in data):
+        return None
+    return PaymentColumns.from_payments(data, strict=False).total()
+
+
+class _SeriesState:
+    """系列の最新バックアップの内容（差分作成用）"""
+
+    def __init__(self, entry_id, keys, record_hashes, content_hash):
+        self.entry_id = entry_id
+        self.keys = keys                    # レコードの id の並び
+        self.record_hashes = record_hashes  # id -> レコードのハッシュ
+        self.content_hash = content_hash
+
+
+def _build_state(entry_id, data):
+    """データから差分作成用の状態を作成"""
+    keys = _record_key(data)
+    if keys is None:
+        return _SeriesState(entry_id, None, None, hashlib.sha256(_dumps(data).encode('utf-8')).hexdigest())
+    record_hashes = {}
+    for key, record in zip(keys, data):
+        record_hashes[key] = hashlib.sha1(
+            json.dumps(record, ensure_ascii=False, sort_keys=True).encode('utf-8')
+        ).hexdigest()
+    content = '\n'.join(f"{key}:{record_hashes[key]}" for key in keys)
+    return _SeriesState(entry_id, keys, record_hashes, hashlib.sha256(content.encode('utf-8')).hexdigest())
+
+
 class DataPersistenceManager:
     """データ永続化管理クラス"""
-    
+
     def __init__(self):
         self.backup_dir = "backups"
         os.makedirs(self.backup_dir, exist_ok=True)
-    
+        self.index_path = os.path.join(self.backup_dir, INDEX_FILENAME)
+        self._lock = threading.RLock()
+        self._lock_depth = 0
+        self._index = None
+        self._index_signature = None  # 読み込み・保存した時点のインデックスファイル（更新日時, サイズ）
+        self._states = {}  # 系列名 -> _SeriesState
+        self._sequence = 0
+        self.archive_path = os.path.join(self.backup_dir, ARCHIVE_FILENAME)
+        self.archive_sources = {}  # セクション名 -> ファイルまたはディレクトリのパス
+
     def compress_and_encode(self, data):
         """データを圧縮・エンコード"""
         try:
@@ -31,7 +159,7 @@ class DataPersistenceManager:
         except Exception as e:
             print(f"データ圧縮エラー: {e}")
             return None
-    
+
     def decode_and_decompress(self, encoded_data):
         """データをデコード・展開"""
         try:
@@ -47,63 +175,497 @@ class DataPersistenceManager:
         except Exception as e:
             print(f"データ展開エラー: {e}")
             return None
-    
+
+    # ---- インデックス ----
+
+    @contextmanager
+    def _locked(self):
+        """インデックス・バックアップファイルの操作を排他（gunicornの別ワーカーとも排他）
+
+        ファイルのロックは同じプロセスでも重ねて取れないため、入れ子の呼び出しではスレッドのロックのみ取る
+        """
+        with self._lock:
+            if self._lock_depth or fcntl is None:
+                self._lock_depth += 1
+                try:
+                    if self._lock_depth == 1:
+                        self._refresh_index()
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                return
+            with open(self.index_path + '.lock', 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                self._lock_depth += 1
+                try:
+                    self._refresh_index()
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _refresh_index(self):
+        """別のプロセスがインデックスを更新していれば、次の参照時に読み直す"""
+        if self._index is not None and _file_signature(self.index_path) != self._index_signature:
+            self._index = None
+
+    def _load_index(self):
+        """インデックスを読み込み（未作成の場合は従来形式のバックアップを取り込んで作成）"""
+        if self._index is not None:
+            return self._index
+        if os.path.exists(self.index_path):
+            try:
+                signature = _file_signature(self.index_path)
+                with open(self.index_path, 'r', encoding='utf-8') as f:
+                    index = json.load(f)
+                if index.get('version') == INDEX_VERSION:
+                    self._index = index
+                    self._index_signature = signature
+                    return self._index
+            except Exception as e:
+                print(f"バックアップインデックス読み込みエラー: {e}")
+        self._index = {'version': INDEX_VERSION, 'series': {}, 'last_retention': {}}
+        self._migrate_legacy_backups()
+        self._save_index()
+        return self._index
+
+    def _save_index(self):
+        """インデックスを保存（一時ファイルに書いてから置き換え）"""
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._index, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.index_path)
+        self._index_signature = _file_signature(self.index_path)
+
+    def _entries(self, name):
+        return self._load_index()['series'].get(name, [])
+
+    def _write_blob(self, filename, payload):
+        """バックアップ本体を gzip 圧縮して保存"""
+        path = os.path.join(self.backup_dir, filename)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(gzip.compress(_dumps(payload).encode('utf-8'), compresslevel=6))
+        os.replace(tmp_path, path)
+        return path
+
+    def _read_blob(self, filename):
+        with open(os.path.join(self.backup_dir, filename), 'rb') as f:
+            return json.loads(gzip.decompress(f.read()).decode('utf-8'))
+
+    # ---- 書き込み ----
+
+    def _new_entry_id(self, timestamp):
+        self._sequence += 1
+        return f"{timestamp.strftime('%Y%m%d_%H%M%S_%f')}_{self._sequence % 1000:03d}"
+
+    def _current_state(self, name):
+        """系列の最新バックアップの状態（プロセス起動後の初回のみバックアップから復元して作成）"""
+        entries = self._entries(name)
+        if not entries:
+            return None
+        state = self._states.get(name)
+        if state is None or state.entry_id != entries[-1]['id']:
+            state = _build_state(entries[-1]['id'], self._reconstruct(entries, len(entries) - 1))
+            self._states[name] = state
+        return state
+
+    def _append_entry(self, name, data, state, timestamp, previous=None):
+        """スナップショットまたは差分としてバックアップを1件追加"""
+        entries = self._load_index()['series'].setdefault(name, [])
+        entry_id = self._new_entry_id(timestamp)
+        chain_length = entries[-1].get('chain_length', 0) + 1 if entries else 0
+
+        payload = None
+        if previous is not None and previous.keys is not None and state.keys is not None \
+                and chain_length < SNAPSHOT_EVERY:
+            upsert = {
+                key: record for key, record in zip(state.keys, data)
+                if previous.record_hashes.get(key) != state.record_hashes[key]
+            }
+            if len(upsert) <= len(state.keys) * SNAPSHOT_CHANGE_RATIO:
+                current_keys = set(state.keys)
+                deleted = [key for key in previous.keys if key not in current_keys]
+                payload = {'parent': previous.entry_id, 'upsert': upsert, 'delete': deleted}
+                # 削除・末尾への追加以外で並びが変わった場合のみ並び順を保存
+                deleted_keys = set(deleted)
+                expected = [key for key in previous.keys if key not in deleted_keys]
+                expected.extend(key for key in state.keys if key not in previous.record_hashes)
+                if expected != state.keys:
+                    payload['order'] = state.keys
+
+        kind = 'diff' if payload is not None else 'snapshot'
+        if payload is None:
+            payload = {'data': data}
+            chain_length = 0
+        filename = f"{name}_{entry_id}.{kind}.json.gz"
+        path = self._write_blob(filename, payload)
+
+        entries.append({
+            'id': entry_id,
+            'kind': kind,
+            'file': filename,
+            'parent': payload.get('parent'),
+            'chain_length': chain_length,
+            'hash': state.content_hash,
+            'count': len(data) if isinstance(data, list) else None,
+            'total_amount': _total_amount(data),
+            'size': os.path.getsize(path),
+            'timestamp': timestamp.isoformat(),
+        })
+        state.entry_id = entry_id
+        self._states[name] = state
+        return path
+
     def backup_to_file(self, data, filename):
-        """ファイルにバックアップ"""
+        """ファイルにバックアップ（前回と同じ内容の場合は保存せず前回のファイルを返す）"""
         try:
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            backup_filename = f"{filename}_{timestamp}.backup"
-            backup_path = os.path.join(self.backup_dir, backup_filename)
-            
-            with open(backup_path, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-            
+            with self._locked():
+                previous = self._current_state(filename)
+                state = _build_state(None, data)
+                if previous is not None and previous.content_hash == state.content_hash:
+                    return os.path.join(self.backup_dir, self._entries(filename)[-1]['file'])
+
+                backup_path = self._append_entry(filename, data, state, datetime.now(), previous)
+                self._apply_retention_if_due(filename)
+                self._save_index()
+
             print(f"バックアップ作成: {backup_path}")
             return backup_path
         except Exception as e:
             print(f"バックアップエラー: {e}")
             return None
-    
+
+    # ---- 復元 ----
+
+    def _reconstruct(self, entries, position):
+        """バックアップ一覧の position 番目の内容を復元（直前のスナップショットから差分を適用）"""
+        start = position
+        while entries[start]['kind'] != 'snapshot':
+            start -= 1
+        data = self._read_blob(entries[start]['file'])['data']
+        if start == position:
+            return data
+
+        records = {str(record['id']): record for record in data}
+        order = [str(record['id']) for record in data]
+        for entry in entries[start + 1:position + 1]:
+            diff = self._read_blob(entry['file'])
+            deleted = set(diff['delete'])
+            for key in deleted:
+                records.pop(key, None)
+            if 'order' in diff:
+                order = diff['order']
+            else:
+                order = [key for key in order if key not in deleted]
+                order.extend(key for key in diff['upsert'] if key not in records)
+            records.update(diff['upsert'])
+        return [records[key] for key in order]
+
+    def _restore_legacy_file(self, filename_pattern):
+        """従来形式（.backup）のバックアップファイルから復元"""
+        backup_files = [f for f in os.listdir(self.backup_dir) if filename_pattern in f and f.endswith('.backup')]
+        if not backup_files:
+            return None
+
+        # 最新のバックアップファイルを選択
+        latest_backup = sorted(backup_files)[-1]
+        backup_path = os.path.join(self.backup_dir, latest_backup)
+
+        with open(backup_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+
+        print(f"バックアップから復元: {backup_path}")
+        return data
+
     def restore_from_file(self, filename_pattern):
         """最新のバックアップファイルから復元"""
         try:
-            backup_files = [f for f in os.listdir(self.backup_dir) if filename_pattern in f and f.endswith('.backup')]
-            if not backup_files:
-                return None
-            
-            # 最新のバックアップファイルを選択
-            latest_backup = sorted(backup_files)[-1]
-            backup_path = os.path.join(self.backup_dir, latest_backup)
-            
-            with open(backup_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            
-            print(f"バックアップから復元: {backup_path}")
-            return data
+            with self._locked():
+                entries = self._entries(filename_pattern)
+                if entries:
+                    data = self._reconstruct(entries, len(entries) - 1)
+                    print(f"バックアップから復元: {entries[-1]['file']}")
+                    return data
+            return self._restore_legacy_file(filename_pattern)
         except Exception as e:
             print(f"復元エラー: {e}")
             return None
-    
-    def auto_backup_payments(self, payments_data):
-        """支払データの自動バックアップ"""
-        if payments_data:
-            self.backup_to_file(payments_data, "payments")
-            # 圧縮版も作成
-            compressed = self.compress_and_encode(payments_data)
-            if compressed:
-                with open(os.path.join(self.backup_dir, "payments_compressed.txt"), 'w') as f:
-                    f.write(compressed)
-    
+
+    # ---- 履歴の参照・時点指定の復元 ----
+
+    def list_entries(self, name):
+        """系列のバックアップ一覧（インデックスの情報のみ・古い順）"""
+        with self._locked():
+            return [dict(entry) for entry in self._entries(name)]
+
+    def list_series(self):
+        """バックアップの系列名一覧"""
+        with self._locked():
+            return sorted(self._load_index()['series'])
+
+    def find_entry(self, name, timestamp=None, entry_id=None):
+        """id または指定時刻以前で最新のバックアップの位置を取得（該当なしは None、日時の形式が不正な場合は ValueError）"""
+        with self._locked():
+            entries = self._entries(name)
+            if entry_id is not None:
+                for position, entry in enumerate(entries):
+                    if entry['id'] == entry_id:
+                        return position
+                return None
+            if timestamp is None:
+                return len(entries) - 1 if entries else None
+            timestamp = _local_timestamp(timestamp)
+            # 一覧は時刻順のため二分探索
+            position = bisect_right(entries, timestamp, key=lambda entry: _local_timestamp(entry['timestamp'])) - 1
+            return position if position >= 0 else None
+
+    def load_entry(self, name, position):
+        """指定位置のバックアップの内容を復元（直前のスナップショットと差分のみ読み込む）"""
+        with self._locked():
+            return self._reconstruct(self._entries(name), position)
+
+    def find_record(self, name, position, record_id):
+        """指定位置の時点の1レコードを取得（新しい差分から順に探し、スナップショットで打ち切る）"""
+        key = str(record_id)
+        with self._locked():
+            entries = self._entries(name)
+            for entry in reversed(entries[:position + 1]):
+                payload = self._read_blob(entry['file'])
+                if entry['kind'] == 'snapshot':
+                    for record in payload['data']:
+                        if isinstance(record, dict) and str(record.get('id')) == key:
+                            return record
+                    return None
+                if key in payload['upsert']:
+                    return payload['upsert'][key]
+                if key in payload['delete']:
+                    return None
+        return None
+
+    # ---- 保持ポリシー ----
+
+    def _select_retained(self, entries, now=None):
+        """保持ポリシーに従って残すバックアップの id を選択"""
+        retained = {entry['id'] for entry in entries[-KEEP_RECENT:]}
+        for period, count in RETENTION_POLICY:
+            buckets = set()
+            for entry in reversed(entries):
+                bucket = _bucket(datetime.fromisoformat(entry['timestamp']), period)
+                if bucket in buckets:
+                    continue
+                if len(buckets) >= count:
+                    break
+                buckets.add(bucket)
+                retained.add(entry['id'])
+        return retained
+
+    def _apply_retention_if_due(self, name):
+        index = self._load_index()
+        last = index['last_retention'].get(name, 0)
+        if time.time() - last >= RETENTION_INTERVAL or len(self._entries(name)) > MAX_ENTRIES:
+            self.apply_retention(name)
+
+    def apply_retention(self, name):
+        """保持ポリシーから外れたバックアップを削除し、残したバックアップの差分の連鎖を詰め直す"""
+        with self._locked():
+            index = self._load_index()
+            entries = self._entries(name)
+            index['last_retention'][name] = time.time()
+            retained = self._select_retained(entries)
+            if len(retained) == len(entries):
+                return 0
+
+            new_entries = []
+            index['series'][name] = new_entries
+            previous = None       # 直前に残したバックアップの状態
+            previous_kept_id = None
+            removed_files = []
+            for position, entry in enumerate(entries):
+                keep = entry['id'] in retained
+                # 連鎖が途切れない（スナップショットか、親を残している）ものはそのまま残す
+                unchanged = keep and (entry['kind'] == 'snapshot' or entry['parent'] == previous_kept_id)
+                if not keep or not unchanged:
+                    removed_files.append(entry['file'])
+                if not keep:
+                    continue
+
+                if unchanged:
+                    new_entries.append(entry)
+                    previous = None
+                else:
+                    # 連鎖を詰め直すため、直前に残したバックアップとの差分として書き直す
+                    data = self._reconstruct(entries, position)
+                    state = _build_state(None, data)
+                    if previous is None and new_entries:
+                        previous = _build_state(new_entries[-1]['id'],
+                                                self._reconstruct(new_entries, len(new_entries) - 1))
+                    timestamp = datetime.fromisoformat(entry['timestamp'])
+                    self._append_entry(name, data, state, timestamp, previous)
+                    previous = state
+                previous_kept_id = new_entries[-1]['id']
+
+            self._states.pop(name, None)
+            self._save_index()
+            for filename in removed_files:
+                path = os.path.join(self.backup_dir, filename)
+                if os.path.exists(path):
+                    os.remove(path)
+            print(f"バックアップ整理: {name} {len(entries)}件 -> {len(new_entries)}件")
+            return len(entries) - len(new_entries)
+
+    # ---- 従来形式の取り込み ----
+
+    def _migrate_legacy_backups(self):
+        """従来形式（系列名_YYYYmmdd_HHMMSS.backup）のバックアップをインデックスに取り込んで削除"""
+        try:
+            legacy_files = sorted(f for f in os.listdir(self.backup_dir) if f.endswith('.backup'))
+        except OSError:
+            return
+        for filename in legacy_files:
+            name, _, stamp = filename[:-len('.backup')].rpartition('_')
+            name, _, date_part = name.rpartition('_')
+            try:
+                timestamp = datetime.strptime(f"{date_part}_{stamp}", '%Y%m%d_%H%M%S')
+                with open(os.path.join(self.backup_dir, filename), 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except (ValueError, OSError) as e:
+                print(f"従来形式のバックアップを取り込めませんでした: {filename} ({e})")
+                continue
+            previous = self._current_state(name)
+            state = _build_state(None, data)
+            if previous is None or previous.content_hash != state.content_hash:
+                self._append_entry(name, data, state, timestamp, previous)
+            os.remove(os.path.join(self.backup_dir, filename))
+        if legacy_files:
+            print(f"従来形式のバックアップを取り込みました: {len(legacy_files)}件")
+
+    # ---- 状態確認 ----
+
+    def backup_status(self):
+        """バックアップの一覧（古い順）と系列ごとの概要をインデックスから取得"""
+        with self._locked():
+            index = self._load_index()
+            backup_files = []
+            series = {}
+            for name, entries in index['series'].items():
+                for entry in entries:
+                    backup_files.append({
+                        'filename': entry['file'],
+                        'series': name,
+                        'kind': entry['kind'],
+                        'size': entry['size'],
+                        'count': entry.get('count'),
+                        'modified': entry['timestamp'],
+                    })
+                series[name] = {
+                    'count': len(entries),
+                    'snapshots': sum(1 for entry in entries if entry['kind'] == 'snapshot'),
+                    'total_size': sum(entry['size'] for entry in entries),
+                    'latest': entries[-1]['timestamp'] if entries else None,
+                }
+            backup_files.sort(key=lambda item: item['modified'])
+            return backup_files, series
+
+    # ---- アーカイブ ----
+
+    def register_archive_source(self, name, path):
+        """アーカイブに含めるファイル・ディレクトリを登録（支払データは 'payments' で登録）"""
+        self.archive_sources[name] = path
+
+    def _archive_sections(self, payments_data, serialized):
+        """アーカイブのセクション一覧（ファイルは書き込み時に少しずつ読み込む）"""
+        if serialized is not None:
+            yield {'name': 'payments', 'kind': 'json', 'text': serialized, 'count': len(payments_data)}
+        else:
+            yield {'name': 'payments', 'kind': 'json', 'data': payments_data}
+        for name, path in self.archive_sources.items():
+            if name == 'payments':
+                continue
+            if os.path.isdir(path):
+                for filename in sorted(os.listdir(path)):
+                    file_path = os.path.join(path, filename)
+                    if os.path.isfile(file_path):
+                        yield {'name': f"{name}/{filename}", 'kind': 'file', 'path': file_path}
+            elif os.path.exists(path):
+                yield {'name': name, 'kind': 'json' if path.endswith('.json') else 'file', 'path': path}
+
+    def write_archive(self, payments_data, serialized=None):
+        """業者・支払・アップロードファイルをまとめたアーカイブを作成"""
+        try:
+            # 一時ファイル名が固定のため、別のワーカーと同時に書き込まない
+            with self._locked():
+                manifest = backup_archive.write_archive(self.archive_path,
+                                                        self._archive_sections(payments_data, serialized))
+            print(f"アーカイブ作成: {self.archive_path}（{len(manifest['sections'])}セクション）")
+            return manifest
+        except Exception as e:
+            print(f"アーカイブ作成エラー: {e}")
+            return None
+
+    def archive_status(self):
+        """アーカイブのマニフェストを取得"""
+        if not os.path.exists(self.archive_path):
+            return None
+        try:
+            with backup_archive.ArchiveReader(self.archive_path) as reader:
+                return reader.manifest
+        except (backup_archive.ArchiveError, OSError) as e:
+            print(f"アーカイブ読み込みエラー: {e}")
+            return None
+
+    def restore_archive(self, names=None):
+        """アーカイブから登録済みのファイル・ディレクトリへ少しずつ展開して復元（チェックサム検証付き）"""
+        restored = []
+        with backup_archive.ArchiveReader(self.archive_path) as reader:
+            for section in reader.sections:
+                source, _, member = section['name'].partition('/')
+                if names is not None and source not in names:
+                    continue
+                path = self.archive_sources.get(source)
+                if path is None:
+                    continue
+                target = backup_archive.member_path(path, member) if member else path
+                reader.extract(section['name'], target)
+                restored.append(section['name'])
+        return restored
+
+    def auto_backup_payments(self, payments_data, serialized=None):
+        """支払データの自動バックアップ（serialized: 保存時にJSON化した文字列があればアーカイブに再利用）"""
+        if not payments_data:
+            return None
+        with self._locked():
+            entries = self._entries("payments")
+            latest_file = entries[-1]['file'] if entries else None
+            backup_path = self.backup_to_file(payments_data, "payments")
+        # 内容が変わらず保存しなかった場合はアーカイブも更新しない
+        if backup_path is None or os.path.basename(backup_path) == latest_file:
+            return backup_path
+        # 業者・アップロードファイルを含めたアーカイブも作成
+        self.write_archive(payments_data, serialized)
+        return backup_path
+
     def auto_restore_payments(self):
         """支払データの自動復元"""
         # まず通常のバックアップから試行
         data = self.restore_from_file("payments")
         if data:
             return data
-        
-        # 圧縮版から復元を試行
+
+        # アーカイブから復元を試行
         try:
-            compressed_file = os.path.join(self.backup_dir, "payments_compressed.txt")
+            if os.path.exists(self.archive_path):
+                with backup_archive.ArchiveReader(self.archive_path) as reader:
+                    data = reader.load_json('payments')
+                if data:
+                    print("アーカイブから復元成功")
+                    return data
+        except Exception as e:
+            print(f"アーカイブ復元エラー: {e}")
+
+        # 従来形式の圧縮版から復元を試行
+        try:
+            compressed_file = os.path.join(self.backup_dir, LEGACY_COMPRESSED_FILENAME)
             if os.path.exists(compressed_file):
                 with open(compressed_file, 'r') as f:
                     compressed_data = f.read()
@@ -113,7 +675,7 @@ class DataPersistenceManager:
                     return data
         except Exception as e:
             print(f"圧縮バックアップ復元エラー: {e}")
-        
+
         return None
 
 # グローバルインスタンス
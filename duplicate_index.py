@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+二重支払の検出用索引
+（支払日, 振込先口座, 金額）をキーに既存の支払表の明細を保持し、新しい支払表の明細ごとに
+同じ支払日・同じ口座・同じ金額の支払いがすでにあるかを、履歴を走査せずに調べる
+
+索引は最初に使うときに支払履歴から作成し、支払表の作成・削除時に差分で更新する
+他のプロセス（gunicornの別ワーカー）や復元で支払データのファイルが更新された場合は、
+ファイルの更新日時・サイズの変化で検知して作り直す
+"""
+import os
+import threading
+
+import payment_exports
+from payment_exports import account_key
+
+
+def _amount(item):
+    try:
+        return int(item.get('amount'))
+    except (TypeError, ValueError):
+        return None
+
+
+def _file_signature(filepath):
+    try:
+        stat = os.stat(filepath)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class DuplicateIndex:
+    """二重支払の検出用索引クラス"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._index = {}        # (支払日, 口座キー, 金額) -> [(支払表ID, 明細ID), ...]
+        self._signature = None  # 索引に反映済みの支払データファイルの状態
+        self.rebuilds = 0
+
+    def _item_keys(self, payment, vendor_map):
+        """支払表の明細ごとの (索引キー, 受取人名)（振込先の口座・金額が不明な明細の索引キーは None）"""
+        payment_date = payment.get('payment_date')
+        keys = []
+        for item in payment.get('items') or []:
+            recipient = payment_exports.item_recipient(item, vendor_map)
+            amount = _amount(item)
+            if recipient and account_key(recipient) is not None and amount is not None:
+                keys.append(((payment_date, account_key(recipient), amount), recipient['name']))
+            else:
+                keys.append((None, item.get('vendor_name', '')))
+        return keys
+
+    def _add(self, payment, vendor_map):
+        for item, (key, _) in zip(payment.get('items') or [], self._item_keys(payment, vendor_map)):
+            if key is not None:
+                self._index.setdefault(key, []).append((payment.get('id'), item.get('id')))
+
+    def sync(self, filepath, load_payments, load_vendors):
+        """支払データのファイルが索引作成時から変わっていれば作り直す"""
+        signature = _file_signature(filepath)
+        with self._lock:
+            if signature is not None and signature == self._signature:
+                return
+            payments = load_payments()
+            # 口座情報のスナップショットがない以前の明細のみ業者マスターを参照する
+            vendor_map = {}
+            if any('recipient' not in item for payment in payments for item in payment.get('items') or []):
+                vendor_map = {v['id']: v for v in load_vendors()}
+            self._index = {}
+            for payment in payments:
+                self._add(payment, vendor_map)
+            self._signature = signature
+            self.rebuilds += 1
+
+    def add_payment(self, payment, filepath):
+        """作成した支払表を索引に追加（保存後に呼ぶ）"""
+        with self._lock:
+            self._add(payment, {})
+            self._signature = _file_signature(filepath)
+
+    def remove_payment(self, payment, filepath):
+        """削除した支払表を索引から除く（保存後に呼ぶ）"""
+        with self._lock:
+            if any('recipient' not in item for item in payment.get('items') or []):
+                # 以前の明細は振込先口座を業者マスターから求めて索引に入れたため、次回使うときに作り直す
+                self._signature = None
+                return
+            payment_id = payment.get('id')
+            for key, _ in self._item_keys(payment, {}):
+                entries = self._index.get(key) if key is not None else None
+                if not entries:
+                    continue
+                entries[:] = [entry for entry in entries if entry[0] != payment_id]
+                if not entries:
+                    del self._index[key]
+            self._signature = _file_signature(filepath)
+
+    def find(self, payment, vendor_map=None, exclude_payment_id=None):
+        """支払表の明細のうち、同じ支払日・口座・金額の支払いがすでにあるものを返す"""
+        duplicates = []
+        with self._lock:
+            keys = self._item_keys(payment, vendor_map or {})
+            for position, (item, (key, name)) in enumerate(zip(payment.get('items') or [], keys)):
+                if key is None:
+                    continue
+                matches = [
+                    {'payment_id': payment_id, 'item_id': item_id}
+                    for payment_id, item_id in self._index.get(key, ())
+                    if payment_id != exclude_payment_id
+                ]
+                if matches:
+                    duplicates.append({
+                        'index': position,
+                        'item_id': item.get('id'),
+                        'vendor_id': item.get('vendor_id'),
+                        'vendor_name': name,
+                        'amount': key[2],
+                        'account': key[1],
+                        'matches': matches,
+                    })
+        return duplicates
+
+    def status(self):
+        """索引の状態を取得"""
+        with self._lock:
+            return {'keys': len(self._index), 'rebuilds': self.rebuilds}
+
+
+# グローバルインスタンス
+duplicate_index = DuplicateIndex()
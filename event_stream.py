@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+変更通知（Server-Sent Events）ユーティリティ
+支払表の作成・削除、業者データの変更、アップロードファイルの追加・削除、PDFの生成完了を
+/api/events で接続中のブラウザへ通知し、一覧の再取得をなくす
+
+通知は events.jsonl に連番付きで追記し、各プロセスは直近の通知をリングバッファに保持する
+（gunicorn の別ワーカーで発生した通知もファイルから読み取って配信する）
+再接続したブラウザは Last-Event-ID 以降の通知をリングバッファから受け取る（古すぎる場合は reset を通知）
+
+gthread ワーカーでは接続ごとにスレッドを1つ使うため、1プロセスあたりの接続数と接続時間に上限を設け、
+上限に達した接続は閉じてブラウザの自動再接続に任せる
+
+環境変数:
+    EVENTS_ENABLED         0 の場合は通知を行わない（既定: 1）
+    EVENTS_BUFFER          再接続時に送り直す通知の件数（既定: 200）
+    EVENTS_MAX_CLIENTS     1プロセスあたりの最大接続数（既定: 2）
+    EVENTS_STREAM_SECONDS  1回の接続の最大時間（秒、既定: 300）
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows ではプロセス間のロックを行わない
+    fcntl = None
+
+EVENTS_FILE = 'events.jsonl'
+HEARTBEAT_SECONDS = 15
+POLL_SECONDS = 1.0
+RETRY_MS = 3000
+
+
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+class EventStreamFull(Exception):
+    """接続数が上限に達している"""
+
+
+class _Connection:
+    """1つの接続（終了・切断時に接続数を戻す。送信前に切断された場合も close で戻す）"""
+
+    def __init__(self, stream, generator):
+        self._stream = stream
+        self._generator = generator
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._generator)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._generator.close()
+            self._stream._release()
+
+
+class EventStream:
+    """変更通知の記録・配信クラス"""
+
+    def __init__(self, filepath=EVENTS_FILE):
+        self.filepath = filepath
+        self.enabled = os.environ.get('EVENTS_ENABLED', '1') != '0'
+        self.buffer_size = max(1, _env_int('EVENTS_BUFFER', 200))
+        self.max_clients = _env_int('EVENTS_MAX_CLIENTS', 2)
+        self.stream_seconds = _env_int('EVENTS_STREAM_SECONDS', 300)
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+        self._events = deque(maxlen=self.buffer_size)  # (連番, 種類, データ)
+        self._file_id = None  # 読み込み済みのファイル（inode）
+        self._offset = 0
+        self._clients = 0
+        self.published = 0
+
+    @contextmanager
+    def _file_lock(self):
+        if fcntl is None:
+            yield
+            return
+        with open(self.filepath + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _sync(self):
+        """ファイルに追記された通知をリングバッファへ読み込む（self._lock の中で呼ぶ）"""
+        try:
+            stat = os.stat(self.filepath)
+        except OSError:
+            return
+        file_id = (stat.st_dev, stat.st_ino)
+        if file_id != self._file_id or stat.st_size < self._offset:
+            # 切り詰め（置き換え）られた場合は先頭から読み直す
+            self._file_id = file_id
+            self._offset = 0
+            self._events.clear()
+        if stat.st_size == self._offset:
+            return
+        with open(self.filepath, 'rb') as f:
+            f.seek(self._offset)
+            data = f.read()
+        # 書き込み途中の行は次回に読む
+        complete = data[:data.rfind(b'\n') + 1]
+        self._offset += len(complete)
+        for line in complete.splitlines():
+            if line.strip():
+                record = json.loads(line)
+                self._events.append((record['id'], record['event'], record['data']))
+
+    def _last_id(self):
+        return self._events[-1][0] if self._events else 0
+
+    def publish(self, event, data):
+        """通知を記録して接続中のブラウザへ配信（失敗しても呼び出し元の処理は続ける）"""
+        if not self.enabled:
+            return None
+        try:
+            with self._file_lock(), self._condition:
+                self._sync()
+                event_id = self._last_id() + 1
+                line = json.dumps({'id': event_id, 'event': event, 'data': data}, ensure_ascii=False) + '\n'
+                if self._offset > 0 and len(self._events) >= self.buffer_size and self._offset > self.buffer_size * 1024:
+                    # ファイルが大きくなったら直近の通知だけを残して書き直す
+                    self._compact(line)
+                else:
+                    with open(self.filepath, 'a', encoding='utf-8') as f:
+                        f.write(line)
+                self._sync()
+                self.published += 1
+                self._condition.notify_all()
+                return event_id
+        except Exception as e:
+            print(f"変更通知エラー: {e}")
+            return None
+
+    def _compact(self, line):
+        temp_path = self.filepath + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            for event_id, event, data in self._events:
+                f.write(json.dumps({'id': event_id, 'event': event, 'data': data}, ensure_ascii=False) + '\n')
+            f.write(line)
+        os.replace(temp_path, self.filepath)
+
+    @staticmethod
+    def format(event_id, event, data):
+        """SSE形式のメッセージ"""
+        return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    def _pending(self, last_id):
+        """last_id より後の通知（リングバッファから消えた通知がある場合は reset を先頭に付ける）"""
+        events = [entry for entry in self._events if entry[0] > last_id]
+        oldest = self._events[0][0] if self._events else 0
+        current = self._last_id()
+        if (last_id and oldest > last_id + 1) or last_id > current:
+            # 取りこぼした通知がある・不明な連番の場合は一覧の取り直しを依頼する
+            return [(current, 'reset', {})]
+        return events
+
+    def open(self, last_id):
+        """接続を受け付けて通知を返すイテレーターを作成（接続数が上限の場合は EventStreamFull）"""
+        with self._lock:
+            if self._clients >= self.max_clients:
+                raise EventStreamFull()
+            self._clients += 1
+            self._sync()
+            if last_id is None:
+                # 初回接続は現在以降の通知のみ
+                last_id = self._last_id()
+        return _Connection(self, self._stream(last_id))
+
+    def _release(self):
+        with self._lock:
+            self._clients -= 1
+
+    def _stream(self, last_id):
+        yield f"retry: {RETRY_MS}\n\n"
+        deadline = time.monotonic() + self.stream_seconds
+        last_sent = time.monotonic()
+        while time.monotonic() < deadline:
+            with self._condition:
+                self._sync()
+                events = self._pending(last_id)
+                if not events:
+                    # 同じプロセスの通知はすぐに、別プロセスの通知はファイルを定期的に確認して受け取る
+                    self._condition.wait(POLL_SECONDS)
+                    self._sync()
+                    events = self._pending(last_id)
+            for event_id, event, data in events:
+                last_id = event_id
+                last_sent = time.monotonic()
+                yield self.format(event_id, event, data)
+            if time.monotonic() - last_sent >= HEARTBEAT_SECONDS:
+                last_sent = time.monotonic()
+                yield ": keepalive\n\n"
+
+    def status(self):
+        """通知の状態を取得"""
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'clients': self._clients,
+                'max_clients': self.max_clients,
+                'last_event_id': self._last_id(),
+                'published': self.published,
+            }
+
+
+# グローバルインスタンス
+event_stream = EventStream()
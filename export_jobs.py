@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+支払履歴Excelのバックグラウンド作成
+期間が長く明細の多いエクスポートはリクエスト内で待たずにバックグラウンドで作成し、
+ブラウザは状態を定期的に確認して、完成したファイルをダウンロードする
+
+作成の状態は temp/exports/<ジョブID>.json に保存するため、gunicorn の別ワーカーからも確認・ダウンロードできる
+作成したファイルは保持期間を過ぎると次の作成時に削除する
+
+環境変数:
+    EXPORT_ASYNC_ITEMS       この明細数を超えるエクスポートをバックグラウンドで作成（既定: 5000）
+    EXPORT_RETENTION_HOURS   作成したファイルの保持時間（既定: 24）
+"""
+import json
+import os
+import threading
+import time
+import uuid
+
+from worker_pool import worker_pool
+import payment_exports
+
+EXPORT_FOLDER = os.path.join('temp', 'exports')
+
+
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+class ExportJobs:
+    """支払履歴Excelの作成ジョブ管理クラス"""
+
+    def __init__(self, folder=EXPORT_FOLDER):
+        self.folder = folder
+        self.async_items = _env_int('EXPORT_ASYNC_ITEMS', 5000)
+        self.retention_seconds = _env_int('EXPORT_RETENTION_HOURS', 24) * 3600
+        self.started = 0
+        self.failed = 0
+
+    def _path(self, job_id, ext):
+        return os.path.join(self.folder, f"{job_id}.{ext}")
+
+    def _write_state(self, job_id, state):
+        temp_path = self._path(job_id, 'json.tmp')
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(temp_path, self._path(job_id, 'json'))
+
+    def _cleanup(self):
+        """保持期間を過ぎたファイルを削除"""
+        cutoff = time.time() - self.retention_seconds
+        for filename in os.listdir(self.folder):
+            path = os.path.join(self.folder, filename)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def should_run_async(self, payments):
+        """バックグラウンドで作成する量か"""
+        return sum(len(payment.get('items') or []) for payment in payments) > self.async_items
+
+    def export(self, payments, vendors):
+        """リクエスト内で作成してファイルのパスを返す（別プロセスで実行）"""
+        os.makedirs(self.folder, exist_ok=True)
+        self._cleanup()
+        path = self._path(uuid.uuid4().hex, 'xlsx')
+        worker_pool.run(payment_exports.generate_payment_excel, payments, vendors, path)
+        return path
+
+    def start(self, payments, vendors, filename):
+        """バックグラウンドでの作成を開始してジョブIDを返す"""
+        os.makedirs(self.folder, exist_ok=True)
+        self._cleanup()
+        job_id = uuid.uuid4().hex
+        self._write_state(job_id, {'status': 'running', 'filename': filename,
+                                   'created_at': time.time()})
+        self.started += 1
+        thread = threading.Thread(target=self._run, args=(job_id, payments, vendors, filename),
+                                  name=f'export-{job_id[:8]}', daemon=True)
+        thread.start()
+        return job_id
+
+    def _run(self, job_id, payments, vendors, filename):
+        started = time.time()
+        try:
+            payment_count, item_count = worker_pool.run(
+                payment_exports.generate_payment_excel, payments, vendors, self._path(job_id, 'xlsx'))
+        except Exception as e:
+            print(f"Excel作成エラー: {e}")
+            self.failed += 1
+            self._write_state(job_id, {'status': 'failed', 'filename': filename, 'error': str(e),
+                                       'created_at': started})
+            return
+        self._write_state(job_id, {'status': 'done', 'filename': filename, 'created_at': started,
+                                   'payment_count': payment_count, 'item_count': item_count,
+                                   'seconds': round(time.time() - started, 2)})
+
+    def get(self, job_id):
+        """ジョブの状態（不明なジョブIDは None）"""
+        if not job_id.isalnum():
+            return None
+        try:
+            with open(self._path(job_id, 'json'), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def file_path(self, job_id):
+        """作成したファイルのパス"""
+        return self._path(job_id, 'xlsx')
+
+    def status(self):
+        """作成状況を取得"""
+        return {'async_items': self.async_items, 'started': self.started, 'failed': self.failed}
+
+
+# グローバルインスタンス
+export_jobs = ExportJobs()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+gunicorn の設定
+gunicorn -c gunicorn.conf.py wsgi:app
+
+- gthread ワーカー: ファイル入出力待ちの多いリクエストをスレッドで並行処理する
+- preload_app: マスタープロセスでアプリケーションを読み込んでから fork し、
+  読み込み済みのモジュール・データをワーカー間で共有する（copy-on-write）
+- max_requests: 一定数のリクエストを処理したワーカーを入れ替え、メモリの増加を抑える
+  （jitter で全ワーカーが同時に入れ替わらないようにする）
+- timeout: 大きな支払表のPDF生成・振込ファイル出力が打ち切られない長さにする
+
+ワーカーごとにバックアップのスケジューラーが動くため、バックアップの一覧（backups/index.json）の更新は
+ファイルロックで排他している。/metrics の計測値はワーカーごとの値（pid ラベルで区別）
+
+環境変数:
+    PORT                     待ち受けポート（既定: 5000）
+    WEB_CONCURRENCY          ワーカー数（既定: 2）
+    GUNICORN_THREADS         ワーカーあたりのスレッド数（既定: 4）
+    GUNICORN_TIMEOUT         リクエストの最大処理時間（秒、既定: 120）
+    GUNICORN_MAX_REQUESTS    ワーカーを入れ替えるまでのリクエスト数（既定: 1000、0 で無効）
+"""
+import os
+
+
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = _env_int('WEB_CONCURRENCY', 2)
+worker_class = 'gthread'
+threads = _env_int('GUNICORN_THREADS', 4)
+preload_app = True
+
+max_requests = _env_int('GUNICORN_MAX_REQUESTS', 1000)
+max_requests_jitter = max_requests // 10
+
+timeout = _env_int('GUNICORN_TIMEOUT', 120)
+graceful_timeout = 30  # 終了時に未実行のバックアップを書き出す時間
+keepalive = 5
+
+accesslog = '-'
+errorlog = '-'
+
+
+def post_worker_init(worker):
+    """ワーカー起動後にバックグラウンドでウォームアップ（フォント登録・マスター読み込み）を開始"""
+    from warmup import warmup
+    warmup.start()
+
+
+def worker_exit(server, worker):
+    """ワーカー終了時（max_requests による入れ替えを含む）に未実行のバックアップを書き出し、
+    PDF生成・振込ファイル出力用のプロセスを停止する"""
+    from backup_scheduler import backup_scheduler
+    from worker_pool import worker_pool
+    backup_scheduler.flush()
+    worker_pool.shutdown()
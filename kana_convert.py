@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+半角カナ・半角英数字変換ユーティリティ
+銀行振込ファイル用に全角文字を半角へ変換する
+"""
+import unicodedata
+
+from app_logging import get_logger
+
+logger = get_logger('kana')
+
+# 全角カタカナから半角カタカナへの変換マップ
+KANA_HANKAKU_MAP = {
+    # 基本カタカナ
+    'ア': 'ｱ', 'イ': 'ｲ', 'ウ': 'ｳ', 'エ': 'ｴ', 'オ': 'ｵ',
+    'カ': 'ｶ', 'キ': 'ｷ', 'ク': 'ｸ', 'ケ': 'ｹ', 'コ': 'ｺ',
+    'サ': 'ｻ', 'シ': 'ｼ', 'ス': 'ｽ', 'セ': 'ｾ', 'ソ': 'ｿ',
+    'タ': 'ﾀ', 'チ': 'ﾁ', 'ツ': 'ﾂ', 'テ': 'ﾃ', 'ト': 'ﾄ',
+    'ナ': 'ﾅ', 'ニ': 'ﾆ', 'ヌ': 'ﾇ', 'ネ': 'ﾈ', 'ノ': 'ﾉ',
+    'ハ': 'ﾊ', 'ヒ': 'ﾋ', 'フ': 'ﾌ', 'ヘ': 'ﾍ', 'ホ': 'ﾎ',
+    'マ': 'ﾏ', 'ミ': 'ﾐ', 'ム': 'ﾑ', 'メ': 'ﾒ', 'モ': 'ﾓ',
+    'ヤ': 'ﾔ', 'ユ': 'ﾕ', 'ヨ': 'ﾖ',
+    'ラ': 'ﾗ', 'リ': 'ﾘ', 'ル': 'ﾙ', 'レ': 'ﾚ', 'ロ': 'ﾛ',
+    'ワ': 'ﾜ', 'ヲ': 'ｦ', 'ン': 'ﾝ',
+    # 濁音・半濁音
+    'ガ': 'ｶﾞ', 'ギ': 'ｷﾞ', 'グ': 'ｸﾞ', 'ゲ': 'ｹﾞ', 'ゴ': 'ｺﾞ',
+    'ザ': 'ｻﾞ', 'ジ': 'ｼﾞ', 'ズ': 'ｽﾞ', 'ゼ': 'ｾﾞ', 'ゾ': 'ｿﾞ',
+    'ダ': 'ﾀﾞ', 'ヂ': 'ﾁﾞ', 'ヅ': 'ﾂﾞ', 'デ': 'ﾃﾞ', 'ド': 'ﾄﾞ',
+    'バ': 'ﾊﾞ', 'ビ': 'ﾋﾞ', 'ブ': 'ﾌﾞ', 'ベ': 'ﾍﾞ', 'ボ': 'ﾎﾞ',
+    'パ': 'ﾊﾟ', 'ピ': 'ﾋﾟ', 'プ': 'ﾌﾟ', 'ペ': 'ﾍﾟ', 'ポ': 'ﾎﾟ',
+    # 小文字
+    'ァ': 'ｧ', 'ィ': 'ｨ', 'ゥ': 'ｩ', 'ェ': 'ｪ', 'ォ': 'ｫ',
+    'ッ': 'ｯ', 'ャ': 'ｬ', 'ュ': 'ｭ', 'ョ': 'ｮ',
+    # 記号類
+    'ー': 'ｰ', '・': '･', '　': ' ',
+    # ピリオド関連（さまざまな種類に対応）
+    '.': '.', '．': '.', '․': '.', '‥': '.', '…': '.',
+    # ハイフン・マイナス記号
+    '-': '-', '－': '-', '−': '-', '–': '-', '—': '-',
+    # その他の記号
+    '(': '(', '（': '(', ')': ')', '）': ')',  # 括弧
+    ' ': ' ', '　': ' ',  # スペース
+    # ひらがなも対応
+    'あ': 'ｱ', 'い': 'ｲ', 'う': 'ｳ', 'え': 'ｴ', 'お': 'ｵ',
+    'か': 'ｶ', 'き': 'ｷ', 'く': 'ｸ', 'け': 'ｹ', 'こ': 'ｺ',
+    'さ': 'ｻ', 'し': 'ｼ', 'す': 'ｽ', 'せ': 'ｾ', 'そ': 'ｿ',
+    'た': 'ﾀ', 'ち': 'ﾁ', 'つ': 'ﾂ', 'て': 'ﾃ', 'と': 'ﾄ',
+    'な': 'ﾅ', 'に': 'ﾆ', 'ぬ': 'ﾇ', 'ね': 'ﾈ', 'の': 'ﾉ',
+    'は': 'ﾊ', 'ひ': 'ﾋ', 'ふ': 'ﾌ', 'へ': 'ﾍ', 'ほ': 'ﾎ',
+    'ま': 'ﾏ', 'み': 'ﾐ', 'む': 'ﾑ', 'め': 'ﾒ', 'も': 'ﾓ',
+    'や': 'ﾔ', 'ゆ': 'ﾕ', 'よ': 'ﾖ',
+    'ら': 'ﾗ', 'り': 'ﾘ', 'る': 'ﾙ', 'れ': 'ﾚ', 'ろ': 'ﾛ',
+    'わ': 'ﾜ', 'を': 'ｦ', 'ん': 'ﾝ',
+    # ひらがな濁音・半濁音
+    'が': 'ｶﾞ', 'ぎ': 'ｷﾞ', 'ぐ': 'ｸﾞ', 'げ': 'ｹﾞ', 'ご': 'ｺﾞ',
+    'ざ': 'ｻﾞ', 'じ': 'ｼﾞ', 'ず': 'ｽﾞ', 'ぜ': 'ｾﾞ', 'ぞ': 'ｿﾞ',
+    'だ': 'ﾀﾞ', 'ぢ': 'ﾁﾞ', 'づ': 'ﾂﾞ', 'で': 'ﾃﾞ', 'ど': 'ﾄﾞ',
+    'ば': 'ﾊﾞ', 'び': 'ﾋﾞ', 'ぶ': 'ﾌﾞ', 'べ': 'ﾍﾞ', 'ぼ': 'ﾎﾞ',
+    'ぱ': 'ﾊﾟ', 'ぴ': 'ﾋﾟ', 'ぷ': 'ﾌﾟ', 'ぺ': 'ﾍﾟ', 'ぽ': 'ﾎﾟ',
+    # ひらがな小文字
+    'ぁ': 'ｧ', 'ぃ': 'ｨ', 'ぅ': 'ｩ', 'ぇ': 'ｪ', 'ぉ': 'ｫ',
+    'っ': 'ｯ', 'ゃ': 'ｬ', 'ゅ': 'ｭ', 'ょ': 'ｮ'
+}
+
+
+def to_halfwidth_kana(text):
+    """全角カナを半角カナに変換"""
+    if not text:
+        return ''
+    
+    # unicodedataを使用して正規化し、手動で変換マップを適用
+    # NFKC正規化で一部の全角文字を半角に変換
+    normalized = unicodedata.normalize('NFKC', text)
+    
+    result = ''
+    for char in normalized:
+        if char in KANA_HANKAKU_MAP:
+            result += KANA_HANKAKU_MAP[char]
+        elif char.isascii():  # ASCII文字はそのまま
+            result += char
+        elif char.isspace():  # スペース文字は半角スペースに
+            result += ' '
+        else:
+            # その他の文字は半角スペースに置換（銀行システム対応）
+            logger.debug("変換できない文字: '%s' (U+%04X) 入力: '%s'", char, ord(char), text)
+            result += ' '
+    
+    logger.debug("変換: '%s' -> '%s'", text, result)
+    return result
+
+
+def to_halfwidth_alphanumeric(text):
+    """全角英数字を半角英数字に変換"""
+    if not text:
+        return ''
+    
+    # unicodedataを使用して全角文字を半角に変換
+    result = unicodedata.normalize('NFKC', text)
+    
+    # さらに確実に半角に変換
+    zenkaku_to_hankaku = {
+        '０': '0', '１': '1', '２': '2', '３': '3', '４': '4',
+        '５': '5', '６': '6', '７': '7', '８': '8', '９': '9',
+        'Ａ': 'A', 'Ｂ': 'B', 'Ｃ': 'C', 'Ｄ': 'D', 'Ｅ': 'E',
+        'Ｆ': 'F', 'Ｇ': 'G', 'Ｈ': 'H', 'Ｉ': 'I', 'Ｊ': 'J',
+        'Ｋ': 'K', 'Ｌ': 'L', 'Ｍ': 'M', 'Ｎ': 'N', 'Ｏ': 'O',
+        'Ｐ': 'P', 'Ｑ': 'Q', 'Ｒ': 'R', 'Ｓ': 'S', 'Ｔ': 'T',
+        'Ｕ': 'U', 'Ｖ': 'V', 'Ｗ': 'W', 'Ｘ': 'X', 'Ｙ': 'Y', 'Ｚ': 'Z',
+        'ａ': 'a', 'ｂ': 'b', 'ｃ': 'c', 'ｄ': 'd', 'ｅ': 'e',
+        'ｆ': 'f', 'ｇ': 'g', 'ｈ': 'h', 'ｉ': 'i', 'ｊ': 'j',
+        'ｋ': 'k', 'ｌ': 'l', 'ｍ': 'm', 'ｎ': 'n', 'ｏ': 'o',
+        'ｐ': 'p', 'ｑ': 'q', 'ｒ': 'r', 'ｓ': 's', 'ｔ': 't',
+        'ｕ': 'u', 'ｖ': 'v', 'ｗ': 'w', 'ｘ': 'x', 'ｙ': 'y', 'ｚ': 'z'
+    }
+    
+    converted = ''
+    for char in result:
+        if char in zenkaku_to_hankaku:
+            converted += zenkaku_to_hankaku[char]
+        else:
+            converted += char
+    
+    return converted
+
+def find_unconvertible_chars(text):
+    """半角カナに変換できず半角スペースに置換される文字を取得"""
+    if not text:
+        return []
+    return [
+        char for char in unicodedata.normalize('NFKC', text)
+        if char not in KANA_HANKAKU_MAP and not char.isascii() and not char.isspace()
+    ]
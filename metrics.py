@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+リクエスト計測ユーティリティ
+ルートごとのレイテンシ・件数と、重い処理の段階ごとの処理時間を集計する
+Prometheusテキスト形式（/metrics）と Server-Timing ヘッダーで出力する
+環境変数 METRICS_ENABLED=1 のときのみ有効（無効時は計測処理を行わない）
+
+計測値はプロセスごとに集計する。gunicorn で複数のワーカーを起動している場合、/metrics は応答したワーカーの
+値のみを返すため、keiri_process_info の pid ラベルでワーカーを区別する（合計はスクレイプ側で集計する）
+"""
+import contextlib
+import functools
+import os
+import threading
+import time
+
+from flask import g, has_request_context, request
+
+# ヒストグラムのバケット境界（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_NULL_STAGE = contextlib.nullcontext()
+
+
+class Histogram:
+    """累積バケット方式のヒストグラム"""
+
+    __slots__ = ('buckets', 'counts', 'total', 'count')
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.total += value
+        self.count += 1
+
+    def render(self, name, labels):
+        """Prometheusテキスト形式の行を生成"""
+        label_text = ','.join(f'{key}="{_escape(value)}"' for key, value in labels)
+        prefix = f'{label_text},' if label_text else ''
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {self.count}')
+        lines.append(f'{name}_sum{{{label_text}}} {self.total:.6f}')
+        lines.append(f'{name}_count{{{label_text}}} {self.count}')
+        return lines
+
+
+def _escape(value):
+    """ラベル値のエスケープ"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class _StageTimer:
+    """処理段階の計測用コンテキストマネージャ"""
+
+    __slots__ = ('registry', 'name', 'start')
+
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.registry.observe_stage(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class MetricsRegistry:
+    """計測値の集計クラス"""
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._request_durations = {}   # (method, route) -> Histogram
+        self._request_counts = {}      # (method, route, status) -> 件数
+        self._stage_durations = {}     # stage -> Histogram
+        self._capture = threading.local()  # 記録せずに呼び出し元へ返す処理段階の時間（capture 中のみ）
+
+    def stage(self, name):
+        """処理段階の時間を計測（無効時は何もしない）"""
+        if not self.enabled:
+            return _NULL_STAGE
+        return _StageTimer(self, name)
+
+    def timed(self, name):
+        """関数全体の処理時間を計測するデコレータ（無効時は元の関数をそのまま返す）"""
+        def decorator(func):
+            if not self.enabled:
+                return func
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with _StageTimer(self, name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    @contextlib.contextmanager
+    def capture(self):
+        """この中で計測した処理段階の時間を記録せずに [(段階, 秒), ...] として受け取る
+        （ワーカープールのプロセスでの計測を、呼び出し元のプロセスで記録するために使う）"""
+        captured = []
+        self._capture.stages = captured
+        try:
+            yield captured
+        finally:
+            self._capture.stages = None
+
+    def observe_stage(self, name, seconds):
+        """処理段階の時間を記録（リクエスト中であれば Server-Timing 用にも保持）"""
+        captured = getattr(self._capture, 'stages', None)
+        if captured is not None:
+            captured.append((name, seconds))
+            return
+        with self._lock:
+            histogram = self._stage_durations.get(name)
+            if histogram is None:
+                histogram = self._stage_durations[name] = Histogram()
+            histogram.observe(seconds)
+        if has_request_context():
+            timings = g.setdefault('stage_timings', {})
+            timings[name] = timings.get(name, 0.0) + seconds
+
+    def observe_request(self, method, route, status, seconds):
+        """リクエストの処理時間と件数を記録"""
+        with self._lock:
+            histogram = self._request_durations.get((method, route))
+            if histogram is None:
+                histogram = self._request_durations[(method, route)] = Histogram()
+            histogram.observe(seconds)
+            key = (method, route, status)
+            self._request_counts[key] = self._request_counts.get(key, 0) + 1
+
+    def init_app(self, app):
+        """Flaskアプリケーションに計測用のフックを登録"""
+        if not self.enabled:
+            return
+
+        @app.before_request
+        def _start_request_timer():
+            g.request_start = time.perf_counter()
+
+        @app.after_request
+        def _record_request(response):
+            start = g.pop('request_start', None)
+            if start is None:
+                return response
+            elapsed = time.perf_counter() - start
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            self.observe_request(request.method, route, response.status_code, elapsed)
+
+            entries = [f'{name};dur={seconds * 1000:.2f}' for name, seconds in g.pop('stage_timings', {}).items()]
+            entries.append(f'total;dur={elapsed * 1000:.2f}')
+            response.headers['Server-Timing'] = ', '.join(entries)
+            return response
+
+    def render_prometheus(self):
+        """Prometheusテキスト形式で出力"""
+        with self._lock:
+            lines = [
+                '# HELP keiri_process_info Worker process that served this scrape (metrics are per process).',
+                '# TYPE keiri_process_info gauge',
+                f'keiri_process_info{{pid="{os.getpid()}"}} 1',
+                '# HELP keiri_http_request_duration_seconds Request latency by route.',
+                '# TYPE keiri_http_request_duration_seconds histogram',
+            ]
+            for (method, route), histogram in sorted(self._request_durations.items()):
+                lines.extend(histogram.render('keiri_http_request_duration_seconds',
+                                              [('method', method), ('route', route)]))
+
+            lines.append('# HELP keiri_http_requests_total Requests by route and status.')
+            lines.append('# TYPE keiri_http_requests_total counter')
+            for (method, route, status), count in sorted(self._request_counts.items()):
+                lines.append(
+                    f'keiri_http_requests_total{{method="{_escape(method)}",route="{_escape(route)}",'
+                    f'status="{status}"}} {count}'
+                )
+
+            lines.append('# HELP keiri_stage_duration_seconds Processing time by stage.')
+            lines.append('# TYPE keiri_stage_duration_seconds histogram')
+            for name, histogram in sorted(self._stage_durations.items()):
+                lines.extend(histogram.render('keiri_stage_duration_seconds', [('stage', name)]))
+        return '\n'.join(lines) + '\n'
+
+
+# グローバルインスタンス
+metrics = MetricsRegistry(enabled=os.environ.get('METRICS_ENABLED', '0') == '1')
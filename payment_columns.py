@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+支払明細の列形式（カラム）表現
+明細ごとの dict の代わりに、業者ID・金額を整数配列、業者名・摘要を文字列表への番号として保持する
+業者ごとの集計・口座ごとの合算・合計を配列に対する一括処理で行い、大量の明細でもメモリを抑える
+"""
+from array import array
+from itertools import compress
+
+
+class StringTable:
+    """文字列表（同じ文字列は1つだけ保持し、番号で参照する）"""
+
+    __slots__ = ('values', '_index')
+
+    def __init__(self):
+        self.values = []
+        self._index = {}
+
+    def add(self, value):
+        """文字列を登録して番号を返す"""
+        value = '' if value is None else str(value)
+        index = self._index.get(value)
+        if index is None:
+            index = self._index[value] = len(self.values)
+            self.values.append(value)
+        return index
+
+    def __getitem__(self, index):
+        return self.values[index]
+
+    def __len__(self):
+        return len(self.values)
+
+
+def _to_int(value, strict):
+    """金額を整数に変換（strict=False の場合、変換できない値は 0）"""
+    if strict:
+        return int(value)
+    try:
+        return int(value or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+class PaymentColumns:
+    """支払明細の列形式データ"""
+
+    __slots__ = ('vendor_ids', 'amounts', 'vendor_names', 'descriptions', 'strings')
+
+    def __init__(self):
+        self.vendor_ids = array('q')
+        self.amounts = array('q')
+        self.vendor_names = array('l')    # strings の番号
+        self.descriptions = array('l')    # strings の番号
+        self.strings = StringTable()
+
+    @classmethod
+    def from_items(cls, items, strict=True):
+        """1つの支払表の明細から作成"""
+        columns = cls()
+        columns._append_items(items, strict)
+        return columns
+
+    @classmethod
+    def from_payments(cls, payments, strict=True):
+        """支払表の一覧（履歴）の全明細から作成"""
+        columns = cls()
+        for payment in payments:
+            columns._append_items(payment.get('items') or [], strict)
+        return columns
+
+    def _append_items(self, items, strict):
+        add = self.strings.add
+        # 業者IDが不正な明細は 0（該当業者なし）として扱う
+        self.vendor_ids.extend(_to_int(item.get('vendor_id'), False) for item in items)
+        self.amounts.extend(_to_int(item.get('amount'), strict) for item in items)
+        self.vendor_names.extend(add(item.get('vendor_name')) for item in items)
+        self.descriptions.extend(add(item.get('description')) for item in items)
+
+    def __len__(self):
+        return len(self.amounts)
+
+    def total(self, mask=None):
+        """金額の合計（mask を指定した場合は True の明細のみ）"""
+        if mask is None:
+            return sum(self.amounts)
+        return sum(compress(self.amounts, mask))
+
+    def description(self, row):
+        return self.strings[self.descriptions[row]]
+
+    def vendor_name(self, row):
+        return self.strings[self.vendor_names[row]]
+
+    def group_rows(self, keys):
+        """キーごとの明細番号の一覧（キーは最初に現れた順）
+
+        keys: 明細ごとのキー（vendor_ids など、明細数と同じ長さ）
+        """
+        groups = {}
+        for row, key in enumerate(keys):
+            rows = groups.get(key)
+            if rows is None:
+                groups[key] = rows = array('l')
+            rows.append(row)
+        return groups
+
+    def group_by_vendor(self):
+        """業者IDごとの明細番号の一覧（業者は最初に現れた順）"""
+        return self.group_rows(self.vendor_ids)
+
+    def sum_rows(self, rows):
+        """明細番号の一覧の金額の合計"""
+        amounts = self.amounts
+        return sum(map(amounts.__getitem__, rows))
+
+    def totals_by(self, keys):
+        """キーごとの (件数, 合計金額)（キーは最初に現れた順。キーが None の明細は除外）"""
+        totals = {}
+        for key, amount in zip(keys, self.amounts):
+            if key is None:
+                continue
+            current = totals.get(key)
+            totals[key] = (1, amount) if current is None else (current[0] + 1, current[1] + amount)
+        return totals
+
+    def totals_by_vendor(self):
+        """業者IDごとの (件数, 合計金額)"""
+        return self.totals_by(self.vendor_ids)
+
+    def consolidate(self, keys):
+        """振込先口座ごとに金額を合算
+
+        keys: 明細ごとの口座キー（振込先がない明細は None）
+        戻り値: (口座キー -> (最初の明細番号, 合算金額) （口座キーは最初に現れた順）, 合計金額)
+        """
+        consolidated = {}
+        for row, (key, amount) in enumerate(zip(keys, self.amounts)):
+            if key is None:
+                continue
+            current = consolidated.get(key)
+            consolidated[key] = (row, amount) if current is None else (current[0], current[1] + amount)
+        total = self.total([key is not None for key in keys])
+        return consolidated, total
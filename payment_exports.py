@@ -0,0 +1,517 @@
+#!/usr/bin/env python3
+"""
+支払表PDF・総合振込ファイル・支払履歴Excelの作成
+CPU負荷が高いため worker_pool から別プロセスで実行する（引数・戻り値はpickleできるデータのみ）
+"""
+import os
+import threading
+from datetime import datetime
+
+import zengin_format
+from app_logging import get_logger
+from kana_convert import to_halfwidth_kana, to_halfwidth_alphanumeric
+from metrics import metrics
+from payment_columns import PaymentColumns
+
+transfer_logger = get_logger('transfer')
+
+def convert_to_ascii_safe(text):
+    """テキストを完全にASCII安全な文字に変換（クラウド環境対応）"""
+    if not text:
+        return ''
+    
+    # 日本語キーワードを英語に完全変換
+    conversion_map = {
+        '支払日': 'Payment Date',
+        '送金会社名': 'Remittance Company',
+        '作成日時': 'Created At',
+        '業者支払表': 'Vendor Payment List',
+        '業者名': 'Vendor Name',
+        '金額': 'Amount',
+        '摘要': 'Description',
+        '合計': 'Total',
+        '小計': 'Subtotal',
+        '不明': 'Unknown',
+        '円': 'JPY',
+        # 追加の変換ルール
+        '【': '[',
+        '】': ']',
+        '「': '"',
+        '」': '"',
+        '・': '-',
+        '、': ',',
+        '。': '.'
+    }
+    
+    result = text
+    # 日本語キーワードを先に変換
+    for japanese, english in conversion_map.items():
+        result = result.replace(japanese, english)
+    
+    # 非-ASCII文字を除去または置換
+    ascii_result = ''
+    for char in result:
+        if ord(char) < 128:  # ASCII文字のみ
+            ascii_result += char
+        else:
+            # 非-ASCII文字はスペースまたは'?'に置換
+            ascii_result += ' '
+    
+    # 連続するスペースを一つに統一
+    import re
+    ascii_result = re.sub(r'\s+', ' ', ascii_result).strip()
+    
+    return ascii_result
+
+def convert_for_pdf_display(text, is_header=False, max_length=None):
+    """テキストをPDF表示用に変換（全て日本語保持、問題文字のみ置換）"""
+    if not text:
+        return ''
+    
+    # 全ての文字で問題のある特殊文字や記号のみ置換
+    # 日本語は全て保持する
+    result = text
+    problem_chars = {
+        '【': '[',
+        '】': ']',
+        '「': '"',
+        '」': '"',
+        '・': '-',
+        '‐': '-',  # ハイフン
+        '–': '-',  # enダッシュ
+        '—': '-',  # emダッシュ
+        '～': '~',  # 全角チルダ
+    }
+    
+    for problem_char, replacement in problem_chars.items():
+        result = result.replace(problem_char, replacement)
+    
+    # 最大長が指定されている場合、改行を挿入
+    if max_length and len(result) > max_length:
+        # 適切な位置で改行を挿入
+        words = []
+        current_line = ''
+        for char in result:
+            if len(current_line) >= max_length:
+                words.append(current_line)
+                current_line = char
+            else:
+                current_line += char
+        if current_line:
+            words.append(current_line)
+        result = '\n'.join(words)
+    
+    return result
+
+# PDF用の日本語フォント（ReportLabは読み込みに時間がかかるため初回利用時に読み込む）
+_pdf_font = None
+_pdf_font_lock = threading.Lock()
+
+def register_pdf_font():
+    """PDF用のCIDフォントを登録してフォント名を返す（登録はプロセスごとに1回だけ）"""
+    global _pdf_font
+    if _pdf_font is not None:
+        return _pdf_font
+    with _pdf_font_lock:
+        if _pdf_font is not None:
+            return _pdf_font
+        from reportlab.pdfbase import pdfmetrics
+        from reportlab.pdfbase.cidfonts import UnicodeCIDFont
+
+        errors = []
+        # 代替フォントを順に試行
+        for font_name in ('HeiseiKakuGo-W5', 'HeiseiMin-W3', 'STSong-Light'):
+            try:
+                pdfmetrics.registerFont(UnicodeCIDFont(font_name))
+                print(f"CIDフォント {font_name} を使用してPDFを生成します")
+                _pdf_font = font_name
+                return _pdf_font
+            except Exception as e:
+                errors.append(str(e))
+        # 最終的なフォールバック
+        print(f"CIDフォント登録失敗: {', '.join(errors)}")
+        print("HelveticaフォントでPDFを生成します")
+        _pdf_font = 'Helvetica'
+        return _pdf_font
+
+@metrics.timed('pdf_build')
+def generate_payment_pdf(payment_data, vendors):
+    """支払表のPDFを生成（CIDフォントで日本語対応）
+
+    vendors: 受取人スナップショットのない明細の業者名に使う業者データ
+    """
+    from reportlab.lib.pagesizes import A4
+    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.lib.units import mm
+    from reportlab.lib import colors
+
+    # CIDフォントで日本語を処理
+    japanese_font = register_pdf_font()
+    
+    # PDFファイル名を生成
+    pdf_filename = f"payment_list_{payment_data['id']}.pdf"
+    pdf_path = os.path.join('temp', pdf_filename)
+    
+    # tempディレクトリを作成
+    if not os.path.exists('temp'):
+        os.makedirs('temp')
+    
+    # 業者IDから業者情報を取得するマップを作成
+    vendor_map = {v['id']: v for v in vendors}
+    
+    # PDFドキュメントを作成
+    doc = SimpleDocTemplate(pdf_path, pagesize=A4)
+    elements = []
+    
+    # スタイルを設定（日本語フォント使用）
+    styles = getSampleStyleSheet()
+    title_style = ParagraphStyle(
+        'CustomTitle',
+        parent=styles['Heading1'],
+        fontName=japanese_font,
+        fontSize=16,
+        spaceAfter=30,
+        alignment=1  # 中央揃え
+    )
+    
+    # タイトル（日本語表示）
+    title = Paragraph(convert_for_pdf_display("業者支払表"), title_style)
+    elements.append(title)
+    elements.append(Spacer(1, 12))
+    
+    # 支払情報（全て日本語表示）
+    info_data = [
+        [convert_for_pdf_display('支払日'), payment_data['payment_date']],
+        [convert_for_pdf_display('送金会社名'), convert_for_pdf_display(payment_data['remittance_company'])],
+        [convert_for_pdf_display('作成日時'), payment_data['created_at'][:19].replace('T', ' ')]
+    ]
+    
+    info_table = Table(info_data, colWidths=[40*mm, 100*mm])
+    info_table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (0, -1), colors.lightgrey),
+        ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ('FONTNAME', (0, 0), (-1, -1), japanese_font),
+        ('FONTSIZE', (0, 0), (-1, -1), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black)
+    ]))
+    
+    elements.append(info_table)
+    elements.append(Spacer(1, 20))
+    
+    # 支払データを業者ごとにグループ化
+    columns = PaymentColumns.from_items(payment_data['items'])
+    vendor_groups = columns.group_by_vendor()
+    
+    # 支払明細テーブル（全て日本語表示）
+    table_data = [['No.', convert_for_pdf_display('業者名'), convert_for_pdf_display('金額'), convert_for_pdf_display('摘要')]]
+    
+    total_amount = columns.total()
+    row_number = 1
+    
+    # 業者ごとにデータを追加
+    for vendor_id, rows in vendor_groups.items():
+        # 明細の受取人スナップショットがあれば業者マスターを参照しない
+        vendor = item_recipient(payment_data['items'][rows[0]], vendor_map) or {}
+        vendor_name = convert_for_pdf_display(vendor.get('name', '不明'), max_length=15)  # 業者名は15文字で改行
+        
+        # 同じ業者の支払い項目を追加
+        for row in rows:
+            table_data.append([
+                str(row_number),
+                vendor_name,
+                f"{columns.amounts[row]:,}",
+                convert_for_pdf_display(columns.description(row), max_length=20)  # 摘要は20文字で改行
+            ])
+            row_number += 1
+        
+        # 同じ業者に複数の支払いがある場合は小計行を追加
+        if len(rows) > 1:
+            table_data.append([
+                '',
+                f"[{convert_for_pdf_display(vendor.get('name', '不明'), max_length=12)} {convert_for_pdf_display('小計')}]",  # 小計行は短めに
+                f"{columns.sum_rows(rows):,}",
+                ''
+            ])
+    
+    # 合計行を追加
+    table_data.append(['', convert_for_pdf_display('合計'), f"{total_amount:,}", ''])
+    
+    # テーブルを作成（業者名列を拡大、バランス調整）
+    payment_table = Table(table_data, colWidths=[12*mm, 75*mm, 28*mm, 75*mm])
+    
+    # 基本スタイルを設定
+    table_style = [
+        # ヘッダー行のスタイル
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), japanese_font),
+        ('FONTSIZE', (0, 0), (-1, 0), 9),
+        
+        # データ行のスタイル
+        ('FONTNAME', (0, 1), (-1, -2), japanese_font),
+        ('FONTSIZE', (0, 1), (-1, -2), 8),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
+        
+        # 合計行のスタイル
+        ('BACKGROUND', (0, -1), (-1, -1), colors.lightgrey),
+        ('FONTNAME', (0, -1), (-1, -1), japanese_font),
+        ('FONTSIZE', (0, -1), (-1, -1), 9),
+        
+        # 罫線
+        ('GRID', (0, 0), (-1, -1), 1, colors.black),
+        
+        # 金額列を右揃え（第3列に変更）
+        ('ALIGN', (2, 1), (2, -1), 'RIGHT'),
+        
+        # テキスト折り返し設定（業者名列と摘要列）
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ('WORDWRAP', (1, 0), (1, -1), True),  # 業者名列
+        ('WORDWRAP', (3, 0), (3, -1), True),  # 摘要列
+    ]
+    
+    # 小計行のスタイルを追加（小計行を識別して背景色を設定）
+    for i, row in enumerate(table_data):
+        if len(row) > 1 and isinstance(row[1], str) and '小計' in row[1]:
+            table_style.extend([
+                ('BACKGROUND', (0, i), (-1, i), colors.Color(0.9, 0.9, 1.0)),  # 薄い青色
+                ('FONTNAME', (0, i), (-1, i), japanese_font),
+                ('FONTSIZE', (0, i), (-1, i), 8),
+                ('ALIGN', (1, i), (1, i), 'LEFT'),  # 業者名は左揃え
+            ])
+    
+    payment_table.setStyle(TableStyle(table_style))
+    
+    elements.append(payment_table)
+    
+    # PDFを生成
+    doc.build(elements)
+    
+    return pdf_path
+
+def _digits(value, width):
+    """コード・口座番号を半角にしてゼロ埋め
+    未入力・数字以外を含む場合はそのまま残す（ゼロ埋めすると検証で未入力・不正の口座として検出できなくなる）"""
+    text = to_halfwidth_alphanumeric(str(value if value is not None else '')).strip()
+    return text.rjust(width, '0') if text.isdigit() else text
+
+def account_key(recipient):
+    """振込先口座のキー（銀行コード+支店コード+口座番号）。口座情報が未入力・数字以外の場合は None"""
+    parts = [str(recipient.get(field) or '') for field in ('bank_code', 'branch_code', 'account_number')]
+    if not all(part.isdigit() for part in parts):
+        return None
+    return '-'.join(parts)
+
+def recipient_snapshot(vendor):
+    """受取人（業者）の口座情報のスナップショット（半角カナ・ゼロ埋め済みで振込ファイルにそのまま使える形）
+
+    支払表の作成時に明細へ保存し、出力時に業者マスターを参照しないようにする
+    """
+    return {
+        'name': vendor.get('name', ''),
+        'bank_code': _digits(vendor.get('bank_code'), 4),
+        'bank_name': to_halfwidth_kana(vendor.get('bank_name_kana') or vendor.get('bank_name', '')),
+        'branch_code': _digits(vendor.get('branch_code'), 3),
+        'branch_name': to_halfwidth_kana(vendor.get('branch_name_kana') or vendor.get('branch_name', '')),
+        'account_type': str(vendor.get('account_type', 1)),
+        'account_number': _digits(vendor.get('account_number'), 7),
+        'account_holder': to_halfwidth_kana(vendor.get('account_holder', '')),
+    }
+
+def remitter_snapshot(company):
+    """送金会社（振込依頼人）の口座情報のスナップショット（半角カナ変換済み）
+    口座情報の既定値は補わない（未入力の項目は出力前の検証でエラーにする）"""
+    return {
+        'name': company.get('name', ''),
+        'client_code': to_halfwidth_alphanumeric(str(company.get('client_code') or '')),
+        'account_holder': to_halfwidth_kana(company.get('account_holder') or ''),
+        'bank_code': _digits(company.get('bank_code'), 4),
+        'bank_name': to_halfwidth_kana(company.get('bank_name_kana') or company.get('bank_name') or ''),
+        'branch_code': _digits(company.get('branch_code'), 3),
+        'branch_name': to_halfwidth_kana(company.get('branch_name_kana') or company.get('branch_name') or ''),
+        'account_type': str(company.get('account_type') or ''),
+        'account_number': _digits(company.get('account_number'), 7),
+        'transfer_format': company.get('transfer_format', 'csv'),
+    }
+
+def item_recipient(item, vendor_map):
+    """明細の受取人の口座情報（スナップショットがなければ業者マスターから作成。業者がなければ None）
+
+    作成時に業者がマスターデータになかった明細は、スナップショットとして None が保存されている
+    """
+    if 'recipient' in item:
+        return item['recipient']
+    vendor = vendor_map.get(item['vendor_id'])
+    return recipient_snapshot(vendor) if vendor else None
+
+def build_transfer_file(payment_id, transfer_format, context, force=False):
+    """総合振込ファイルをShift-JISバイト列で生成（内容, 出力形式, フィールド変換レポート, エラー）
+
+    context: (支払表, 業者マップ, 送金会社) のタプル
+    支払表・明細に口座情報のスナップショットがあればそれを使い、業者マップ・送金会社は参照しない
+    数字項目が桁数を超えている場合は出力せず、レポートに reason='overflow' の項目を含めてエラーを返す
+    （force=True の場合は出力する）
+    """
+    payment, vendor_map, selected_company = context
+    # 送金会社がマスターデータにない場合は口座情報が空のまま（検証でエラー、強制出力時のみ出力）
+    remitter = payment.get('remitter') or remitter_snapshot(selected_company or {})
+    
+    # 出力形式（指定がなければ送金会社の設定を使用）
+    if not transfer_format:
+        transfer_format = remitter['transfer_format']
+    if transfer_format not in zengin_format.TRANSFER_FORMATS:
+        return None, transfer_format, [], f'未対応の出力形式です: {transfer_format}'
+    
+    # 振込データの準備（同一口座番号の項目は合算する。銀行システムエラー回避のため）
+    columns = PaymentColumns.from_items(payment['items'])
+    with metrics.stage('kana_convert'):
+        recipients = [item_recipient(item, vendor_map) for item in payment['items']]
+    # 口座を一意に識別するキー（銀行コード+支店コード+口座番号）
+    # 口座情報に不備がある明細（検証でエラー、強制出力時のみ出力）は別の明細と合算しない
+    account_keys = [
+        (account_key(recipient) or f'row-{row}') if recipient else None
+        for row, recipient in enumerate(recipients)
+    ]
+    consolidated, total_amount = columns.consolidate(account_keys)
+    transfer_data = [(recipients[row], amount) for row, amount in consolidated.values()]
+    transfer_logger.info("振込データ作成 - payment_id: %s, 合算前項目数: %d, 合算後項目数: %d",
+                         payment_id, len(payment['items']), len(transfer_data))
+    
+    # 取組日（MMDD形式）
+    payment_date = datetime.strptime(payment['payment_date'], '%Y-%m-%d')
+    toritsuke_date = payment_date.strftime('%m%d')
+    
+    # ヘッダーレコード（データ区分：1）
+    # 委託者名はマスターデータのI列（account_holder）を半角カナに変換したもの
+    remittance_company_kana = remitter['account_holder']
+    if not remittance_company_kana.strip():  # 変換後が空の場合はデフォルト値
+        remittance_company_kana = 'イライシャ'
+    
+    header_record = {
+        'type_code': '21',  # 種別コード（総合振込）
+        'code_type': '0',  # コード区分（JISコード）
+        'client_code': remitter['client_code'],  # 委託者コード（10桁）
+        'client_name': remittance_company_kana,  # 委託者名（40桁・半角カナ）
+        'transfer_date': toritsuke_date,  # 取組日（MMDD）
+        'bank_code': remitter['bank_code'],  # 仕向銀行番号
+        'bank_name': remitter['bank_name'],  # 仕向銀行名（15桁・半角カナ）
+        'branch_code': remitter['branch_code'],  # 仕向支店番号（3桁）
+        'branch_name': remitter['branch_name'],  # 仕向支店名（15桁・半角カナ）
+        'account_type': remitter['account_type'],  # 預金種目
+        'account_number': remitter['account_number'],  # 口座番号（7桁・半角数字）
+    }
+    
+    # データレコード（データ区分：2）
+    data_records = []
+    for recipient, amount in transfer_data:
+        account_holder_kana = recipient['account_holder']
+        if not account_holder_kana.strip():  # 変換後が空の場合はデフォルト値
+            account_holder_kana = 'ウケトリニン'
+            transfer_logger.warning("受取人名が変換後に空のためデフォルト値を使用: '%s'", recipient['name'])
+        
+        data_records.append({
+            'bank_code': recipient['bank_code'],  # 被仕向銀行番号（4桁・半角数字）
+            'bank_name': recipient['bank_name'],  # 被仕向銀行名（15桁・半角カナ）
+            'branch_code': recipient['branch_code'],  # 被仕向支店番号（3桁・半角数字）
+            'branch_name': recipient['branch_name'],  # 被仕向支店名（15桁・半角カナ）
+            'clearing_house': '0000',  # 手形交換所番号（未使用・半角数字）
+            'account_type': recipient['account_type'],  # 預金種目（半角数字）
+            'account_number': recipient['account_number'],  # 口座番号（7桁・半角数字）
+            'account_holder': account_holder_kana,  # 受取人名（30桁・半角カナ）
+            'amount': str(amount),  # 振込金額（10桁・半角数字）
+            'transfer_type': '7',  # 振込区分（電信振込・半角数字）
+        })
+    
+    # トレーラレコード（データ区分：8）
+    trailer_record = {
+        'record_count': str(len(transfer_data)),  # 合計件数（6桁）
+        'total_amount': str(total_amount),  # 合計金額（12桁）
+    }
+    
+    # 各フィールドをShift-JISでバイト幅に揃えて組み立て（レコード組み立てと文字コード変換を同時に行う）
+    rejections = []
+    error = None
+    with metrics.stage('transfer_encode'):
+        try:
+            encoded_content = zengin_format.build_transfer_file(
+                header_record, data_records, trailer_record, transfer_format, rejections, allow_overflow=force
+            )
+        except zengin_format.FieldOverflowError as e:
+            encoded_content, error = None, str(e)
+    for rejection in rejections:
+        log = transfer_logger.warning if rejection['reason'] == 'overflow' else transfer_logger.info
+        log("フィールド変換警告 - %s[%s] %s: %s",
+            rejection['record'], rejection['index'], rejection['label'], rejection['reason'])
+    
+    return encoded_content, transfer_format, rejections, error
+
+# 支払履歴Excelの列（見出し, 列幅）
+EXCEL_PAYMENT_COLUMNS = [('支払ID', 18), ('支払日', 12), ('送金会社', 30), ('作成日時', 20), ('件数', 8), ('合計金額', 14)]
+EXCEL_ITEM_COLUMNS = [('支払ID', 18), ('支払日', 12), ('送金会社', 30), ('No.', 6), ('業者ID', 8), ('業者名', 30),
+                      ('銀行コード', 10), ('支店コード', 10), ('口座番号', 10), ('金額', 14), ('摘要', 30)]
+AMOUNT_FORMAT = '#,##0'
+
+@metrics.timed('excel_build')
+def generate_payment_excel(payments, vendors, output_path):
+    """支払履歴のExcel（支払一覧・支払明細の2シート）を生成して (支払表数, 明細数) を返す
+
+    openpyxl の書き込み専用ブックで1行ずつ書き出すため、行数が増えてもメモリはほぼ一定
+    vendors: 受取人スナップショットのない明細の業者名・口座に使う業者データ
+    """
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.utils import get_column_letter
+
+    vendor_map = {v['id']: v for v in vendors}
+    workbook = Workbook(write_only=True)
+    payment_sheet = workbook.create_sheet('支払一覧')
+    item_sheet = workbook.create_sheet('支払明細')
+    for sheet, columns in ((payment_sheet, EXCEL_PAYMENT_COLUMNS), (item_sheet, EXCEL_ITEM_COLUMNS)):
+        for index, (_, width) in enumerate(columns, 1):
+            sheet.column_dimensions[get_column_letter(index)].width = width
+        sheet.freeze_panes = 'A2'
+        sheet.append([title for title, _ in columns])
+
+    def amount_cell(sheet, value):
+        cell = WriteOnlyCell(sheet, value=value)
+        cell.number_format = AMOUNT_FORMAT
+        return cell
+
+    payment_count = item_count = 0
+    for payment in payments:
+        items = payment.get('items') or []
+        columns = PaymentColumns.from_items(items, strict=False)
+        head = [payment.get('id', ''), payment.get('payment_date', ''), payment.get('remittance_company', '')]
+        payment_sheet.append(head + [
+            (payment.get('created_at') or '')[:19].replace('T', ' '),
+            len(items),
+            amount_cell(payment_sheet, columns.total()),
+        ])
+        for row, item in enumerate(items):
+            recipient = item_recipient(item, vendor_map) or {}
+            item_sheet.append(head + [
+                row + 1,
+                columns.vendor_ids[row],
+                recipient.get('name') or item.get('vendor_name', ''),
+                recipient.get('bank_code', ''),
+                recipient.get('branch_code', ''),
+                recipient.get('account_number', ''),
+                amount_cell(item_sheet, columns.amounts[row]),
+                columns.description(row),
+            ])
+        payment_count += 1
+        item_count += len(items)
+
+    # 書き込み途中のファイルをダウンロードさせないよう、一時ファイルに保存してから置き換える
+    temp_path = output_path + '.tmp'
+    workbook.save(temp_path)
+    os.replace(temp_path, output_path)
+    return payment_count, item_count
+
+def warm_up():
+    """ReportLabの読み込みとCIDフォントの登録（起動直後のウォームアップ用）"""
+    import reportlab.platypus  # noqa: F401
+    return register_pdf_font()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+会計システムから出力した支払データ（CSV/Excel）の一括取り込み
+1行を1明細として読み込み、振込先口座（銀行コード+支店コード+口座番号）または業者名で業者マスターの業者を特定し、
+支払日・送金会社ごとに支払表へまとめる
+
+業者の特定には業者マスターから作成した索引（口座キー・正規化した業者名 -> 業者）を使い、行ごとに業者一覧を走査しない
+口座の列がある行は口座で、ない行は業者名で特定する（同名で口座の異なる業者が複数ある場合は特定できない）
+特定できなかった行・金額などが不正な行は取り込まずに理由とともに返す
+"""
+import re
+import unicodedata
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+from bank_master import normalize_name_key
+from payment_exports import account_key, recipient_snapshot
+from tabular_reader import read_tabular_file
+
+# 列名（いずれかに一致する列を使用）
+HEADER_ALIASES = {
+    'payment_date': ('支払日', '支払予定日', '振込日', '日付', 'payment_date'),
+    'remittance_company': ('送金会社', '送金会社名', '振込依頼人', '依頼人名', '支払元', 'remittance_company'),
+    'vendor_name': ('業者名', '支払先', '支払先名', '取引先', '取引先名', '企業名', '受取人名', 'vendor_name'),
+    'bank_code': ('金融機関コード', '銀行コード', 'bank_code'),
+    'branch_code': ('支店コード', '店舗コード', 'branch_code'),
+    'account_number': ('口座番号', 'account_number'),
+    'amount': ('金額', '支払金額', '振込金額', 'amount'),
+    'description': ('摘要', '内容', '備考', 'description'),
+}
+
+DATE_PATTERN = re.compile(r'^(\d{4})[-/年.]?(\d{1,2})[-/月.]?(\d{1,2})日?')
+
+
+def _cell(text):
+    return str(text or '').strip()
+
+
+def _halfwidth(text):
+    return unicodedata.normalize('NFKC', text)
+
+
+def parse_date(text):
+    """支払日を YYYY-MM-DD に変換（2025/1/5・20250105・2025年1月5日・Excelの日時に対応。不正な場合は None）"""
+    match = DATE_PATTERN.match(_halfwidth(_cell(text)))
+    if not match:
+        return None
+    try:
+        # 2月31日・4月31日など存在しない日付も不正とする（振込ファイル出力時に日付として扱えないため）
+        return date(*(int(part) for part in match.groups())).isoformat()
+    except ValueError:
+        return None
+
+
+def parse_amount(text):
+    """金額を整数に変換（カンマ・円記号を除く。0以下・円未満を含む・不正な場合は None）
+
+    Excelの数値セルは 1234.0 のように読み込まれるため、小数部が0の場合のみ受け付ける
+    （float を経由すると大きな金額の桁が失われるため Decimal で扱う）
+    """
+    text = _halfwidth(_cell(text)).replace(',', '').replace('円', '').replace('¥', '').replace('\\', '')
+    try:
+        value = Decimal(text)
+    except InvalidOperation:
+        return None
+    if not value.is_finite() or value != value.to_integral_value():
+        return None
+    amount = int(value)
+    return amount if amount > 0 else None
+
+
+class VendorIndex:
+    """業者マスターの索引（口座キー・正規化した業者名 -> 業者）"""
+
+    def __init__(self, vendors):
+        self.by_account = {}
+        self.by_name = {}  # 正規化した業者名 -> {口座キー: 業者}
+        for vendor in vendors:
+            key = account_key(recipient_snapshot(vendor))
+            if key is not None:
+                self.by_account.setdefault(key, vendor)
+            else:
+                key = ('id', vendor.get('id'))  # 口座情報のない業者は業者名でのみ特定する（別の業者とまとめない）
+            self.by_name.setdefault(normalize_name_key(vendor.get('name')), {}).setdefault(key, vendor)
+
+    def resolve(self, row):
+        """行の業者を特定（業者, 特定できない理由）"""
+        if row['account_number']:
+            key = account_key(recipient_snapshot(row))
+            if key is None:
+                return None, '金融機関コード・支店コード・口座番号が不正です'
+            vendor = self.by_account.get(key)
+            if vendor is None:
+                return None, f'口座（{key}）が業者マスターにありません'
+            return vendor, None
+        if not row['vendor_name']:
+            return None, '業者名・口座番号がありません'
+        candidates = self.by_name.get(normalize_name_key(row['vendor_name']))
+        if not candidates:
+            return None, '業者名が業者マスターにありません'
+        if len(candidates) > 1:
+            return None, '同名で口座の異なる業者が複数あります（口座番号の列で指定してください）'
+        return next(iter(candidates.values())), None
+
+    def company_name(self, name):
+        """送金会社名を業者マスターの表記に合わせる（全角・半角や空白の違いを吸収。該当がなければそのまま）"""
+        candidates = self.by_name.get(normalize_name_key(name)) if name else None
+        return next(iter(candidates.values())).get('name', name) if candidates else name
+
+
+class PaymentImporter:
+    """支払データの一括取り込みクラス"""
+
+    def read_rows(self, filepath):
+        """ファイルを読み込んで行データ（行番号付き）と警告メッセージを返す"""
+        headers, data_rows, message = read_tabular_file(filepath)
+        if headers is None:
+            raise ValueError(message)
+
+        header_texts = [_halfwidth(_cell(h)) for h in headers]
+        columns = {}
+        for name, aliases in HEADER_ALIASES.items():
+            for i, header in enumerate(header_texts):
+                if header in aliases:
+                    columns[name] = i
+                    break
+        if 'amount' not in columns:
+            raise ValueError('金額の列が見つかりません')
+        if 'vendor_name' not in columns and 'account_number' not in columns:
+            raise ValueError('業者名または口座番号の列が見つかりません')
+
+        rows = []
+        # 1行目はヘッダーのため、データ行はファイルの2行目から
+        for line_number, row_data in enumerate(data_rows, 2):
+            values = {
+                name: _cell(row_data[index]) if index < len(row_data) else ''
+                for name, index in columns.items()
+            }
+            if not any(values.values()):
+                continue
+            rows.append({
+                'row': line_number,
+                'payment_date': values.get('payment_date', ''),
+                'remittance_company': values.get('remittance_company', ''),
+                'vendor_name': values.get('vendor_name', ''),
+                'bank_code': values.get('bank_code', ''),
+                'branch_code': values.get('branch_code', ''),
+                'account_number': values.get('account_number', ''),
+                'amount': values.get('amount', ''),
+                'description': values.get('description', ''),
+            })
+        return rows, message
+
+    def build_payments(self, rows, vendors, default_date='', default_company=''):
+        """行データを支払日・送金会社ごとの支払表（作成日時・IDなし）にまとめる
+
+        戻り値: (支払表の一覧, 取り込まなかった行の一覧)
+        支払日・送金会社の列がない・空の行は default_date・default_company を使う
+        """
+        index = VendorIndex(vendors)
+        default_date = parse_date(default_date) if default_date else None
+        payments = {}  # (支払日, 送金会社) -> 支払表
+        unmatched = []
+
+        for row in rows:
+            payment_date = parse_date(row['payment_date']) if row['payment_date'] else default_date
+            remittance_company = index.company_name(row['remittance_company'] or default_company)
+            amount = parse_amount(row['amount'])
+            reason = None
+            if payment_date is None:
+                reason = '支払日が不正です' if row['payment_date'] else '支払日がありません'
+            elif not remittance_company:
+                reason = '送金会社がありません'
+            elif amount is None:
+                reason = '金額が不正です（1円以上の整数で入力してください）'
+            else:
+                vendor, reason = index.resolve(row)
+            if reason:
+                unmatched.append({
+                    'row': row['row'],
+                    'vendor_name': row['vendor_name'],
+                    'account_number': row['account_number'],
+                    'amount': row['amount'],
+                    'reason': reason,
+                })
+                continue
+
+            key = (payment_date, remittance_company)
+            payment = payments.get(key)
+            if payment is None:
+                payment = payments[key] = {
+                    'payment_date': payment_date,
+                    'remittance_company': remittance_company,
+                    'items': [],
+                }
+            payment['items'].append({
+                'id': len(payment['items']) + 1,
+                'vendor_id': vendor['id'],
+                'vendor_name': vendor.get('name', ''),
+                'amount': amount,
+                'description': row['description'],
+                'remarks': '',
+            })
+        return list(payments.values()), unmatched
+
+
+# グローバルインスタンス
+payment_importer = PaymentImporter()
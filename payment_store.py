@@ -0,0 +1,541 @@
+#!/usr/bin/env python3
+"""
+支払データの分割保存
+支払表を送金会社ごと（PAYMENT_SHARDS=month の場合は送金会社・支払月ごと）のファイルに分けて
+payment_shards/ に保存し、支払表の作成・削除では該当する分割ファイルとマニフェストだけを書き換える
+送金会社・支払日で絞り込んだ読み込みでは該当する分割ファイルだけを読む
+
+マニフェスト（manifest.json）:
+    shards: 分割ファイルごとの送金会社・支払月・件数・内容のハッシュ
+    order:  支払履歴の並び順（[分割ID, 連続する件数] の一覧）
+
+支払月ごとに分割した場合、PAYMENT_COLD_MONTHS か月より前の分割ファイルは更新がほぼないため、
+インデントなしのJSONをgzip圧縮して保存する（起動時のウォームアップで圧縮し直す）
+
+payments.json からの移行は管理者が明示的に行う（読み込み時に payments.json を取り込むことはしない）
+    1. migrate           payments.json の内容を分割保存に書き込み、読み戻して一致を確認する
+                         （payments.json は残し、移行を確定するまではこちらを正として使い続ける）
+    2. migrate --confirm 最新の payments.json で書き込み直して確認し、移行を確定して
+                         payments.json.migrated に名前を変える（アプリケーションを停止して実行する）
+移行の状態はマニフェストの migration に記録する
+アーカイブから復元した payments.json は、復元の操作から restore_file で取り込む
+
+環境変数:
+    PAYMENT_SHARDS       off: payments.json 1ファイル（既定）、remitter: 送金会社ごと、month: 送金会社・支払月ごと
+    PAYMENT_COLD_MONTHS  圧縮して保存する支払月（この月数より前、既定: 6）
+
+使い方:
+    python payment_store.py status
+    python payment_store.py migrate [--confirm]
+"""
+import gzip
+import hashlib
+import json
+import os
+import sys
+import threading
+from contextlib import contextmanager
+from datetime import date, datetime
+
+from app_logging import get_logger
+
+try:
+    import fcntl
+except ImportError:  # Windows ではプロセス間のロックを行わない
+    fcntl = None
+
+SHARD_DIR = 'payment_shards'
+LEGACY_FILE = 'payments.json'
+MANIFEST_VERSION = 1
+
+logger = get_logger('storage')
+
+
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def _digest(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def _file_signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class MigrationError(Exception):
+    """payments.json からの移行・取り込みができない"""
+
+
+class PaymentStore:
+    """支払データの分割保存クラス"""
+
+    def __init__(self, directory=SHARD_DIR, legacy_path=LEGACY_FILE):
+        self.directory = directory
+        self.manifest_path = os.path.join(directory, 'manifest.json')
+        self.legacy_path = legacy_path
+        mode = os.environ.get('PAYMENT_SHARDS', 'off')
+        self.enabled = mode != 'off'
+        self.granularity = 'month' if mode == 'month' else 'remitter'
+        self.cold_months = _env_int('PAYMENT_COLD_MONTHS', 6)
+        self._lock = threading.RLock()
+        self._active_cache = (None, False)  # (マニフェストの更新日時・サイズ, 移行を確定済みか)
+        self.shard_writes = 0
+        self.imports = 0
+
+    @contextmanager
+    def _locked(self, exclusive):
+        """読み込みは共有ロック、書き込みは排他ロック（gunicornの別ワーカーとも排他）"""
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.manifest_path + '.lock', 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    # ---- 分割 ----
+
+    def _shard_of(self, payment):
+        """支払表の分割ID・送金会社・支払月"""
+        company = payment.get('remittance_company') or ''
+        month = (payment.get('payment_date') or '')[:7] if self.granularity == 'month' else None
+        shard_id = _digest(company)[:12]
+        if month is not None:
+            shard_id = f"{shard_id}_{month or 'none'}"
+        return shard_id, company, month
+
+    def _cold_before(self):
+        """この支払月より前の分割ファイルを圧縮する（YYYY-MM）"""
+        today = date.today()
+        months = today.year * 12 + today.month - 1 - self.cold_months
+        return f"{months // 12:04d}-{months % 12 + 1:02d}"
+
+    def _is_cold(self, month):
+        return self.granularity == 'month' and bool(month) and month < self._cold_before()
+
+    # ---- ファイル ----
+
+    def _empty_manifest(self):
+        return {'version': MANIFEST_VERSION, 'granularity': self.granularity, 'shards': {}, 'order': []}
+
+    def _read_manifest(self):
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _write_file(self, path, content):
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(content)
+        os.replace(temp_path, path)
+
+    def _write_manifest(self, manifest):
+        os.makedirs(self.directory, exist_ok=True)
+        self._write_file(self.manifest_path, json.dumps(manifest, ensure_ascii=False).encode('utf-8'))
+
+    def _read_shard(self, entry):
+        path = os.path.join(self.directory, entry['file'])
+        if entry['file'].endswith('.gz'):
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                return json.load(f)
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _write_shard(self, manifest, shard_id, company, month, payments, digest=None):
+        """分割ファイルを書き込んでマニフェストの情報を更新（古い月は圧縮して保存）"""
+        cold = self._is_cold(month)
+        if cold:
+            compact = json.dumps(payments, ensure_ascii=False, separators=(',', ':'))
+            content = gzip.compress(compact.encode('utf-8'), mtime=0)
+            filename = f"{shard_id}.json.gz"
+        else:
+            content = json.dumps(payments, ensure_ascii=False, indent=2).encode('utf-8')
+            filename = f"{shard_id}.json"
+        os.makedirs(self.directory, exist_ok=True)
+        self._write_file(os.path.join(self.directory, filename), content)
+        previous = manifest['shards'].get(shard_id)
+        if previous and previous['file'] != filename:
+            self._remove_file(previous['file'])
+        manifest['shards'][shard_id] = {
+            'file': filename,
+            'remittance_company': company,
+            'month': month,
+            'count': len(payments),
+            'digest': digest or self._content_digest(payments),
+        }
+        self.shard_writes += 1
+
+    def _remove_file(self, filename):
+        try:
+            os.remove(os.path.join(self.directory, filename))
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _content_digest(payments):
+        return _digest(json.dumps(payments, ensure_ascii=False, separators=(',', ':')))
+
+    @staticmethod
+    def _extend_order(order, shard_id, count=1):
+        if order and order[-1][0] == shard_id:
+            order[-1][1] += count
+        else:
+            order.append([shard_id, count])
+
+    @staticmethod
+    def _active(manifest):
+        """移行を確定済み（または payments.json から移行していない）マニフェストか"""
+        migration = manifest.get('migration')
+        return migration is None or bool(migration.get('confirmed'))
+
+    def in_use(self):
+        """分割保存を使うか（移行を確定済み、または payments.json のない新しい環境）
+        移行していない・移行を確定していない場合は payments.json を正として使う"""
+        if not self.enabled:
+            return False
+        # リクエストごとに何度も呼ばれるため、マニフェストが変わったときだけ読み直す
+        signature = _file_signature(self.manifest_path)
+        if signature is None:
+            return not os.path.exists(self.legacy_path)
+        cached_signature, active = self._active_cache
+        if signature != cached_signature:
+            manifest = self._read_manifest()
+            active = manifest is not None and self._active(manifest)
+            self._active_cache = (signature, active)
+        return active
+
+    # ---- 読み込み ----
+
+    def has_payments(self):
+        """保存済みの支払表があるか"""
+        manifest = self._read_manifest()
+        return bool(manifest and any(entry['count'] for entry in manifest['shards'].values()))
+
+    def load(self, remittance_company=None, date_from='', date_to=''):
+        """支払表を履歴の順に読み込む（送金会社・支払日を指定した場合は該当する分割ファイルのみ）
+
+        支払日の絞り込みは支払月単位のため、呼び出し元で支払日を確認する
+        """
+        with self._locked(exclusive=False):
+            manifest = self._read_manifest()
+            if manifest is None:
+                return []
+            if manifest.get('granularity') != self.granularity:
+                # 分割の単位が変わった場合は全件を返す（次の保存時に分割し直す）
+                return self._load_shards(manifest, manifest['shards'])
+            month_from, month_to = date_from[:7], date_to[:7]
+            selected = {
+                shard_id: entry for shard_id, entry in manifest['shards'].items()
+                if (remittance_company is None or entry['remittance_company'] == remittance_company)
+                and (entry['month'] is None or not month_from or entry['month'] >= month_from)
+                and (entry['month'] is None or not month_to or entry['month'] <= month_to)
+            }
+            return self._load_shards(manifest, selected)
+
+    def _load_shards(self, manifest, selected):
+        shards = {shard_id: iter(self._read_shard(entry)) for shard_id, entry in selected.items()}
+        payments = []
+        for shard_id, count in manifest['order']:
+            shard = shards.get(shard_id)
+            if shard is not None:
+                payments.extend(payment for _, payment in zip(range(count), shard))
+        return payments
+
+    # ---- 書き込み ----
+
+    def save_all(self, payments):
+        """支払表の一覧全体を保存（内容が変わった分割ファイルだけを書き換える）"""
+        with self._locked(exclusive=True):
+            return self._save_all(payments)
+
+    def _save_all(self, payments):
+        # ファイルのロックは同じプロセスでも重ねて取れないため、ロックの中から呼ぶ処理はこちらを使う
+        groups = {}
+        order = []
+        for payment in payments:
+            shard_id, company, month = self._shard_of(payment)
+            group = groups.get(shard_id)
+            if group is None:
+                group = groups[shard_id] = (company, month, [])
+            group[2].append(payment)
+            self._extend_order(order, shard_id)
+
+        manifest = self._read_manifest() or self._empty_manifest()
+        if manifest.get('granularity') != self.granularity:
+            for entry in manifest['shards'].values():
+                self._remove_file(entry['file'])
+            manifest = self._empty_manifest()
+        written = 0
+        for shard_id, (company, month, shard_payments) in groups.items():
+            digest = self._content_digest(shard_payments)
+            entry = manifest['shards'].get(shard_id)
+            if entry and entry['digest'] == digest and entry['file'].endswith('.gz') == self._is_cold(month):
+                continue
+            self._write_shard(manifest, shard_id, company, month, shard_payments, digest)
+            written += 1
+        for shard_id in [shard_id for shard_id in manifest['shards'] if shard_id not in groups]:
+            self._remove_file(manifest['shards'].pop(shard_id)['file'])
+            written += 1
+        if written or manifest['order'] != order or not os.path.exists(self.manifest_path):
+            manifest['order'] = order
+            self._write_manifest(manifest)
+        return written
+
+    def append(self, new_payments):
+        """支払表を履歴の末尾に追加（追加先の分割ファイルとマニフェストだけを書き換える）"""
+        groups = {}
+        for payment in new_payments:
+            shard_id, company, month = self._shard_of(payment)
+            groups.setdefault(shard_id, (company, month, []))[2].append(payment)
+
+        with self._locked(exclusive=True):
+            manifest = self._read_manifest()
+            if manifest is None or manifest.get('granularity') != self.granularity:
+                existing = self._load_shards(manifest, manifest['shards']) if manifest else []
+                return self._save_all(existing + list(new_payments))
+            for shard_id, (company, month, shard_payments) in groups.items():
+                entry = manifest['shards'].get(shard_id)
+                payments = self._read_shard(entry) if entry else []
+                self._write_shard(manifest, shard_id, company, month, payments + shard_payments)
+            for payment in new_payments:
+                self._extend_order(manifest['order'], self._shard_of(payment)[0])
+            self._write_manifest(manifest)
+            return len(groups)
+
+    def _find(self, manifest, payment_id):
+        """支払表を含む分割ファイル（分割ID, 分割ファイル内の位置, 分割ファイルの支払表一覧）。ない場合は None"""
+        for shard_id, entry in manifest['shards'].items():
+            payments = self._read_shard(entry)
+            for index, payment in enumerate(payments):
+                if str(payment.get('id')) == str(payment_id):
+                    return shard_id, index, payments
+        return None
+
+    @staticmethod
+    def _expand_order(order):
+        """並び順を支払表ごとの分割IDの一覧に展開"""
+        return [shard_id for shard_id, count in order for _ in range(count)]
+
+    @classmethod
+    def _compress_order(cls, sequence):
+        order = []
+        for shard_id in sequence:
+            cls._extend_order(order, shard_id)
+        return order
+
+    @staticmethod
+    def _position(sequence, shard_id, index):
+        """分割ファイル内の index 番目の支払表の、履歴全体での位置"""
+        seen = -1
+        for position, current in enumerate(sequence):
+            if current == shard_id:
+                seen += 1
+                if seen == index:
+                    return position
+        raise ValueError(f'マニフェストの並び順と分割ファイルの件数が一致しません: {shard_id}')
+
+    def _put_shard(self, manifest, shard_id, payments):
+        """分割ファイルを書き込む（空になった分割ファイルは削除）"""
+        entry = manifest['shards'][shard_id]
+        if payments:
+            self._write_shard(manifest, shard_id, entry['remittance_company'], entry['month'], payments)
+        else:
+            self._remove_file(manifest['shards'].pop(shard_id)['file'])
+
+    def remove(self, payment_id):
+        """支払表を削除（該当する分割ファイルとマニフェストだけを書き換える）。削除した支払表、ない場合は None"""
+        with self._locked(exclusive=True):
+            manifest = self._read_manifest()
+            if manifest is None:
+                return None
+            if manifest.get('granularity') != self.granularity:
+                payments = self._load_shards(manifest, manifest['shards'])
+                removed = next((p for p in payments if str(p.get('id')) == str(payment_id)), None)
+                if removed is not None:
+                    self._save_all([p for p in payments if p is not removed])
+                return removed
+            found = self._find(manifest, payment_id)
+            if found is None:
+                return None
+            shard_id, index, payments = found
+            sequence = self._expand_order(manifest['order'])
+            del sequence[self._position(sequence, shard_id, index)]
+            removed = payments.pop(index)
+            self._put_shard(manifest, shard_id, payments)
+            manifest['order'] = self._compress_order(sequence)
+            self._write_manifest(manifest)
+            return removed
+
+    def replace(self, payment):
+        """同じIDの支払表を置き換え（履歴の位置は変えない。ない場合は末尾に追加）。置き換え前の支払表、ない場合は None
+
+        書き換えるのは置き換え前・後の分割ファイルとマニフェストだけ
+        （送金会社・支払月が変わった場合は別の分割ファイルへ移す）
+        """
+        with self._locked(exclusive=True):
+            manifest = self._read_manifest()
+            if manifest is None or manifest.get('granularity') != self.granularity:
+                payments = self._load_shards(manifest, manifest['shards']) if manifest else []
+                previous = next((p for p in payments if str(p.get('id')) == str(payment.get('id'))), None)
+                self._save_all([payment if p is previous else p for p in payments]
+                               + ([] if previous is not None else [payment]))
+                return previous
+            found = self._find(manifest, payment.get('id'))
+            new_shard, company, month = self._shard_of(payment)
+            if found is None:
+                entry = manifest['shards'].get(new_shard)
+                payments = self._read_shard(entry) if entry else []
+                self._write_shard(manifest, new_shard, company, month, payments + [payment])
+                self._extend_order(manifest['order'], new_shard)
+                self._write_manifest(manifest)
+                return None
+            shard_id, index, payments = found
+            previous = payments[index]
+            if shard_id == new_shard:
+                payments[index] = payment
+                self._write_shard(manifest, shard_id, company, month, payments)
+                self._write_manifest(manifest)
+                return previous
+            sequence = self._expand_order(manifest['order'])
+            position = self._position(sequence, shard_id, index)
+            del payments[index]
+            self._put_shard(manifest, shard_id, payments)
+            # 移動先の分割ファイル内の位置は、履歴でそれより前にある同じ分割IDの件数
+            target_index = sequence[:position].count(new_shard)
+            sequence[position] = new_shard
+            entry = manifest['shards'].get(new_shard)
+            target = self._read_shard(entry) if entry else []
+            target.insert(target_index, payment)
+            self._write_shard(manifest, new_shard, company, month, target)
+            manifest['order'] = self._compress_order(sequence)
+            self._write_manifest(manifest)
+            return previous
+
+    # ---- payments.json からの移行・取り込み ----
+
+    def _write_verified(self, filepath):
+        """payments.json の内容で全体を置き換え、読み戻して一致を確認する（ロックの中から呼ぶ）"""
+        if not os.path.exists(filepath):
+            raise MigrationError(f'{filepath} がありません')
+        with open(filepath, 'r', encoding='utf-8') as f:
+            payments = json.load(f)
+        self._save_all(payments)
+        manifest = self._read_manifest()
+        if self._load_shards(manifest, manifest['shards']) != payments:
+            raise MigrationError(f'分割保存から読み戻した内容が {filepath} と一致しません')
+        return payments, manifest
+
+    def migrate(self, confirm=False):
+        """payments.json を分割保存に移行する（confirm=True で移行を確定し payments.json.migrated に名前を変える）"""
+        if not self.enabled:
+            raise MigrationError('PAYMENT_SHARDS が off のため移行できません')
+        with self._locked(exclusive=True):
+            manifest = self._read_manifest()
+            if manifest is not None and self._active(manifest):
+                raise MigrationError('分割保存は使用中です（移行済み）')
+            payments, manifest = self._write_verified(self.legacy_path)
+            manifest['migration'] = {
+                'source': os.path.basename(self.legacy_path),
+                'count': len(payments),
+                'digest': self._content_digest(payments),
+                'migrated_at': datetime.now().isoformat(timespec='seconds'),
+                'confirmed': confirm,
+            }
+            self._write_manifest(manifest)
+            if confirm:
+                os.replace(self.legacy_path, self.legacy_path + '.migrated')
+                logger.info('支払データを分割保存に移行しました: %d件（%s は %s.migrated として残しています）',
+                            len(payments), self.legacy_path, self.legacy_path)
+            else:
+                logger.info('支払データを分割保存に書き込みました: %d件（確定するまでは %s を使います）',
+                            len(payments), self.legacy_path)
+            return len(payments)
+
+    def restore_file(self, filepath):
+        """アーカイブから復元した payments.json の内容で全体を置き換え、payments.json.restored に名前を変える"""
+        with self._locked(exclusive=True):
+            payments, _ = self._write_verified(filepath)
+            os.replace(filepath, filepath + '.restored')
+            self.imports += 1
+        logger.info('復元した支払データを分割保存に取り込みました: %d件', len(payments))
+        return len(payments)
+
+    def compact_cold(self):
+        """古い支払月の分割ファイルを圧縮して保存し直す（起動時のウォームアップ用）"""
+        if not self.enabled or self.granularity != 'month':
+            return 0
+        with self._locked(exclusive=True):
+            manifest = self._read_manifest()
+            if manifest is None or manifest.get('granularity') != self.granularity or not self._active(manifest):
+                return 0
+            changed = 0
+            for shard_id, entry in list(manifest['shards'].items()):
+                if entry['file'].endswith('.gz') != self._is_cold(entry['month']):
+                    self._write_shard(manifest, shard_id, entry['remittance_company'], entry['month'],
+                                      self._read_shard(entry), entry['digest'])
+                    changed += 1
+            if changed:
+                self._write_manifest(manifest)
+            return changed
+
+    def status(self):
+        """分割保存の状態を取得"""
+        manifest = self._read_manifest() or self._empty_manifest()
+        shards = manifest['shards'].values()
+        return {
+            'enabled': self.enabled,
+            'in_use': self.in_use(),
+            'migration': manifest.get('migration'),
+            'legacy_file': os.path.exists(self.legacy_path),
+            'granularity': manifest.get('granularity'),
+            'shards': len(manifest['shards']),
+            'cold_shards': sum(1 for entry in shards if entry['file'].endswith('.gz')),
+            'payments': sum(entry['count'] for entry in shards),
+            'shard_writes': self.shard_writes,
+            'imports': self.imports,
+        }
+
+
+def main(argv):
+    if len(argv) < 2 or argv[1] not in ('status', 'migrate'):
+        print(__doc__)
+        return 1
+    store = payment_store
+    if argv[1] == 'status':
+        print(json.dumps(store.status(), ensure_ascii=False, indent=2))
+        return 0
+    confirm = '--confirm' in argv[2:]
+    try:
+        count = store.migrate(confirm=confirm)
+    except MigrationError as e:
+        print(f"移行できません: {e}")
+        return 1
+    if confirm:
+        print(f"移行を確定しました: {count}件（{store.legacy_path} は {store.legacy_path}.migrated に名前を変えました）")
+    else:
+        print(f"分割保存に書き込み、内容の一致を確認しました: {count}件")
+        print(f"確定するまでは {store.legacy_path} を使います。アプリケーションを停止して "
+              f"python payment_store.py migrate --confirm を実行してください")
+    return 0
+
+
+# グローバルインスタンス
+payment_store = PaymentStore()
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+リクエストのプロファイリングユーティリティ
+遅いリクエスト（振込ファイル出力・PDF生成など）の原因調査用に、処理内容を記録して profiles/ に保存する
+
+- 管理者トークン指定時（X-Profile-Token ヘッダーまたは ?_profile=トークン）: cProfile で記録（.prof）
+- PROFILE_SLOW_MS 指定時: 全リクエストのスタックを一定間隔で採取し、閾値を超えたものだけ保存（.folded）
+保存件数は PROFILE_MAX_FILES 件まで（古いものから削除）。どちらも未設定の場合は何も行わない
+
+環境変数:
+    PROFILE_TOKEN               管理者トークン（一覧・ダウンロードにも必要）
+    PROFILE_SLOW_MS             遅いリクエストとみなす処理時間（ミリ秒）
+    PROFILE_SAMPLE_INTERVAL_MS  スタック採取間隔（既定: 5ミリ秒）
+    PROFILE_MAX_FILES           保存するプロファイル数（既定: 20）
+    PROFILE_DIR                 保存先（既定: profiles）
+"""
+import cProfile
+import hmac
+import io
+import json
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from flask import g, has_request_context, request
+
+MAX_STACK_DEPTH = 128
+PROFILE_API_PREFIX = '/api/profiles'  # 一覧・ダウンロードは記録対象外
+PROFILE_EXTENSIONS = {'cprofile': '.prof', 'sampling': '.folded'}
+
+
+def _env_int(name, default=None):
+    try:
+        return int(os.environ[name])
+    except (KeyError, ValueError):
+        return default
+
+
+def _fold_stack(frame):
+    """フレームを flamegraph 用の1行（呼び出し元;...;呼び出し先）に変換"""
+    names = []
+    while frame is not None and len(names) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        names.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class _StackSampler:
+    """実行中のリクエストスレッドのスタックを一定間隔で採取するスレッド（リクエストがない間は停止）"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._active = {}  # thread_id -> Counter
+        self._thread = None
+        self._pid = None
+
+    def begin(self, thread_id):
+        with self._lock:
+            self._active[thread_id] = Counter()
+            # fork後の子プロセスには採取スレッドが引き継がれないため、プロセスIDで判定して起動する
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+                self._thread.start()
+
+    def end(self, thread_id):
+        with self._lock:
+            return self._active.pop(thread_id, None)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                if not self._active:
+                    self._thread = None
+                    return
+                for thread_id, samples in self._active.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        samples[_fold_stack(frame)] += 1
+            del frames
+
+
+class RequestProfiler:
+    """リクエストのプロファイル記録・保存クラス"""
+
+    def __init__(self):
+        self.token = os.environ.get('PROFILE_TOKEN') or None
+        self.slow_ms = _env_int('PROFILE_SLOW_MS')
+        self.max_profiles = _env_int('PROFILE_MAX_FILES', 20)
+        self.profile_dir = os.environ.get('PROFILE_DIR', 'profiles')
+        self.sampler = _StackSampler(_env_int('PROFILE_SAMPLE_INTERVAL_MS', 5) / 1000)
+        # cProfile は同時に1リクエストのみ（計測のオーバーヘッドが他のリクエストに及ばないように）
+        self._cprofile_lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._sequence = 0
+
+    @property
+    def enabled(self):
+        return bool(self.token or self.slow_ms)
+
+    def is_admin(self):
+        """リクエストに管理者トークンが指定されているか"""
+        if not self.token:
+            return False
+        supplied = request.headers.get('X-Profile-Token') or request.args.get('_profile') or ''
+        return hmac.compare_digest(supplied.encode('utf-8'), self.token.encode('utf-8'))
+
+    def is_cprofiling(self):
+        """処理中のリクエストを cProfile で記録しているか（ワーカープールを使わずに実行する判定用）"""
+        return has_request_context() and 'profile_cprofile' in g
+
+    def add_stages(self, stages):
+        """ワーカープールで実行した処理段階の時間を、スタック採取の記録に加える
+        （採取するのはリクエストのスレッドのみのため、プールのプロセスでの処理はスタックに現れない）"""
+        if not stages or not has_request_context() or 'profile_thread' not in g:
+            return
+        worker_stages = g.setdefault('profile_worker_stages', {})
+        for name, seconds in stages:
+            worker_stages[name] = worker_stages.get(name, 0.0) + seconds
+
+    def init_app(self, app):
+        """Flaskアプリケーションにプロファイリング用のフックを登録"""
+        if not self.enabled:
+            return
+
+        @app.before_request
+        def _start_profile():
+            if request.path.startswith(PROFILE_API_PREFIX):
+                return
+            if self.is_admin() and self._cprofile_lock.acquire(blocking=False):
+                profiler = cProfile.Profile()
+                g.profile_cprofile = profiler
+                g.profile_start = time.perf_counter()
+                profiler.enable()
+            elif self.slow_ms:
+                g.profile_thread = threading.get_ident()
+                g.profile_start = time.perf_counter()
+                self.sampler.begin(g.profile_thread)
+
+        @app.after_request
+        def _finish_profile(response):
+            profile_id = self._finish(response.status_code)
+            if profile_id:
+                response.headers['X-Profile-Id'] = profile_id
+            return response
+
+        @app.teardown_request
+        def _cleanup_profile(exc):
+            # 例外で after_request が呼ばれなかった場合の後始末
+            self._finish(500)
+
+    def _finish(self, status_code):
+        """記録を終了し、保存対象であれば保存してプロファイルIDを返す"""
+        profiler = g.pop('profile_cprofile', None)
+        thread_id = g.pop('profile_thread', None)
+        worker_stages = g.pop('profile_worker_stages', None)
+        start = g.pop('profile_start', None)
+        if start is None:
+            return None
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        if profiler is not None:
+            profiler.disable()
+            self._cprofile_lock.release()
+            return self._save('cprofile', elapsed_ms, status_code, profiler.dump_stats)
+
+        samples = self.sampler.end(thread_id)
+        if not samples or elapsed_ms < self.slow_ms:
+            return None
+
+        def write_folded(path):
+            with open(path, 'w', encoding='utf-8') as f:
+                for stack, count in samples.most_common():
+                    f.write(f'{stack} {count}\n')
+        extra = {'sample_count': sum(samples.values())}
+        if worker_stages:
+            extra['worker_stages_ms'] = {name: round(seconds * 1000, 2) for name, seconds in worker_stages.items()}
+        return self._save('sampling', elapsed_ms, status_code, write_folded, **extra)
+
+    def _save(self, kind, elapsed_ms, status_code, write, **extra):
+        """プロファイルとメタデータを保存し、上限を超えた古いプロファイルを削除"""
+        try:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            route = request.url_rule.rule if request.url_rule else request.path
+            with self._save_lock:
+                self._sequence += 1
+                profile_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{os.getpid()}_{self._sequence:04d}"
+            data_path = os.path.join(self.profile_dir, profile_id + PROFILE_EXTENSIONS[kind])
+            write(data_path)
+            meta = dict(extra, id=profile_id, kind=kind, method=request.method, route=route,
+                        path=request.path, status=status_code,
+                        duration_ms=round(elapsed_ms, 2), created_at=datetime.now().isoformat(),
+                        file=os.path.basename(data_path), size=os.path.getsize(data_path))
+            with open(os.path.join(self.profile_dir, profile_id + '.json'), 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False, indent=2)
+            self._prune()
+            return profile_id
+        except Exception as e:
+            print(f"プロファイル保存エラー: {e}")
+            return None
+
+    def _prune(self):
+        """保存件数の上限を超えた古いプロファイルを削除"""
+        with self._save_lock:
+            profiles = self.list_profiles()
+            for meta in profiles[self.max_profiles:]:
+                for name in (meta['file'], meta['id'] + '.json'):
+                    path = os.path.join(self.profile_dir, name)
+                    if os.path.exists(path):
+                        os.remove(path)
+
+    def list_profiles(self):
+        """保存済みプロファイルの一覧（新しい順）"""
+        if not os.path.isdir(self.profile_dir):
+            return []
+        profiles = []
+        for name in os.listdir(self.profile_dir):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.profile_dir, name), 'r', encoding='utf-8') as f:
+                    profiles.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        profiles.sort(key=lambda meta: meta.get('created_at', ''), reverse=True)
+        return profiles
+
+    def get_profile(self, profile_id):
+        """プロファイルのメタデータとファイルパスを取得"""
+        if not re.fullmatch(r'[0-9_]+', profile_id or ''):
+            return None, None
+        for meta in self.list_profiles():
+            if meta['id'] == profile_id:
+                return meta, os.path.abspath(os.path.join(self.profile_dir, meta['file']))
+        return None, None
+
+    def render_text(self, path, limit=50):
+        """cProfile の結果を累積時間順のテキストに変換"""
+        buffer = io.StringIO()
+        stats = pstats.Stats(path, stream=buffer)
+        stats.sort_stats('cumulative').print_stats(limit)
+        return buffer.getvalue()
+
+
+# グローバルインスタンス
+request_profiler = RequestProfiler()
@@ -3,6 +3,7 @@ let vendors = [];
 let companies = [];  // 送金会社データ
 let paymentItems = [];
 let currentPaymentId = null;
+let paymentHistory = [];  // 支払履歴（一覧表示用）
 
 // 金額をカンマ区切りでフォーマット（日本語短縮形を避ける）
 function formatAmount(amount) {
@@ -18,6 +19,9 @@ document.addEventListener('DOMContentLoaded', function() {
     updateVendorStats();
     setupVendorSearch(); // 業者検索機能をセットアップ
     setupCompanySearch(); // 送金会社検索機能をセットアップ
+    setupBankAutocomplete(); // 金融機関・支店の入力補完をセットアップ
+    loadBankMasterStatus();
+    connectEvents(); // 変更通知を受信
     
     // 今日の日付をデフォルトに設定
     const today = new Date().toISOString().split('T')[0];
@@ -51,11 +55,75 @@ function showSection(sectionId) {
     }
 }
 
+// 業者データのローカルキャッシュ（IndexedDB）
+// 前回取得したバージョン以降の差分だけをサーバーから取得して適用する
+const VENDOR_DB_NAME = 'keiri-vendors';
+const VENDOR_DB_VERSION = 1;
+
+function idbRequest(request) {
+    return new Promise((resolve, reject) => {
+        request.onsuccess = () => resolve(request.result);
+        request.onerror = () => reject(request.error);
+    });
+}
+
+function openVendorDb() {
+    if (!window.indexedDB) {
+        return Promise.reject(new Error('IndexedDBが使用できません'));
+    }
+    const request = indexedDB.open(VENDOR_DB_NAME, VENDOR_DB_VERSION);
+    request.onupgradeneeded = () => {
+        const db = request.result;
+        db.createObjectStore('vendors', { keyPath: 'id' });
+        db.createObjectStore('meta');
+    };
+    return idbRequest(request);
+}
+
+async function syncVendorCache() {
+    const db = await openVendorDb();
+    try {
+        const version = await idbRequest(db.transaction('meta').objectStore('meta').get('version'));
+        const response = await fetch(`/api/vendors/changes?since=${version ?? ''}`);
+        if (!response.ok) {
+            throw new Error(`業者データの差分取得に失敗しました: ${response.status}`);
+        }
+        const changes = await response.json();
+        
+        const tx = db.transaction(['vendors', 'meta'], 'readwrite');
+        const store = tx.objectStore('vendors');
+        if (changes.reset) {
+            // 差分で追えない場合は全件を置き換える
+            store.clear();
+            changes.vendors.forEach(vendor => store.put(vendor));
+        } else {
+            changes.upserts.forEach(vendor => store.put(vendor));
+            changes.deletes.forEach(vendorId => store.delete(vendorId));
+        }
+        tx.objectStore('meta').put(changes.version, 'version');
+        await new Promise((resolve, reject) => {
+            tx.oncomplete = resolve;
+            tx.onerror = () => reject(tx.error);
+            tx.onabort = () => reject(tx.error);
+        });
+        
+        return await idbRequest(db.transaction('vendors').objectStore('vendors').getAll());
+    } finally {
+        db.close();
+    }
+}
+
 // 業者データを読み込み
 async function loadVendors() {
     try {
-        const response = await fetch('/api/vendors');
-        vendors = await response.json();
+        try {
+            vendors = await syncVendorCache();
+        } catch (cacheError) {
+            // IndexedDBが使えない場合（プライベートブラウズ等）は全件を取得
+            console.warn('業者データのキャッシュを使用できません:', cacheError);
+            const response = await fetch('/api/vendors');
+            vendors = await response.json();
+        }
         updateVendorSelect();
         updateVendorList();
     } catch (error) {
@@ -76,6 +144,64 @@ async function loadCompanies() {
     }
 }
 
+// 変更通知（Server-Sent Events）
+// 支払表の作成・削除、業者データ・アップロードファイルの変更を受け取り、一覧を再取得せずに更新する
+// （他のタブ・他の利用者の変更も反映される。接続できない場合は操作後に一覧を再取得する）
+let eventsConnected = false;
+let lastEventId = null;
+const EVENTS_RECONNECT_MS = 30000;
+
+function connectEvents() {
+    if (!window.EventSource) {
+        return;
+    }
+    const url = lastEventId === null ? '/api/events' : `/api/events?last_event_id=${lastEventId}`;
+    const source = new EventSource(url);
+    
+    source.onopen = () => {
+        eventsConnected = true;
+    };
+    source.onerror = () => {
+        eventsConnected = false;
+        if (source.readyState === EventSource.CLOSED) {
+            // 接続数の上限などで拒否された場合は時間をおいて接続し直す
+            setTimeout(connectEvents, EVENTS_RECONNECT_MS);
+        }
+    };
+    
+    const listen = (type, handler) => {
+        source.addEventListener(type, event => {
+            lastEventId = event.lastEventId;
+            handler(JSON.parse(event.data));
+        });
+    };
+    listen('payment_created', payment => {
+        if (!paymentHistory.some(p => p.id === payment.id)) {
+            updatePaymentHistory([...paymentHistory, payment]);
+        }
+    });
+    listen('payment_deleted', data => {
+        updatePaymentHistory(paymentHistory.filter(p => p.id !== data.id));
+    });
+    listen('vendors_changed', async () => {
+        await loadVendors(); // 差分のみ取得
+        updateVendorStats();
+    });
+    listen('files_changed', data => {
+        updateUploadedFilesList(data.files);
+    });
+    listen('pdf_ready', data => {
+        console.log('PDFの生成が完了しました:', data.payment_id);
+    });
+    listen('reset', async () => {
+        // 復元などで全体が変わった場合・通知を取りこぼした場合は一覧を取り直す
+        loadPaymentHistory();
+        loadUploadedFiles();
+        await loadVendors();
+        updateVendorStats();
+    });
+}
+
 // 業者選択プルダウンを更新
 function updateVendorSelect() {
     const select = document.getElementById('vendor-select');
@@ -164,6 +290,190 @@ function setupVendorSearch() {
     });
 }
 
+// 金融機関・支店の入力補完（金融機関マスター）
+function setupBankAutocomplete() {
+    const bankInput = document.getElementById('bank-name');
+    const branchInput = document.getElementById('branch-name');
+    const bankCode = document.getElementById('bank-code');
+    const branchCode = document.getElementById('branch-code');
+    
+    if (!bankInput || !branchInput) return;
+    
+    let bankResults = [];
+    let branchResults = [];
+    let bankTimeout;
+    let branchTimeout;
+    
+    function fillOptions(datalistId, results, nameKey, kanaKey, codeKey) {
+        const datalist = document.getElementById(datalistId);
+        datalist.innerHTML = '';
+        results.forEach(result => {
+            const option = document.createElement('option');
+            option.value = result[nameKey];
+            option.label = `${result[codeKey]} ${result[kanaKey]}`;
+            datalist.appendChild(option);
+        });
+    }
+    
+    bankInput.addEventListener('input', function() {
+        const query = this.value.trim();
+        const selected = bankResults.find(bank => bank.bank_name === query);
+        bankCode.value = selected ? selected.bank_code : '';
+        
+        clearTimeout(bankTimeout);
+        if (selected || query.length < 1) return;
+        
+        bankTimeout = setTimeout(async () => {
+            try {
+                const response = await fetch(`/api/banks/search?q=${encodeURIComponent(query)}`);
+                bankResults = await response.json();
+                fillOptions('bank-name-options', bankResults, 'bank_name', 'bank_kana', 'bank_code');
+            } catch (error) {
+                console.error('金融機関検索エラー:', error);
+            }
+        }, 200);
+    });
+    
+    branchInput.addEventListener('input', function() {
+        const query = this.value.trim();
+        const selected = branchResults.find(branch => branch.branch_name === query);
+        branchCode.value = selected ? selected.branch_code : '';
+        
+        clearTimeout(branchTimeout);
+        if (selected || !bankCode.value || query.length < 1) return;
+        
+        branchTimeout = setTimeout(async () => {
+            try {
+                const response = await fetch(`/api/banks/${bankCode.value}/branches/search?q=${encodeURIComponent(query)}`);
+                branchResults = await response.json();
+                fillOptions('branch-name-options', branchResults, 'branch_name', 'branch_kana', 'branch_code');
+            } catch (error) {
+                console.error('支店検索エラー:', error);
+            }
+        }, 200);
+    });
+}
+
+// 金融機関マスターの状態を表示
+async function loadBankMasterStatus() {
+    const statusLabel = document.getElementById('bank-master-status');
+    if (!statusLabel) return;
+    
+    try {
+        const response = await fetch('/api/banks/status');
+        const status = await response.json();
+        statusLabel.textContent = status.loaded
+            ? `登録済み: 金融機関${status.bank_count}件・支店${status.branch_count}件`
+            : '未登録';
+    } catch (error) {
+        console.error('金融機関マスター状態取得エラー:', error);
+    }
+}
+
+// 金融機関マスターを取り込み
+async function importBankMaster() {
+    const fileInput = document.getElementById('bank-master-file');
+    const file = fileInput.files[0];
+    
+    if (!file) {
+        showAlert('ファイルを選択してください', 'danger');
+        return;
+    }
+    
+    const formData = new FormData();
+    formData.append('file', file);
+    
+    try {
+        const response = await fetch('/api/banks/import', {
+            method: 'POST',
+            body: formData
+        });
+        const result = await response.json();
+        
+        if (result.success) {
+            showAlert(result.message, 'success');
+            fileInput.value = '';
+            loadBankMasterStatus();
+        } else {
+            showAlert(result.error, 'danger');
+        }
+    } catch (error) {
+        console.error('金融機関マスター取り込みエラー:', error);
+        showAlert('金融機関マスターの取り込みに失敗しました', 'danger');
+    }
+}
+
+// 会計システムの支払データから支払表を一括作成（dryRun の場合は保存せずに内容を確認）
+async function importPaymentFile(dryRun) {
+    const fileInput = document.getElementById('payment-import-file');
+    const file = fileInput.files[0];
+    
+    if (!file) {
+        showAlert('ファイルを選択してください', 'danger');
+        return;
+    }
+    
+    const formData = new FormData();
+    formData.append('file', file);
+    formData.append('payment_date', document.getElementById('payment-import-date').value);
+    formData.append('remittance_company', document.getElementById('payment-import-company').value);
+    formData.append('dry_run', dryRun ? '1' : '0');
+    
+    try {
+        const response = await fetch('/api/payments/import', {
+            method: 'POST',
+            body: formData
+        });
+        const result = await response.json();
+        
+        if (!result.success) {
+            showAlert(result.error, 'danger');
+            return;
+        }
+        showPaymentImportResult(result, dryRun);
+        if (!dryRun && result.payments.length > 0) {
+            fileInput.value = '';
+            const message = `支払表を${result.payments.length}件作成しました（${result.imported_count}明細）`;
+            showAlert(result.duplicate_warning ? `${message} ※${result.duplicate_warning}` : message,
+                      result.duplicate_warning || result.unmatched.length ? 'warning' : 'success');
+            if (!eventsConnected) {
+                loadPaymentHistory();
+            }
+        }
+    } catch (error) {
+        console.error('支払データ取り込みエラー:', error);
+        showAlert('支払データの取り込みに失敗しました', 'danger');
+    }
+}
+
+// 一括取り込みの結果（作成する支払表と取り込めない行）を表示
+function showPaymentImportResult(result, dryRun) {
+    const container = document.getElementById('payment-import-result');
+    const paymentLines = result.payments.map(p =>
+        `<li>${p.payment_date} ${p.remittance_company}: ${p.item_count}件 ¥${p.total_amount.toLocaleString()}</li>`
+    ).join('');
+    const unmatchedRows = result.unmatched.map(row =>
+        `<tr><td>${row.row}</td><td>${row.vendor_name || row.account_number}</td>` +
+        `<td>${row.amount}</td><td>${row.reason}</td></tr>`
+    ).join('');
+    
+    container.innerHTML = `
+        <div class="small">
+            <strong>${dryRun ? '作成予定' : '作成済み'}:</strong> ${result.imported_count} / ${result.row_count}行
+            <ul class="mb-2">${paymentLines}</ul>
+            ${result.warning ? `<div class="text-warning">${result.warning}</div>` : ''}
+        </div>
+        ${unmatchedRows ? `
+        <div class="small text-danger mb-1">取り込めない行: ${result.unmatched.length}件</div>
+        <div class="table-responsive" style="max-height: 240px;">
+            <table class="table table-sm small">
+                <thead><tr><th>行</th><th>業者・口座</th><th>金額</th><th>理由</th></tr></thead>
+                <tbody>${unmatchedRows}</tbody>
+            </table>
+        </div>` : ''}
+    `;
+}
+
 // 送金会社検索機能
 function setupCompanySearch() {
     const searchInput = document.getElementById('company-search');
@@ -273,7 +583,9 @@ async function addVendor() {
         branch_name: document.getElementById('branch-name').value,
         account_type: parseInt(document.getElementById('account-type').value),
         account_number: document.getElementById('account-number').value,
-        account_holder: document.getElementById('account-holder').value
+        account_holder: document.getElementById('account-holder').value,
+        bank_code: document.getElementById('bank-code').value,
+        branch_code: document.getElementById('branch-code').value
     };
     
     // バリデーション
@@ -297,6 +609,8 @@ async function addVendor() {
         if (result.success) {
             showAlert('業者を登録しました', 'success');
             form.reset();
+            document.getElementById('bank-code').value = '';
+            document.getElementById('branch-code').value = '';
             loadVendors();
         } else {
             showAlert('業者の登録に失敗しました', 'danger');
@@ -487,8 +801,15 @@ async function createPaymentList() {
                 message += `。ただし、PDF生成に失敗しました: ${result.error}`;
             }
             
-            showAlert(message, 'success');
-            loadPaymentHistory();
+            if (result.warning) {
+                // 同じ支払日・振込先・金額の支払いが既存の支払表にある（二重支払の可能性）
+                showAlert(`${message} ※${result.warning}`, 'warning');
+            } else {
+                showAlert(message, 'success');
+            }
+            if (!eventsConnected) {
+                loadPaymentHistory();
+            }
         } else {
             showAlert('支払表の作成に失敗しました', 'danger');
         }
@@ -527,9 +848,28 @@ function generateTransferFile() {
         return;
     }
     
-    // ファイルダウンロード
-    window.location.href = `/api/payments/${currentPaymentId}/transfer`;
-    showAlert('総合振込ファイルをダウンロードしました', 'success');
+    downloadTransferFile(currentPaymentId);
+}
+
+// 振込データを検証（不備がある場合は出力するか確認）
+async function confirmTransferValidation(paymentId) {
+    try {
+        const response = await fetch(`/api/payments/${paymentId}/validate`);
+        const validation = await response.json();
+        if (validation.valid) {
+            return { proceed: true, force: false };
+        }
+        
+        const messages = validation.issues
+            .filter(issue => issue.severity === 'error')
+            .slice(0, 10)
+            .map(issue => `・${issue.vendor_name || issue.remitter || ''} ${issue.message}`);
+        const proceed = confirm(`振込データに不備があります（${validation.error_count}件）\n\n${messages.join('\n')}\n\nこのまま出力しますか？`);
+        return { proceed, force: proceed };
+    } catch (error) {
+        console.error('振込データ検証エラー:', error);
+        return { proceed: true, force: false };
+    }
 }
 
 // 支払履歴を読み込み
@@ -546,12 +886,19 @@ async function loadPaymentHistory() {
 
 // 支払履歴テーブルを更新
 function updatePaymentHistory(payments) {
+    paymentHistory = payments;
     const tbody = document.getElementById('payment-history');
     tbody.innerHTML = '';
     
+    updateExportCompanies(payments);
+    
     payments.forEach(payment => {
         const row = document.createElement('tr');
-        const totalAmount = payment.items.reduce((sum, item) => sum + parseInt(item.amount), 0);
+        // 変更通知で追加した行は明細を持たず、件数・合計金額のみ
+        const itemCount = payment.items ? payment.items.length : payment.item_count;
+        const totalAmount = payment.items
+            ? payment.items.reduce((sum, item) => sum + parseInt(item.amount), 0)
+            : payment.total_amount;
         
         // 作成日時を日本語形式で表示
         const createdAt = new Date(payment.created_at);
@@ -575,7 +922,7 @@ function updatePaymentHistory(payments) {
             <td>${createdAtFormatted}</td>
             <td>${paymentDateFormatted}</td>
             <td>${payment.remittance_company}</td>
-            <td>${payment.items.length}件</td>
+            <td>${itemCount}件</td>
             <td>${formatAmount(totalAmount)}円</td>
             <td>
                 <button class="btn btn-info btn-sm me-1" onclick="recreateFromHistory('${payment.id}')" title="この支払表をベースに新しい支払表を作成">
@@ -596,12 +943,93 @@ function updatePaymentHistory(payments) {
     });
 }
 
-// 履歴から振込ファイルをダウンロード
-function downloadTransferFile(paymentId) {
-    window.location.href = `/api/payments/${paymentId}/transfer`;
+// 振込ファイルをダウンロード（出力前に検証）
+async function downloadTransferFile(paymentId) {
+    const { proceed, force } = await confirmTransferValidation(paymentId);
+    if (!proceed) {
+        return;
+    }
+    
+    window.location.href = `/api/payments/${paymentId}/transfer${force ? '?force=1' : ''}`;
     showAlert('総合振込ファイルをダウンロードしました', 'success');
 }
 
+// Excel出力の送金会社の選択肢を支払履歴から作成
+function updateExportCompanies(payments) {
+    const select = document.getElementById('export-company');
+    const selected = select.value;
+    const companies = [...new Set(payments.map(p => p.remittance_company).filter(Boolean))].sort();
+    select.innerHTML = '<option value="">すべて</option>';
+    companies.forEach(company => {
+        const option = document.createElement('option');
+        option.value = company;
+        option.textContent = company;
+        select.appendChild(option);
+    });
+    select.value = companies.includes(selected) ? selected : '';
+}
+
+// 支払履歴をExcelで出力（明細が多い場合はサーバーのバックグラウンド作成を待ってダウンロード）
+const EXPORT_POLL_MS = 3000;
+
+async function exportPaymentsExcel() {
+    const params = new URLSearchParams();
+    const dateFrom = document.getElementById('export-from').value;
+    const dateTo = document.getElementById('export-to').value;
+    const company = document.getElementById('export-company').value;
+    if (dateFrom) params.set('from', dateFrom);
+    if (dateTo) params.set('to', dateTo);
+    if (company) params.set('company', company);
+    
+    const button = document.getElementById('export-button');
+    button.disabled = true;
+    try {
+        const response = await fetch(`/api/payments/export?${params}`);
+        if (response.status === 202) {
+            const job = await response.json();
+            showAlert('明細が多いため、Excelをバックグラウンドで作成しています...', 'info');
+            await waitForExport(job.status_url);
+            return;
+        }
+        if (!response.ok) {
+            const result = await response.json();
+            showAlert(`Excel出力エラー: ${result.error}`, 'danger');
+            return;
+        }
+        
+        // ダウンロード名は Content-Disposition から取得
+        const disposition = response.headers.get('Content-Disposition') || '';
+        const match = disposition.match(/filename="?([^";]+)"?/);
+        const link = document.createElement('a');
+        link.href = URL.createObjectURL(await response.blob());
+        link.download = match ? match[1] : 'payments.xlsx';
+        link.click();
+        URL.revokeObjectURL(link.href);
+        showAlert('支払履歴をExcelで出力しました', 'success');
+    } catch (error) {
+        console.error('Excel出力エラー:', error);
+        showAlert('Excel出力に失敗しました', 'danger');
+    } finally {
+        button.disabled = false;
+    }
+}
+
+async function waitForExport(statusUrl) {
+    for (;;) {
+        await new Promise(resolve => setTimeout(resolve, EXPORT_POLL_MS));
+        const job = await (await fetch(statusUrl)).json();
+        if (job.status === 'done') {
+            window.location.href = job.download_url;
+            showAlert(`支払履歴をExcelで出力しました（${job.item_count}明細）`, 'success');
+            return;
+        }
+        if (job.status !== 'running') {
+            showAlert(`Excel出力エラー: ${job.error || '作成に失敗しました'}`, 'danger');
+            return;
+        }
+    }
+}
+
 // アラート表示
 function showAlert(message, type = 'info') {
     // 既存のアラートを削除
@@ -661,8 +1089,10 @@ async function uploadMasterFile() {
         if (result.success) {
             showAlert(result.message, 'success');
             fileInput.value = ''; // ファイル選択をクリア
-            loadVendors(); // 業者一覧を更新
-            loadUploadedFiles(); // アップロードファイル一覧を更新
+            if (!eventsConnected) {
+                loadVendors(); // 業者一覧を更新
+                loadUploadedFiles(); // アップロードファイル一覧を更新
+            }
             updateVendorStats(); // 統計を更新
         } else {
             showAlert(result.error, 'danger');
@@ -745,8 +1175,10 @@ async function deleteUploadedFile(filename) {
         
         if (result.success) {
             showAlert(result.message, 'success');
-            loadVendors(); // 業者一覧を更新
-            loadUploadedFiles(); // アップロードファイル一覧を更新
+            if (!eventsConnected) {
+                loadVendors(); // 業者一覧を更新
+                loadUploadedFiles(); // アップロードファイル一覧を更新
+            }
             updateVendorStats(); // 統計を更新
         } else {
             showAlert(result.error, 'danger');
@@ -775,7 +1207,9 @@ async function deletePayment(paymentId, paymentDate, remittanceCompany) {
         .then(response => {
             if (response.ok) {
                 alert('支払表を削除しました。');
-                loadPaymentHistory(); // 履歴を再読み込み
+                if (!eventsConnected) {
+                    loadPaymentHistory(); // 履歴を再読み込み
+                }
             } else {
                 alert('削除に失敗しました。');
             }
@@ -925,7 +1359,20 @@ function checkBackupStatus() {
     .then(data => {
         if (data.success) {
             let message = `バックアップ状態\n\n`;
-            message += `バックアップファイル数: ${data.backup_count}件\n\n`;
+            message += `バックアップファイル数: ${data.backup_count}件\n`;
+            if (data.scheduler) {
+                const lastSuccess = data.scheduler.last_success
+                    ? new Date(data.scheduler.last_success).toLocaleString('ja-JP')
+                    : '未実行';
+                message += `最終自動バックアップ: ${lastSuccess}\n`;
+                if (data.scheduler.pending.length > 0) {
+                    message += `未実行の自動バックアップ: ${data.scheduler.pending.length}件（${Math.round(data.scheduler.lag_seconds)}秒待機中）\n`;
+                }
+                if (data.scheduler.last_error) {
+                    message += `自動バックアップエラー: ${data.scheduler.last_error}\n`;
+                }
+            }
+            message += '\n';
             
             if (data.backup_files.length > 0) {
                 message += '最新のバックアップファイル:\n';
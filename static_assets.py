@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+静的ファイル（JavaScript・CSS）の配信ユーティリティ
+ファイル内容のハッシュを含むURL（例: /assets/js/app.3f2a9c1b04de.js）で配信し、
+内容が変わればURLも変わるため、ブラウザに1年間・再検証なし（immutable）でキャッシュさせる
+gzip・brotli（brotli パッケージがインストールされている場合）で圧縮したものを事前に作成し、
+Accept-Encoding に応じて返す
+
+テンプレートでは asset_url('js/app.js') でハッシュ付きのURLを取得する
+ファイルが更新された場合は次に asset_url を呼んだときに作り直す（開発中の編集にも追従する）
+
+環境変数:
+    ASSETS_FINGERPRINT  0 の場合はハッシュ付きURLを使わず通常の /static/ で配信（既定: 1）
+"""
+import gzip
+import hashlib
+import os
+import threading
+
+from flask import Response, abort, request, url_for
+
+try:
+    import brotli
+except ImportError:  # brotli は任意（未インストールの場合は gzip のみ）
+    brotli = None
+
+ASSET_EXTENSIONS = ('.js', '.css', '.svg')
+CACHE_CONTROL = 'public, max-age=31536000, immutable'
+HASH_LENGTH = 12
+# 圧縮しても小さくならない程度のファイルは圧縮しない
+MIN_COMPRESS_SIZE = 512
+
+MIMETYPES = {
+    '.js': 'text/javascript; charset=utf-8',
+    '.css': 'text/css; charset=utf-8',
+    '.svg': 'image/svg+xml',
+}
+
+
+class _Asset:
+    """ハッシュ付きの名前と圧縮済みの内容"""
+
+    __slots__ = ('name', 'fingerprinted', 'digest', 'mtime_ns', 'mimetype', 'variants')
+
+    def __init__(self, name, path):
+        with open(path, 'rb') as f:
+            content = f.read()
+        self.name = name
+        self.mtime_ns = os.stat(path).st_mtime_ns
+        self.digest = hashlib.sha256(content).hexdigest()[:HASH_LENGTH]
+        base, ext = os.path.splitext(name)
+        self.fingerprinted = f"{base}.{self.digest}{ext}"
+        self.mimetype = MIMETYPES.get(ext, 'application/octet-stream')
+        # 符号化方式 -> 内容（優先順）
+        self.variants = {}
+        if len(content) >= MIN_COMPRESS_SIZE:
+            if brotli is not None:
+                self.variants['br'] = brotli.compress(content, quality=11)
+            self.variants['gzip'] = gzip.compress(content, compresslevel=9, mtime=0)
+        self.variants['identity'] = content
+
+
+class StaticAssets:
+    """ハッシュ付きURLでの静的ファイル配信クラス"""
+
+    def __init__(self):
+        self.enabled = os.environ.get('ASSETS_FINGERPRINT', '1') != '0'
+        self.static_folder = None
+        self._lock = threading.Lock()
+        self._assets = {}         # 元の名前 -> _Asset
+        self._fingerprinted = {}  # ハッシュ付きの名前 -> _Asset
+
+    def init_app(self, app):
+        """配信ルートとテンプレート用の asset_url を登録"""
+        self.static_folder = app.static_folder
+        app.add_url_rule('/assets/<path:filename>', 'assets', self.serve)
+
+        @app.context_processor
+        def _asset_url_processor():
+            return {'asset_url': self.url}
+
+    def _iter_files(self):
+        for root, _, files in os.walk(self.static_folder):
+            for filename in files:
+                if filename.endswith(ASSET_EXTENSIONS):
+                    path = os.path.join(root, filename)
+                    yield os.path.relpath(path, self.static_folder).replace(os.sep, '/'), path
+
+    def _load(self, name, path):
+        asset = _Asset(name, path)
+        with self._lock:
+            previous = self._assets.get(name)
+            if previous is not None:
+                self._fingerprinted.pop(previous.fingerprinted, None)
+            self._assets[name] = asset
+            self._fingerprinted[asset.fingerprinted] = asset
+        return asset
+
+    def build(self):
+        """静的フォルダーの全ファイルのハッシュと圧縮済みの内容を作成（起動時・ウォームアップ用）"""
+        if not self.enabled or not self.static_folder or not os.path.isdir(self.static_folder):
+            return 0
+        count = 0
+        for name, path in self._iter_files():
+            self._get(name, path)
+            count += 1
+        return count
+
+    def _get(self, name, path=None):
+        """ファイルの情報を取得（未作成またはファイルが更新されていれば作り直す。ファイルがなければ None）"""
+        path = path or os.path.join(self.static_folder, name)
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+        asset = self._assets.get(name)
+        if asset is None or asset.mtime_ns != mtime_ns:
+            asset = self._load(name, path)
+        return asset
+
+    def url(self, filename):
+        """テンプレート用: ハッシュ付きのURL（対象外・無効の場合は通常の /static/ のURL）"""
+        if self.enabled and filename.endswith(ASSET_EXTENSIONS) and '..' not in filename.split('/'):
+            asset = self._get(filename)
+            if asset is not None:
+                return url_for('assets', filename=asset.fingerprinted)
+        return url_for('static', filename=filename)
+
+    def serve(self, filename):
+        """ハッシュ付きのURLのファイルを配信（クライアントが対応していれば圧縮済みの内容を返す）"""
+        asset = self._fingerprinted.get(filename)
+        if asset is None:
+            # 未作成（テンプレートを表示していない別ワーカー）またはファイルが更新された場合は作り直す
+            self.build()
+            asset = self._fingerprinted.get(filename)
+        if asset is None:
+            abort(404)
+        # 圧縮の有無で内容が変わるため弱いETagを使う
+        if request.if_none_match.contains_weak(asset.digest):
+            response = Response(status=304)
+        else:
+            accepted = request.accept_encodings
+            encoding = next(
+                (name for name in asset.variants if name == 'identity' or accepted[name]),
+                'identity'
+            )
+            response = Response(asset.variants[encoding], mimetype=asset.mimetype)
+            if encoding != 'identity':
+                response.headers['Content-Encoding'] = encoding
+        response.headers['Cache-Control'] = CACHE_CONTROL
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.set_etag(asset.digest, weak=True)
+        return response
+
+    def status(self):
+        """作成済みのファイルの一覧を取得"""
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'brotli': brotli is not None,
+                'assets': {
+                    name: {'url': asset.fingerprinted,
+                           'sizes': {encoding: len(content) for encoding, content in asset.variants.items()}}
+                    for name, asset in self._assets.items()
+                },
+            }
+
+
+# グローバルインスタンス
+static_assets = StaticAssets()
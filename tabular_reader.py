@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+表形式ファイル読み込みユーティリティ
+CSV（文字コード自動判定）・Excelファイルをヘッダー行とデータ行に分けて読み込む
+"""
+import csv
+import io
+
+
+def detect_encoding_and_read_csv(filepath):
+    """CSVファイルのエンコーディングを検出して読み込み"""
+    # 試行するエンコーディングのリスト
+    encodings = ['utf-8', 'shift_jis', 'cp932', 'euc-jp', 'iso-2022-jp', 'utf-8-sig']
+    
+    for encoding in encodings:
+        try:
+            with open(filepath, 'r', encoding=encoding, newline='') as csvfile:
+                reader = csv.reader(csvfile)
+                headers = next(reader)
+                data_rows = list(reader)
+                return headers, data_rows, None
+        except (UnicodeDecodeError, UnicodeError):
+            continue
+        except Exception as e:
+            continue
+    
+    # すべてのエンコーディングで失敗した場合、バイナリモードで読み込んでエラー文字を置換
+    try:
+        with open(filepath, 'rb') as f:
+            content = f.read()
+        
+        # UTF-8で読み込み、エラー文字は置換
+        text_content = content.decode('utf-8', errors='replace')
+        
+        # StringIOを使ってCSVとして解析
+        csv_content = io.StringIO(text_content)
+        reader = csv.reader(csv_content)
+        headers = next(reader)
+        data_rows = list(reader)
+        return headers, data_rows, "警告: 一部の文字が正しく読み込めませんでした"
+        
+    except Exception as e:
+        return None, None, f"ファイルの読み込みに失敗しました: {str(e)}"
+
+
+def read_excel_rows(filepath):
+    """Excelファイルの先頭シートを読み込み（空行はスキップ）"""
+    import openpyxl  # 読み込みに時間がかかるため初回利用時に読み込む
+
+    workbook = openpyxl.load_workbook(filepath)
+    worksheet = workbook.active
+    
+    # ヘッダー行を取得
+    headers = [cell.value for cell in worksheet[1]]
+    
+    # データ行を取得
+    data_rows = []
+    for row in worksheet.iter_rows(min_row=2, values_only=True):
+        if any(cell is not None for cell in row):  # 空行をスキップ
+            data_rows.append([str(cell) if cell is not None else '' for cell in row])
+    
+    return headers, data_rows
+
+
+def read_tabular_file(filepath):
+    """拡張子に応じてCSV・Excelファイルを読み込み（ヘッダー, データ行, 警告・エラーメッセージ）"""
+    file_ext = filepath.rsplit('.', 1)[-1].lower()
+    if file_ext in ('csv', 'txt'):
+        return detect_encoding_and_read_csv(filepath)
+    
+    try:
+        headers, data_rows = read_excel_rows(filepath)
+        return headers, data_rows, None
+    except Exception as e:
+        return None, None, f"ファイルの読み込みに失敗しました: {str(e)}"
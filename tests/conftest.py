@@ -0,0 +1,91 @@
+"""
+テスト共通の設定・データ
+リポジトリ直下のモジュールを読み込めるようにし、振込ファイル出力用の支払表データを用意する
+"""
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# アプリケーションの読み込み時にワーカープールを使わない（重い処理はテストのプロセスで実行する）
+os.environ.setdefault('HEAVY_WORKERS', '0')
+
+
+def make_recipient(account_number, bank_code='0001', branch_code='001', holder='ｶ)ﾃｽﾄ'):
+    """受取人の口座情報のスナップショット（payment_exports.recipient_snapshot と同じ形）"""
+    return {
+        'name': 'テスト商事',
+        'bank_code': bank_code,
+        'bank_name': 'ﾐｽﾞﾎ',
+        'branch_code': branch_code,
+        'branch_name': 'ﾎﾝﾃﾝ',
+        'account_type': '1',
+        'account_number': account_number,
+        'account_holder': holder,
+    }
+
+
+def make_payment(payment_id='20250101_090000', amounts=(10000, 20000), company='テスト送金会社'):
+    """口座情報のスナップショット付きの支払表（業者マスターを参照せずに振込ファイルを出力できる）"""
+    items = [
+        {
+            'id': 1700000000000 + index,
+            'vendor_id': index + 1,
+            'vendor_name': f'業者{index + 1}',
+            'amount': amount,
+            'description': '外注費',
+            'remarks': '',
+            'recipient': make_recipient(f'{index + 1:07d}'),
+        }
+        for index, amount in enumerate(amounts)
+    ]
+    return {
+        'id': payment_id,
+        'payment_date': '2025-01-10',
+        'remittance_company': company,
+        'remitter': {
+            'name': company,
+            'client_code': '1234567890',
+            'account_holder': 'ﾃｽﾄｿｳｷﾝ',
+            'bank_code': '0001',
+            'bank_name': 'ﾐｽﾞﾎ',
+            'branch_code': '001',
+            'branch_name': 'ﾎﾝﾃﾝ',
+            'account_type': '1',
+            'account_number': '1234567',
+            'transfer_format': 'csv',
+        },
+        'items': items,
+        'created_at': '2025-01-01T09:00:00',
+    }
+
+
+@pytest.fixture(scope='session', autouse=True)
+def stop_log_writer():
+    """ログの書き込みスレッドをテストの出力の取り込み中に停止する（終了時に閉じた出力へ書き込まないように）"""
+    yield
+    if 'app_logging' in sys.modules:
+        sys.modules['app_logging'].logging_manager.shutdown()
+
+
+@pytest.fixture
+def app_client(tmp_path, monkeypatch):
+    """作業ディレクトリを一時ディレクトリにしてアプリケーションのテストクライアントを返す
+
+    データファイルは相対パスのため、支払表を書き込んでから呼び出す（初回の読み込みもこのディレクトリで行う）
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('BACKUP_INTERVAL', '0')
+
+    def create(payments):
+        with open('payments.json', 'w', encoding='utf-8') as f:
+            json.dump(payments, f, ensure_ascii=False)
+        with open('vendors.json', 'w', encoding='utf-8') as f:
+            json.dump([], f)
+        # バックアップの保存先はアプリケーションの初回読み込み時にしか作られないため、2回目以降のテスト用に作成
+        os.makedirs('backups', exist_ok=True)
+        import app
+        return app.app.test_client()
+    return create
@@ -0,0 +1,42 @@
+"""バックアップ履歴の時点指定（data_persistence.py の find_entry・復元API）のテスト"""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from conftest import make_payment
+
+
+@pytest.fixture
+def manager(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    from data_persistence import DataPersistenceManager
+    manager = DataPersistenceManager()
+    manager.backup_to_file([{'id': 1, 'items': []}], 'payments')
+    return manager
+
+
+def _utc(timestamp, seconds=0):
+    """インデックスの日時（タイムゾーンなしのローカル時刻）をUTCのISO 8601形式にする"""
+    value = datetime.fromisoformat(timestamp) + timedelta(seconds=seconds)
+    return value.astimezone(timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+def test_timezone_aware_timestamp_is_compared_in_local_time(manager):
+    timestamp = manager.list_entries('payments')[0]['timestamp']
+    assert manager.find_entry('payments', timestamp=_utc(timestamp, 1)) == 0
+    assert manager.find_entry('payments', timestamp=_utc(timestamp, -1)) is None
+    assert manager.find_entry('payments', timestamp=timestamp) == 0
+
+
+@pytest.mark.parametrize('timestamp', ['2025-13-01T00:00:00', 'yesterday', 20250101])
+def test_invalid_timestamp_raises_value_error(manager, timestamp):
+    with pytest.raises(ValueError):
+        manager.find_entry('payments', timestamp=timestamp)
+
+
+@pytest.mark.parametrize('timestamp', ['yesterday', 20250101])
+def test_restore_with_invalid_timestamp_is_bad_request(app_client, timestamp):
+    client = app_client([make_payment()])
+    response = client.post('/api/backup/history/restore', json={'series': 'payments', 'timestamp': timestamp})
+    assert response.status_code == 400
+    assert '日時の形式が不正です' in response.get_json()['error']
@@ -0,0 +1,43 @@
+"""バックアップのバックグラウンド実行（backup_scheduler.py）のテスト"""
+import json
+
+import pytest
+
+
+@pytest.fixture
+def scheduler(tmp_path, monkeypatch):
+    # バックアップの保存先（backups/）は読み込み時の作業ディレクトリに作られる
+    monkeypatch.chdir(tmp_path)
+    import backup_scheduler
+    calls = []
+    monkeypatch.setattr(backup_scheduler.persistence_manager, 'auto_backup_payments',
+                        lambda data, serialized=None: calls.append((data, serialized)) or 'backup')
+    return backup_scheduler, calls
+
+
+def test_saved_data_is_reused_without_parsing(scheduler, monkeypatch):
+    module, calls = scheduler
+    payments = [{'id': '1', 'items': []}]
+    serialized = json.dumps(payments)
+
+    def fail(*args, **kwargs):
+        raise AssertionError('JSONを読み込み直しています')
+    monkeypatch.setattr(module.json, 'loads', fail)
+    module.BackupScheduler(interval=0).submit('payments', serialized, payments)
+    assert calls == [(payments, serialized)]
+    assert calls[0][0] is payments
+
+
+def test_callable_returns_string_and_data(scheduler):
+    module, calls = scheduler
+    payments = [{'id': '1', 'items': []}]
+    runner = module.BackupScheduler(interval=0)
+    runner.submit('payments', lambda: (json.dumps(payments), payments))
+    assert calls == [(payments, json.dumps(payments))]
+    assert runner.status()['last_error'] is None
+
+
+def test_string_only_is_parsed(scheduler):
+    module, calls = scheduler
+    module.BackupScheduler(interval=0).submit('payments', '[{"id": "1", "items": []}]')
+    assert calls[0][0] == [{'id': '1', 'items': []}]
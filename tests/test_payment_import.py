@@ -0,0 +1,39 @@
+"""支払データの一括取り込み（payment_import.py）のテスト"""
+import pytest
+
+from payment_import import parse_amount, parse_date
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('2025/1/5', '2025-01-05'),
+    ('20250105', '2025-01-05'),
+    ('2025年1月5日', '2025-01-05'),
+    ('２０２５－０２－２８', '2025-02-28'),
+    ('2024-02-29 00:00:00', '2024-02-29'),
+    ('2025-02-29', None),
+    ('2025-02-31', None),
+    ('2025-04-31', None),
+    ('2025-13-01', None),
+    ('支払日', None),
+])
+def test_parse_date(text, expected):
+    assert parse_date(text) == expected
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('12,345', 12345),
+    ('¥1,000円', 1000),
+    ('１２３４', 1234),
+    (1234.0, 1234),
+    ('1234.00', 1234),
+    ('9999999999', 9999999999),
+    ('12345678901234567890', 12345678901234567890),
+    ('1234.56', None),
+    ('0', None),
+    ('-100', None),
+    ('abc', None),
+    ('nan', None),
+    ('', None),
+])
+def test_parse_amount(text, expected):
+    assert parse_amount(text) == expected
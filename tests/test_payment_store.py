@@ -0,0 +1,173 @@
+"""支払データの分割保存（payment_store.py）のテスト"""
+import json
+import os
+
+import pytest
+
+from conftest import make_payment
+from payment_store import MigrationError, PaymentStore
+
+
+def _payments():
+    # 送金会社が交互に並ぶ支払表（分割ファイルをまたいで履歴の順を保つ必要がある）
+    return [
+        make_payment('20250101_090000', (1000,), company='A社'),
+        make_payment('20250102_090000', (2000,), company='B社'),
+        make_payment('20250103_090000', (3000,), company='A社'),
+        make_payment('20250104_090000', (4000,), company='A社'),
+        make_payment('20250105_090000', (5000,), company='B社'),
+    ]
+
+
+def _ids(payments):
+    return [payment['id'] for payment in payments]
+
+
+@pytest.fixture
+def make_store(tmp_path, monkeypatch):
+    def create(mode='remitter'):
+        monkeypatch.setenv('PAYMENT_SHARDS', mode)
+        return PaymentStore(str(tmp_path / 'payment_shards'), str(tmp_path / 'payments.json'))
+    return create
+
+
+def test_disabled_by_default(tmp_path, monkeypatch):
+    monkeypatch.delenv('PAYMENT_SHARDS', raising=False)
+    store = PaymentStore(str(tmp_path / 'payment_shards'), str(tmp_path / 'payments.json'))
+    assert not store.enabled
+    assert not store.in_use()
+
+
+def test_save_all_and_load_round_trip(make_store):
+    store = make_store()
+    payments = _payments()
+    store.save_all(payments)
+
+    assert store.load() == payments
+    assert _ids(store.load(remittance_company='A社')) == _ids(payments[0:1] + payments[2:4])
+    assert store.status()['shards'] == 2
+
+
+def test_save_all_rewrites_only_changed_shards(make_store):
+    store = make_store()
+    payments = _payments()
+    store.save_all(payments)
+    writes = store.shard_writes
+
+    payments[1]['items'][0]['amount'] = 2500
+    assert store.save_all(payments) == 1
+    assert store.shard_writes == writes + 1
+    assert store.load() == payments
+
+
+def test_append_keeps_history_order(make_store):
+    store = make_store()
+    payments = _payments()
+    store.save_all(payments[:3])
+    store.append(payments[3:4])
+    store.append(payments[4:])
+
+    assert _ids(store.load()) == _ids(payments)
+    assert store.load() == payments
+
+
+def test_month_shards_filter_by_payment_month(make_store):
+    store = make_store('month')
+    payments = _payments()
+    payments[2]['payment_date'] = '2025-03-01'
+    store.save_all(payments)
+
+    assert store.load() == payments
+    assert _ids(store.load(date_from='2025-02-01')) == [payments[2]['id']]
+    assert store.compact_cold() == 0  # 保存時に古い月は圧縮済み
+    assert store.status()['cold_shards'] == store.status()['shards']
+
+
+def test_migration_keeps_legacy_file_until_confirmed(make_store):
+    store = make_store()
+    payments = _payments()
+    with open(store.legacy_path, 'w', encoding='utf-8') as f:
+        json.dump(payments[:4], f, ensure_ascii=False)
+    assert not store.in_use()
+
+    assert store.migrate() == 4
+    assert os.path.exists(store.legacy_path)
+    assert not store.in_use()
+    assert store.status()['migration']['confirmed'] is False
+
+    # 確定までに payments.json へ追加された支払表も含めて移行する
+    with open(store.legacy_path, 'w', encoding='utf-8') as f:
+        json.dump(payments, f, ensure_ascii=False)
+    assert store.migrate(confirm=True) == 5
+    assert store.in_use()
+    assert not os.path.exists(store.legacy_path)
+    assert os.path.exists(store.legacy_path + '.migrated')
+    assert store.load() == payments
+
+    with pytest.raises(MigrationError):
+        store.migrate(confirm=True)
+
+
+def test_restored_legacy_file_is_not_consumed_on_load(make_store):
+    store = make_store()
+    payments = _payments()
+    store.save_all(payments)
+    with open(store.legacy_path, 'w', encoding='utf-8') as f:
+        json.dump(payments[:1], f, ensure_ascii=False)
+
+    assert store.in_use()
+    assert store.load() == payments
+    assert os.path.exists(store.legacy_path)
+
+    assert store.restore_file(store.legacy_path) == 1
+    assert store.load() == payments[:1]
+    assert os.path.exists(store.legacy_path + '.restored')
+
+
+def test_remove_keeps_payments_added_by_another_worker(make_store):
+    store = make_store()
+    other = make_store()  # 別のワーカーのインスタンス
+    payments = _payments()
+    store.save_all(payments[:4])
+    other.append(payments[4:])
+
+    removed = store.remove(payments[1]['id'])
+    assert removed == payments[1]
+    assert _ids(store.load()) == _ids(payments[:1] + payments[2:])
+    assert store.remove('missing') is None
+
+    # 分割ファイルが空になった場合はファイルごと削除する
+    store.remove(payments[4]['id'])
+    assert store.status()['shards'] == 1
+
+
+def test_replace_keeps_history_position(make_store):
+    store = make_store('month')
+    payments = _payments()
+    store.save_all(payments)
+
+    updated = dict(payments[1], items=[dict(payments[1]['items'][0], amount=9999)])
+    assert store.replace(updated) == payments[1]
+    assert store.load()[1] == updated
+
+    # 支払月が変わった場合は別の分割ファイルへ移し、履歴の位置は変えない
+    moved = dict(payments[2], payment_date='2025-02-01')
+    store.replace(moved)
+    assert _ids(store.load()) == _ids(payments)
+    assert store.load()[2] == moved
+    assert _ids(store.load(date_from='2025-02-01')) == [moved['id']]
+
+    restored = make_payment('20250106_090000', (6000,), company='B社')
+    assert store.replace(restored) is None
+    assert _ids(store.load()) == _ids(payments) + [restored['id']]
+
+
+def test_in_use_follows_manifest_changes(make_store):
+    store = make_store()
+    other = make_store()
+    with open(store.legacy_path, 'w', encoding='utf-8') as f:
+        json.dump(_payments(), f, ensure_ascii=False)
+    other.migrate()
+    assert not store.in_use()
+    other.migrate(confirm=True)
+    assert store.in_use()
@@ -0,0 +1,125 @@
+"""振込データ検証（transfer_validation.py）と振込ファイル出力前の検証のテスト"""
+import payment_exports
+from conftest import make_payment, make_recipient
+from transfer_validation import TransferValidator
+
+
+def _codes(issues, severity=None):
+    return [issue['code'] for issue in issues if severity is None or issue['severity'] == severity]
+
+
+def test_valid_account_has_no_issues():
+    assert TransferValidator().validate_vendor(make_recipient('1234567')) == []
+
+
+def test_digit_fields():
+    validator = TransferValidator()
+    issues = validator.validate_vendor(make_recipient('12345678', bank_code='ABCD', branch_code='1'))
+    by_field = {issue['field']: issue for issue in issues}
+    assert by_field['bank_code']['code'] == 'not_numeric'
+    assert by_field['account_number']['code'] == 'too_long'
+    assert by_field['branch_code']['code'] == 'zero_padded'
+    assert by_field['branch_code']['severity'] == 'warning'
+
+
+def test_account_type_and_holder():
+    vendor = dict(make_recipient('1234567', holder=''), account_type='3')
+    issues = TransferValidator().validate_vendor(vendor)
+    assert _codes(issues, 'error') == ['invalid_account_type', 'required']
+
+
+def test_holder_width_depends_on_role():
+    vendor = make_recipient('1234567', holder='ｱ' * 35)
+    validator = TransferValidator()
+    assert _codes(validator.validate_vendor(vendor)) == ['truncated']
+    assert validator.validate_vendor(vendor, role='remitter') == []
+
+
+def test_results_are_cached_by_revision():
+    validator = TransferValidator()
+    vendor = make_recipient('1234567')
+    first = validator.validate_vendor(vendor)
+    assert validator.validate_vendor(dict(vendor)) is first
+    validator.validate_vendor(dict(vendor, account_number='7654321'))
+    assert validator.cache_info() == {'size': 2, 'hits': 1, 'misses': 2}
+
+
+def test_payment_amount_rules():
+    payment = make_payment(amounts=(0, 10 ** 10, 5000))
+    payment['items'][2]['recipient'] = None
+    result = TransferValidator().validate_payment(payment, {}, payment['remitter'])
+    assert not result['valid']
+    assert _codes(result['issues']) == ['invalid_amount', 'amount_too_large', 'vendor_not_found']
+    assert result['issues'][1]['item_id'] == payment['items'][1]['id']
+
+
+def test_consolidated_and_total_amounts():
+    payment = make_payment(amounts=(6 * 10 ** 9, 6 * 10 ** 9))
+    for item in payment['items']:
+        item['recipient'] = make_recipient('0000001')
+    result = TransferValidator().validate_payment(payment, {}, payment['remitter'])
+    assert _codes(result['issues']) == ['consolidated_amount_too_large']
+
+    payment = make_payment(amounts=[9 * 10 ** 9] * 112)
+    result = TransferValidator().validate_payment(payment, {}, payment['remitter'])
+    assert _codes(result['issues']) == ['total_amount_too_large']
+
+
+def test_missing_company_is_an_error():
+    payment = make_payment()
+    result = TransferValidator().validate_payment(payment, {}, None)
+    assert not result['valid']
+    assert _codes(result['issues']) == ['remitter_not_found']
+
+
+def test_remitter_snapshot_has_no_default_bank():
+    remitter = payment_exports.remitter_snapshot({'name': 'テスト送金会社', 'account_holder': 'ﾃｽﾄ'})
+    assert (remitter['bank_code'], remitter['bank_name'], remitter['branch_code']) == ('', '', '')
+    issues = TransferValidator().validate_vendor(remitter, role='remitter')
+    assert {issue['field'] for issue in issues if issue['code'] == 'required'} == {
+        'bank_code', 'branch_code', 'account_number'}
+
+
+def test_transfer_download_is_refused_until_forced(app_client):
+    payment = make_payment(amounts=(10 ** 10, 5000))
+    client = app_client([payment])
+
+    response = client.get(f"/api/payments/{payment['id']}/transfer?format=fixed")
+    assert response.status_code == 422
+    assert _codes(response.get_json()['validation']['issues']) == ['amount_too_large']
+
+    response = client.get(f"/api/payments/{payment['id']}/transfer?format=fixed&force=1")
+    assert response.status_code == 200
+    assert len(response.data) == 120 * 5
+    assert int(response.headers['X-Transfer-Rejections']) >= 1
+
+
+def test_valid_transfer_download(app_client):
+    payment = make_payment()
+    client = app_client([payment])
+
+    response = client.get(f"/api/payments/{payment['id']}/transfer?format=fixed_crlf")
+    assert response.status_code == 200
+    assert len(response.data) == 122 * 5
+    assert response.headers['X-Transfer-Rejections'] == '0'
+
+    response = client.get('/api/payments/missing/transfer')
+    assert response.status_code == 404
+
+
+def test_snapshot_keeps_missing_account_fields():
+    vendor = {'id': 1, 'name': 'テスト商事', 'bank_code': '', 'branch_code': None, 'account_number': '',
+              'account_type': 1, 'account_holder': 'ﾃｽﾄｼﾖｳｼﾞ'}
+    snapshot = payment_exports.recipient_snapshot(vendor)
+    assert (snapshot['bank_code'], snapshot['branch_code'], snapshot['account_number']) == ('', '', '')
+    assert payment_exports.account_key(snapshot) is None
+
+    validator = TransferValidator()
+    assert _codes(validator.validate_vendor(snapshot), 'error') == _codes(validator.validate_vendor(vendor), 'error')
+    assert _codes(validator.validate_vendor(snapshot), 'error') == ['required', 'required', 'required']
+
+
+def test_snapshot_zero_pads_digit_strings_only():
+    snapshot = payment_exports.recipient_snapshot({'bank_code': '１', 'branch_code': '12', 'account_number': '12-34'})
+    assert (snapshot['bank_code'], snapshot['branch_code'], snapshot['account_number']) == ('0001', '012', '12-34')
+    assert _codes(TransferValidator().validate_vendor(snapshot), 'error')[:1] == ['not_numeric']
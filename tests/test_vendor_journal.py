@@ -0,0 +1,46 @@
+"""業者マスターの変更履歴（vendor_journal.py）のテスト"""
+import json
+
+import pytest
+
+from vendor_journal import VendorJournal
+
+
+@pytest.fixture
+def journal(tmp_path):
+    vendors_file = tmp_path / 'vendors.json'
+    vendors_file.write_text('[]', encoding='utf-8')
+    return VendorJournal(vendors_file=str(vendors_file), filepath=str(tmp_path / 'vendor_journal.jsonl'))
+
+
+def _save(journal, vendors):
+    with journal.lock():
+        with open(journal.vendors_file, encoding='utf-8') as f:
+            previous = json.load(f)
+        with open(journal.vendors_file, 'w', encoding='utf-8') as f:
+            json.dump(vendors, f)
+        return journal.record(previous, vendors)
+
+
+def test_current_version_does_not_rewrite_unchanged_journal(journal, monkeypatch):
+    version = journal.current_version()
+    rewrites = []
+    monkeypatch.setattr(journal, '_rewrite', lambda *args: rewrites.append(args))
+    assert [journal.current_version() for _ in range(3)] == [version] * 3
+    assert rewrites == []
+
+
+def test_changes_since_previous_version(journal):
+    base = journal.current_version()
+    version = _save(journal, [{'id': 1, 'name': 'テスト商事'}])
+    assert version == base + 1
+    assert journal.current_version() == version
+    assert journal.changes(base) == (version, [{'id': 1, 'name': 'テスト商事'}], [])
+
+
+def test_external_change_advances_base_version(journal):
+    version = _save(journal, [{'id': 1, 'name': 'テスト商事'}])
+    with open(journal.vendors_file, 'w', encoding='utf-8') as f:
+        json.dump([{'id': 2, 'name': '別の業者'}, {'id': 3, 'name': '追加'}], f)
+    assert journal.current_version() == version + 1
+    assert journal.changes(version) is None
@@ -0,0 +1,83 @@
+"""ワーカープール（worker_pool.py）で実行した処理段階の時間の記録・実行件数の上限のテスト"""
+from concurrent.futures import Future
+
+import pytest
+from flask import Flask, g
+
+import payment_exports
+import worker_pool
+from conftest import make_payment
+from metrics import metrics
+from worker_pool import WorkerPool, WorkerPoolBusy, WorkerPoolTimeout
+
+
+@pytest.fixture
+def metrics_enabled(tmp_path, monkeypatch):
+    # プールのプロセスは環境変数から計測の有効・無効を読み込む（ログは一時ディレクトリに出力）
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('METRICS_ENABLED', '1')
+    monkeypatch.setattr(metrics, 'enabled', True)
+
+
+def _stage_count(name):
+    histogram = metrics._stage_durations.get(name)
+    return histogram.count if histogram else 0
+
+
+@pytest.mark.parametrize('max_workers', [1, 0])
+def test_stage_timings_are_recorded_in_parent(metrics_enabled, max_workers):
+    payment = make_payment()
+    context = (payment, {}, payment['remitter'])
+    before = _stage_count('transfer_encode')
+    pool = WorkerPool(max_workers=max_workers, max_queue=1, timeout=60)
+    try:
+        with Flask(__name__).test_request_context():
+            content, transfer_format, rejections, error = pool.run(
+                payment_exports.build_transfer_file, payment['id'], 'fixed', context
+            )
+            stage_timings = dict(g.stage_timings)
+    finally:
+        pool.shutdown()
+
+    assert error is None
+    assert len(content) == 120 * 5
+    assert {'kana_convert', 'transfer_encode'} <= set(stage_timings)
+    assert _stage_count('transfer_encode') == before + 1
+    assert ('worker_pool' in stage_timings) == bool(max_workers)
+
+
+class _PendingExecutor:
+    """依頼した処理が呼び出し側で完了させるまで終わらないプール"""
+
+    def __init__(self, **kwargs):
+        self.futures = []
+
+    def submit(self, func, *args):
+        future = Future()
+        self.futures.append(future)
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        pass
+
+
+def test_discarded_pool_does_not_release_slots_of_new_pool(monkeypatch):
+    monkeypatch.setattr(worker_pool, 'ProcessPoolExecutor', _PendingExecutor)
+    pool = WorkerPool(max_workers=1, max_queue=0, timeout=0.01)
+
+    with pytest.raises(WorkerPoolTimeout):
+        pool.run(_stage_count, 'transfer_encode')
+    old = pool._executor
+    pool._discard(old)
+
+    with pytest.raises(WorkerPoolTimeout):
+        pool.run(_stage_count, 'transfer_encode')
+    # 破棄したプールの処理が後から終わっても、新しいプールの実行中の件数は減らない
+    old.futures[0].set_result((0, []))
+    assert pool.status()['in_flight'] == 1
+    with pytest.raises(WorkerPoolBusy):
+        pool.run(_stage_count, 'transfer_encode')
+
+    pool._executor.futures[0].set_result((0, []))
+    status = pool.status()
+    assert (status['in_flight'], status['completed'], status['rejected']) == (0, 2, 1)
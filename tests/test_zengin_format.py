@@ -0,0 +1,96 @@
+"""全銀協フォーマットのレコード組み立て（zengin_format.py）のテスト"""
+import pytest
+
+import zengin_format
+from zengin_format import FieldOverflowError, encode_field
+
+HEADER = {
+    'type_code': '21', 'code_type': '0', 'client_code': '1234567890', 'client_name': 'ﾃｽﾄｿｳｷﾝ',
+    'transfer_date': '0110', 'bank_code': '0001', 'bank_name': 'ﾐｽﾞﾎ', 'branch_code': '001',
+    'branch_name': 'ﾎﾝﾃﾝ', 'account_type': '1', 'account_number': '1234567',
+}
+
+
+def _data_record(amount, holder='ｶ)ﾃｽﾄ'):
+    return {
+        'bank_code': '0001', 'bank_name': 'ﾐｽﾞﾎ', 'branch_code': '001', 'branch_name': 'ﾎﾝﾃﾝ',
+        'account_type': '1', 'account_number': '0000001', 'account_holder': holder,
+        'amount': amount, 'transfer_type': '7',
+    }
+
+
+def _trailer(records):
+    return {'record_count': len(records), 'total_amount': sum(int(r['amount']) for r in records)}
+
+
+def test_text_field_is_padded_by_shift_jis_bytes():
+    assert encode_field('ｱｲｳ', 5, 'C') == b'\xb1\xb2\xb3  '
+    encoded = encode_field('山田', 6, 'C')
+    assert encoded == '山田'.encode('shift_jis') + b'  '
+    assert len(encoded) == 6
+
+
+def test_text_field_is_truncated_without_splitting_double_byte_chars():
+    rejections = []
+    encoded = encode_field('山田太郎', 5, 'C', rejections, {'field': 'account_holder'})
+    assert encoded == '山田'.encode('shift_jis') + b' '
+    assert rejections == [{'field': 'account_holder', 'reason': 'truncated', 'value': '山田太郎', 'byte_length': 8}]
+
+
+def test_unencodable_char_is_replaced_and_recorded():
+    rejections = []
+    encoded = encode_field('A☃B', 4, 'C', rejections, {'field': 'client_name'})
+    assert encoded == b'A B '
+    assert rejections[0]['reason'] == 'unencodable'
+
+
+def test_numeric_field_is_zero_padded():
+    assert encode_field('123', 7, 'N') == b'0000123'
+    assert encode_field(None, 4, 'N') == b'0000'
+
+
+def test_numeric_overflow_is_rejected():
+    with pytest.raises(FieldOverflowError) as excinfo:
+        encode_field('12345678901', 10, 'N', location={'field': 'amount', 'label': '振込金額'})
+    assert '振込金額' in str(excinfo.value)
+
+
+def test_numeric_overflow_is_recorded_when_collecting_rejections():
+    rejections = []
+    assert encode_field('12345678901', 10, 'N', rejections, {'field': 'amount'}) == b'2345678901'
+    assert rejections[0]['reason'] == 'overflow'
+
+
+@pytest.mark.parametrize('transfer_format, separator', [('fixed', b''), ('fixed_crlf', b'\r\n')])
+def test_fixed_length_records_are_120_bytes(transfer_format, separator):
+    records = [_data_record(10000), _data_record(25000, holder='ﾔﾏﾀﾞ ﾀﾛｳ')]
+    content = zengin_format.build_transfer_file(HEADER, records, _trailer(records), transfer_format)
+
+    assert type(content) is bytes
+    stride = zengin_format.RECORD_LENGTH + len(separator)
+    assert len(content) == stride * (len(records) + 3)
+    chunks = [content[offset:offset + stride] for offset in range(0, len(content), stride)]
+    assert [chunk[:1] for chunk in chunks] == [b'1', b'2', b'2', b'8', b'9']
+    assert all(chunk.endswith(separator) for chunk in chunks)
+    assert chunks[1][80:90] == b'0000010000'
+
+
+def test_csv_is_bytes_with_crlf():
+    records = [_data_record(10000)]
+    content = zengin_format.build_transfer_file(HEADER, records, _trailer(records), 'csv')
+    assert type(content) is bytes
+    lines = content.split(b'\r\n')
+    assert [line[:1] for line in lines] == [b'1', b'2', b'8', b'9', b'']
+
+
+def test_build_transfer_file_rejects_overflow_unless_allowed():
+    records = [_data_record(10 ** 10)]
+    with pytest.raises(FieldOverflowError) as excinfo:
+        zengin_format.build_transfer_file(HEADER, records, _trailer(records), 'csv')
+    assert [overflow['field'] for overflow in excinfo.value.overflows] == ['amount']
+
+    rejections = []
+    content = zengin_format.build_transfer_file(HEADER, records, _trailer(records), 'csv',
+                                                rejections, allow_overflow=True)
+    assert content.split(b'\r\n')[1].split(b',')[9] == b'0000000000'
+    assert [rejection['reason'] for rejection in rejections] == ['overflow']
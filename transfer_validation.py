@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+振込データ検証ユーティリティ
+振込ファイル出力前・マスターデータ取込時に口座情報を検証する
+検証結果は業者データの内容（リビジョン）ごとにキャッシュする
+"""
+import threading
+from collections import OrderedDict
+
+from kana_convert import to_halfwidth_kana, to_halfwidth_alphanumeric, find_unconvertible_chars
+
+# 検証結果に影響する業者データの項目
+REVISION_FIELDS = (
+    'bank_code', 'bank_name', 'bank_name_kana', 'branch_code', 'branch_name', 'branch_name_kana',
+    'account_type', 'account_number', 'account_holder',
+)
+
+# 預金種目（1:普通, 2:当座, 4:貯蓄, 9:その他）
+VALID_ACCOUNT_TYPES = {'1', '2', '4', '9'}
+
+# 全銀協フォーマットで使用できる文字（半角英大文字・数字・半角カナ・一部記号）
+ZENGIN_ALLOWED_CHARS = set('0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ ().-/,\\')
+ZENGIN_ALLOWED_CHARS.update(chr(code) for code in range(0xFF66, 0xFFA0))
+ZENGIN_ALLOWED_CHARS.difference_update('ｧｨｩｪｫｬｭｮｯ')  # 小文字カナは使用不可
+
+MAX_TRANSFER_AMOUNT = 10 ** 10 - 1  # 振込金額（10桁）
+MAX_TOTAL_AMOUNT = 10 ** 12 - 1  # 合計金額（12桁）
+
+
+def _issue(severity, code, field, message, value=None):
+    """検証結果の1項目を作成"""
+    return {'severity': severity, 'code': code, 'field': field, 'message': message, 'value': value}
+
+
+def _check_digits(issues, value, width, field, label):
+    """数字項目（銀行コード・支店コード・口座番号など）の桁数を検証"""
+    text = to_halfwidth_alphanumeric(str(value if value is not None else '')).strip()
+    if not text:
+        issues.append(_issue('error', 'required', field, f'{label}が未入力です', value))
+    elif not text.isdigit():
+        issues.append(_issue('error', 'not_numeric', field, f'{label}に数字以外の文字が含まれています', value))
+    elif len(text) > width:
+        issues.append(_issue('error', 'too_long', field, f'{label}は{width}桁以内で入力してください', value))
+    elif len(text) < width:
+        issues.append(_issue('warning', 'zero_padded', field, f'{label}は先頭を0埋めして{width}桁で出力されます', value))
+
+
+def _check_kana(issues, value, width, field, label, required=False):
+    """カナ項目が半角カナ変換後も銀行仕様を満たすか検証"""
+    if not value or not str(value).strip():
+        if required:
+            issues.append(_issue('error', 'required', field, f'{label}が未入力です', value))
+        return
+
+    unconvertible = find_unconvertible_chars(value)
+    if unconvertible:
+        # 名義人は変換できない文字があると銀行で不一致になるためエラー扱い
+        severity = 'error' if required else 'warning'
+        issues.append(_issue(
+            severity, 'unconvertible', field,
+            f"{label}に半角カナへ変換できない文字があります: {''.join(unconvertible)}", value
+        ))
+
+    kana = to_halfwidth_kana(value)
+    if required and not kana.strip():
+        issues.append(_issue('error', 'empty_after_conversion', field, f'{label}が半角カナ変換後に空になります', value))
+        return
+
+    invalid = sorted({char for char in kana if char not in ZENGIN_ALLOWED_CHARS} - set(unconvertible))
+    if invalid:
+        issues.append(_issue(
+            'warning', 'invalid_char', field,
+            f"{label}に全銀フォーマットで使用できない文字があります: {''.join(invalid)}", value
+        ))
+
+    try:
+        byte_length = len(kana.encode('shift_jis'))
+    except UnicodeEncodeError:
+        issues.append(_issue('error', 'unencodable', field, f'{label}をShift_JISに変換できません', value))
+        return
+    if byte_length > width:
+        issues.append(_issue('warning', 'truncated', field, f'{label}は{width}バイトに切り詰められます', value))
+
+
+class TransferValidator:
+    """振込データ検証クラス"""
+
+    def __init__(self, max_cache_size=4096):
+        self.max_cache_size = max_cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def vendor_revision(self, vendor, role='recipient'):
+        """検証結果のキャッシュキー（検証対象項目の内容）を作成"""
+        return (role,) + tuple(str(vendor.get(field, '')) for field in REVISION_FIELDS)
+
+    def _check_account(self, vendor, role):
+        """口座情報を検証"""
+        issues = []
+        _check_digits(issues, vendor.get('bank_code'), 4, 'bank_code', '金融機関コード')
+        _check_digits(issues, vendor.get('branch_code'), 3, 'branch_code', '支店コード')
+        _check_digits(issues, vendor.get('account_number'), 7, 'account_number', '口座番号')
+
+        if str(vendor.get('account_type', '')) not in VALID_ACCOUNT_TYPES:
+            issues.append(_issue('error', 'invalid_account_type', 'account_type',
+                                 '預金種目が不正です（1:普通, 2:当座, 4:貯蓄, 9:その他）', vendor.get('account_type')))
+
+        holder_width = 40 if role == 'remitter' else 30
+        _check_kana(issues, vendor.get('account_holder'), holder_width, 'account_holder', '口座名義', required=True)
+        # 金融機関マスターのカナ名があれば振込ファイルではそちらが使われる
+        _check_kana(issues, vendor.get('bank_name_kana') or vendor.get('bank_name'), 15, 'bank_name', '金融機関名')
+        _check_kana(issues, vendor.get('branch_name_kana') or vendor.get('branch_name'), 15, 'branch_name', '支店名')
+        return issues
+
+    def validate_vendor(self, vendor, role='recipient'):
+        """業者（受取人・送金会社）の口座情報を検証（内容が変わらなければキャッシュを返す）"""
+        revision = self.vendor_revision(vendor, role)
+        with self._lock:
+            cached = self._cache.get(revision)
+            if cached is not None:
+                self._cache.move_to_end(revision)
+                self.cache_hits += 1
+                return cached
+
+        issues = self._check_account(vendor, role)
+
+        with self._lock:
+            self.cache_misses += 1
+            self._cache[revision] = issues
+            while len(self._cache) > self.max_cache_size:
+                self._cache.popitem(last=False)
+        return issues
+
+    def validate_vendors(self, vendors):
+        """業者データ一覧を検証し、業者情報付きの検証結果を返す"""
+        results = []
+        for vendor in vendors:
+            for issue in self.validate_vendor(vendor):
+                results.append(dict(issue, vendor_id=vendor.get('id'), vendor_name=vendor.get('name', '')))
+        return results
+
+    def validate_payment(self, payment, vendor_map, company=None):
+        """支払表の全項目を検証（同一口座へ合算した振込金額・合計金額の桁数も確認する）"""
+        issues = []
+        account_totals = {}  # 口座キー -> (合算した金額, 明細数, 最初の明細の情報)
+        total_amount = 0
+
+        if company is None:
+            issues.append(_issue('error', 'remitter_not_found', 'remittance_company',
+                                 '送金会社がマスターデータにないため振込元の口座情報がありません',
+                                 payment.get('remittance_company')))
+        else:
+            for issue in self.validate_vendor(company, role='remitter'):
+                issues.append(dict(issue, remitter=company.get('name', '')))
+
+        for item in payment.get('items', []):
+            item_info = {'item_id': item.get('id'), 'vendor_id': item.get('vendor_id'),
+                         'vendor_name': item.get('vendor_name', '')}
+
+            try:
+                amount = int(item.get('amount'))
+            except (TypeError, ValueError):
+                amount = None
+            if amount is None or amount <= 0:
+                issues.append(dict(_issue('error', 'invalid_amount', 'amount', '振込金額が不正です',
+                                          item.get('amount')), **item_info))
+            elif amount > MAX_TRANSFER_AMOUNT:
+                issues.append(dict(_issue('error', 'amount_too_large', 'amount', '振込金額が10桁を超えています',
+                                          item.get('amount')), **item_info))
+
+            # 作成時に保存した受取人の口座情報があればそれを検証する（業者が見つからなかった明細は None）
+            vendor = item['recipient'] if 'recipient' in item else vendor_map.get(item.get('vendor_id'))
+            if vendor is None:
+                issues.append(dict(_issue('error', 'vendor_not_found', 'vendor_id',
+                                          '業者がマスターデータに見つかりません', item.get('vendor_id')), **item_info))
+                continue
+            for issue in self.validate_vendor(vendor):
+                issues.append(dict(issue, **item_info))
+            if amount is not None and amount > 0:
+                key = f"{vendor.get('bank_code')}-{vendor.get('branch_code')}-{vendor.get('account_number')}"
+                subtotal, count, first_info = account_totals.get(key, (0, 0, item_info))
+                account_totals[key] = (subtotal + amount, count + 1, first_info)
+                total_amount += amount
+
+        # 振込ファイルでは同一口座の明細を合算するため、合算後の金額も10桁以内か確認する
+        for subtotal, count, item_info in account_totals.values():
+            if count > 1 and subtotal > MAX_TRANSFER_AMOUNT:
+                issues.append(dict(_issue('error', 'consolidated_amount_too_large', 'amount',
+                                          '同一口座へ合算した振込金額が10桁を超えています', subtotal), **item_info))
+        if total_amount > MAX_TOTAL_AMOUNT:
+            issues.append(_issue('error', 'total_amount_too_large', 'amount', '合計金額が12桁を超えています', total_amount))
+
+        error_count = sum(1 for issue in issues if issue['severity'] == 'error')
+        return {
+            'payment_id': payment.get('id'),
+            'valid': error_count == 0,
+            'error_count': error_count,
+            'warning_count': len(issues) - error_count,
+            'issues': issues,
+        }
+
+    def cache_info(self):
+        """キャッシュの状態を取得"""
+        with self._lock:
+            return {'size': len(self._cache), 'hits': self.cache_hits, 'misses': self.cache_misses}
+
+
+# グローバルインスタンス
+transfer_validator = TransferValidator()
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+アップロードした業者マスターファイルの重複排除と読み込み結果のキャッシュ
+アップロードされたファイルを内容のハッシュ（SHA-256）で識別し、
+- 同じ内容のファイルが uploads/ にある場合は保存せずに既存のファイルを使う
+- 読み込み結果（業者データ・警告メッセージ）をハッシュごとに upload_cache/<ハッシュ>.jsonl に保存し、
+  同じ内容のファイルは読み込み・変換を行わずにキャッシュから取り込む（ファイルの削除後も残す）
+
+キャッシュのファイル形式（JSON Lines）:
+    1行目: {"bank_revision": 金融機関マスターの更新日時, "message": 警告メッセージ, "count": 件数}
+    2行目以降: 業者データ（1行1件）
+金融機関名・支店名の補完結果を含むため、金融機関マスターが更新された場合は読み込み直す
+
+ハッシュと uploads/ のファイルの対応は upload_cache/index.json に保存する
+（記録のないファイルは、同じサイズのファイルがアップロードされたときにハッシュを計算して記録する）
+
+環境変数:
+    UPLOAD_CACHE_MAX  保持する読み込み結果の件数（既定: 50。超えた場合は古いものから削除）
+"""
+import hashlib
+import json
+import os
+import threading
+import uuid
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows ではプロセス間のロックを行わない
+    fcntl = None
+
+CACHE_FOLDER = 'upload_cache'
+CHUNK_SIZE = 1024 * 1024
+
+
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def _file_signature(filepath):
+    try:
+        stat = os.stat(filepath)
+    except OSError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def file_digest(filepath):
+    """ファイルの内容のハッシュ（SHA-256）"""
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class UploadCache:
+    """アップロードファイルの重複排除・読み込み結果のキャッシュ管理クラス"""
+
+    def __init__(self, upload_folder='uploads', folder=CACHE_FOLDER):
+        self.upload_folder = upload_folder
+        self.folder = folder
+        self.index_path = os.path.join(folder, 'index.json')
+        self.max_entries = _env_int('UPLOAD_CACHE_MAX', 50)
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.duplicates = 0
+
+    @contextmanager
+    def _locked(self):
+        """索引の読み書き（gunicornの別ワーカーとも排他）"""
+        with self._lock:
+            os.makedirs(self.folder, exist_ok=True)
+            if fcntl is None:
+                yield
+                return
+            with open(self.index_path + '.lock', 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_index(self):
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_index(self, index):
+        temp_path = self.index_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f, ensure_ascii=False)
+        os.replace(temp_path, self.index_path)
+
+    def _rows_path(self, digest):
+        return os.path.join(self.folder, f"{digest}.jsonl")
+
+    # ---- 受け取り・重複排除 ----
+
+    def receive(self, file):
+        """アップロードされたファイルを一時ファイルに保存しながらハッシュを計算（一時ファイルのパス, ハッシュ）"""
+        os.makedirs(self.folder, exist_ok=True)
+        temp_path = os.path.join(self.folder, f"{uuid.uuid4().hex}.upload")
+        digest = hashlib.sha256()
+        with open(temp_path, 'wb') as f:
+            for chunk in iter(lambda: file.stream.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+                f.write(chunk)
+        return temp_path, digest.hexdigest()
+
+    def find_file(self, digest, size):
+        """同じ内容のファイルが uploads/ にあればファイル名を返す"""
+        with self._locked():
+            index = self._read_index()
+            entry = index.get(digest)
+            if entry and _file_signature(os.path.join(self.upload_folder, entry['filename'])) == entry['signature']:
+                return entry['filename']
+
+            # 削除・変更されたファイルの記録を除く
+            live = {file_hash: entry for file_hash, entry in index.items()
+                    if _file_signature(os.path.join(self.upload_folder, entry['filename'])) == entry['signature']}
+            changed = len(live) != len(index)
+            index = live
+
+            # 記録のない（以前にアップロードされた）ファイルは、同じサイズのものだけハッシュを計算して記録する
+            recorded = {(entry['filename'], tuple(entry['signature'])) for entry in index.values()}
+            found = None
+            for filename in sorted(os.listdir(self.upload_folder)) if os.path.isdir(self.upload_folder) else []:
+                filepath = os.path.join(self.upload_folder, filename)
+                signature = _file_signature(filepath)
+                if (not os.path.isfile(filepath) or signature is None or signature[1] != size
+                        or (filename, tuple(signature)) in recorded):
+                    continue
+                file_hash = file_digest(filepath)
+                index[file_hash] = {'filename': filename, 'signature': signature}
+                changed = True
+                if file_hash == digest:
+                    found = filename
+                    break
+            if changed:
+                self._write_index(index)
+            return found
+
+    def record_file(self, digest, filename):
+        """保存したファイルとハッシュの対応を記録"""
+        with self._locked():
+            index = self._read_index()
+            index[digest] = {'filename': filename,
+                             'signature': _file_signature(os.path.join(self.upload_folder, filename))}
+            self._write_index(index)
+
+    def note_duplicate(self):
+        self.duplicates += 1
+
+    # ---- 読み込み結果 ----
+
+    def get(self, digest, bank_revision):
+        """キャッシュした読み込み結果（業者データ, 警告メッセージ）。ない・古い場合は None"""
+        try:
+            with open(self._rows_path(digest), 'r', encoding='utf-8') as f:
+                header = json.loads(f.readline())
+                if header.get('bank_revision') != bank_revision:
+                    self.misses += 1
+                    return None
+                vendors = [json.loads(line) for line in f if line.strip()]
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        if len(vendors) != header.get('count'):
+            # 書き込み途中のファイル
+            self.misses += 1
+            return None
+        self.hits += 1
+        try:
+            os.utime(self._rows_path(digest))  # 使われた結果は削除の対象から遠ざける
+        except OSError:
+            pass
+        return vendors, header.get('message')
+
+    def put(self, digest, bank_revision, vendors, message):
+        """読み込み結果を保存（保持件数を超えた場合は古いものから削除）"""
+        os.makedirs(self.folder, exist_ok=True)
+        path = self._rows_path(digest)
+        temp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'bank_revision': bank_revision, 'message': message,
+                                'count': len(vendors)}, ensure_ascii=False) + '\n')
+            for vendor in vendors:
+                f.write(json.dumps(vendor, ensure_ascii=False) + '\n')
+        os.replace(temp_path, path)
+        self._prune()
+
+    def _prune(self):
+        entries = []
+        for filename in os.listdir(self.folder):
+            if filename.endswith('.jsonl'):
+                path = os.path.join(self.folder, filename)
+                try:
+                    entries.append((os.path.getmtime(path), path))
+                except OSError:
+                    pass
+        for _, path in sorted(entries)[:max(0, len(entries) - self.max_entries)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def status(self):
+        """キャッシュの利用状況を取得"""
+        return {'hits': self.hits, 'misses': self.misses, 'duplicates': self.duplicates,
+                'max_entries': self.max_entries}
+
+
+# グローバルインスタンス
+upload_cache = UploadCache()
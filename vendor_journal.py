@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+業者マスターの変更履歴（差分同期用）
+業者データを保存するたびに、前回との差分（追加・更新した業者と削除した業者ID）をバージョン番号付きで
+vendor_journal.jsonl に追記する。ブラウザは手元に保存した業者データのバージョン以降の差分だけを取得する
+
+ファイル形式（JSON Lines）:
+    1行目: {"base": 基準バージョン}（これより前のバージョンからは差分で追えないため全件を返す）
+    2行目以降: {"version": n, "upserts": [業者, ...], "deletes": [業者ID, ...], "signature": [更新日時, サイズ]}
+
+signature は記録時の業者データファイルの状態で、これと異なる場合（変更履歴を通さずにファイルが
+置き換えられた場合）は基準バージョンを進めて、ブラウザに全件を取り直させる
+
+環境変数:
+    VENDOR_JOURNAL_MAX  変更履歴に保持する件数（既定: 1000。超えた場合は履歴を切り詰める）
+"""
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows ではプロセス間のロックを行わない
+    fcntl = None
+
+JOURNAL_FILE = 'vendor_journal.jsonl'
+
+
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def _file_signature(filepath):
+    try:
+        stat = os.stat(filepath)
+    except OSError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+class VendorJournal:
+    """業者マスターの変更履歴管理クラス"""
+
+    def __init__(self, vendors_file='vendors.json', filepath=JOURNAL_FILE):
+        self.vendors_file = vendors_file
+        self.filepath = filepath
+        self.max_entries = _env_int('VENDOR_JOURNAL_MAX', 1000)
+        self._lock = threading.RLock()
+        self._cache_signature = None
+        self._cache = None  # (基準バージョン, 記録の一覧)
+
+    @contextmanager
+    def lock(self, shared=False):
+        """業者データの保存と変更履歴の記録をまとめて行うためのロック（gunicornの別ワーカーとも排他）
+        shared=True は読み込みだけを行う場合で、他のワーカーの読み込みとは同時に実行できる"""
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self.filepath + '.lock', 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read(self):
+        """変更履歴を読み込み（基準バージョン, 記録の一覧）。ファイルが変わっていなければ前回の内容を返す"""
+        signature = _file_signature(self.filepath)
+        if signature is None:
+            return 0, []
+        if signature == self._cache_signature:
+            return self._cache
+        base, entries = 0, []
+        with open(self.filepath, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if 'base' in record:
+                    base = record['base']
+                else:
+                    entries.append(record)
+        self._cache_signature = signature
+        self._cache = (base, entries)
+        return self._cache
+
+    @staticmethod
+    def _version(base, entries):
+        return entries[-1]['version'] if entries else base
+
+    def _rewrite(self, base, entries):
+        temp_path = self.filepath + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'base': base}) + '\n')
+            for entry in entries:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        os.replace(temp_path, self.filepath)
+
+    def _reset(self, base):
+        """基準バージョンを進めて履歴を空にする（以前のバージョンを持つブラウザは全件を取り直す）"""
+        self._rewrite(base, [{'version': base, 'upserts': [], 'deletes': [],
+                              'signature': _file_signature(self.vendors_file)}])
+
+    def record(self, previous, vendors):
+        """業者データの保存後に、保存前との差分を記録（lock() の中で呼ぶ）
+        変更があった場合は新しいバージョン、なかった場合は None を返す"""
+        with self._lock:
+            base, entries = self._read()
+            version = self._version(base, entries)
+            old_map = {vendor.get('id'): vendor for vendor in previous}
+            new_ids = {vendor.get('id') for vendor in vendors}
+            upserts = [vendor for vendor in vendors if old_map.get(vendor.get('id')) != vendor]
+            deletes = [vendor_id for vendor_id in old_map if vendor_id not in new_ids]
+            if upserts or deletes:
+                version += 1
+            entry = {'version': version, 'upserts': upserts, 'deletes': deletes,
+                     'signature': _file_signature(self.vendors_file)}
+
+            if not entries or len(entries) >= self.max_entries:
+                # 初回・件数が上限を超えた場合は履歴を切り詰める
+                self._reset(version)
+            else:
+                with open(self.filepath, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            return version if upserts or deletes else None
+
+    def _stale(self, entries):
+        """業者データのファイルが変更履歴を通さずに変わっているか"""
+        return not entries or entries[-1].get('signature') != _file_signature(self.vendors_file)
+
+    def current_version(self):
+        """現在のバージョン（業者データのファイルが変更履歴を通さずに変わっていれば基準バージョンを進める）
+        通常は共有ロックで読み込むだけで、基準バージョンを進める場合だけ排他ロックで書き直す"""
+        with self.lock(shared=True):
+            base, entries = self._read()
+            if not self._stale(entries):
+                return self._version(base, entries)
+        with self.lock():
+            # ロックを取り直す間に他のワーカーが書き直している場合があるため、読み込み直して確認する
+            base, entries = self._read()
+            version = self._version(base, entries)
+            if self._stale(entries):
+                version += 1
+                self._reset(version)
+            return version
+
+    def changes(self, since):
+        """指定したバージョン以降の差分（バージョン, 追加・更新した業者, 削除した業者ID）
+        差分で追えない場合（基準バージョンより前・未来のバージョン）は None"""
+        version = self.current_version()
+        with self._lock:
+            base, entries = self._read()
+        if since is None or since < base or since > version:
+            return None
+
+        # 同じ業者の変更は最後のものだけを返す
+        upserts = {}
+        deletes = set()
+        for entry in entries:
+            if entry['version'] <= since:
+                continue
+            for vendor in entry['upserts']:
+                upserts[vendor.get('id')] = vendor
+                deletes.discard(vendor.get('id'))
+            for vendor_id in entry['deletes']:
+                upserts.pop(vendor_id, None)
+                deletes.add(vendor_id)
+        return version, list(upserts.values()), sorted(deletes, key=str)
+
+    def status(self):
+        """変更履歴の状態を取得"""
+        with self._lock:
+            base, entries = self._read()
+            return {'version': self._version(base, entries), 'base': base, 'entries': len(entries)}
+
+
+# グローバルインスタンス
+vendor_journal = VendorJournal()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+起動直後のウォームアップユーティリティ
+重いモジュール（ReportLab・openpyxl）の読み込みやフォント登録・マスターデータの読み込みを
+待ち受け開始後にバックグラウンドスレッドで行い、スリープ復帰後の最初のリクエストを待たせない
+（ウォームアップ前にリクエストが来た場合も、各処理は初回利用時に読み込むため結果は変わらない）
+
+環境変数:
+    WARMUP  0 の場合はウォームアップを行わない（既定: 1）
+"""
+import os
+import threading
+import time
+from datetime import datetime
+
+
+class Warmup:
+    """ウォームアップ処理の登録・実行クラス"""
+
+    def __init__(self):
+        self.enabled = os.environ.get('WARMUP', '1') != '0'
+        self._lock = threading.Lock()
+        self._tasks = []  # (名前, 関数)
+        self._thread = None
+        self._pid = None
+        self.started_at = None
+        self.finished_at = None
+        self.results = {}  # 名前 -> {'duration_ms':..., 'error':...}
+
+    def register(self, name, func):
+        """ウォームアップ処理を登録（登録順に実行）"""
+        self._tasks.append((name, func))
+        return func
+
+    def start(self):
+        """ウォームアップをバックグラウンドで開始（プロセスごとに1回だけ）"""
+        if not self.enabled:
+            return False
+        with self._lock:
+            # fork後の子プロセスではスレッドが引き継がれないため、プロセスIDで判定して再実行する
+            if self._pid == os.getpid():
+                return False
+            self._pid = os.getpid()
+            self.started_at = datetime.now().isoformat()
+            self.finished_at = None
+            self.results = {}
+            self._thread = threading.Thread(target=self.run, name='warmup', daemon=True)
+            self._thread.start()
+            return True
+
+    def run(self):
+        """登録済みのウォームアップ処理を順に実行（失敗しても続行）"""
+        for name, func in self._tasks:
+            start = time.perf_counter()
+            error = None
+            try:
+                func()
+            except Exception as e:
+                error = str(e)
+                print(f"ウォームアップエラー ({name}): {e}")
+            self.results[name] = {
+                'duration_ms': round((time.perf_counter() - start) * 1000, 2),
+                'error': error,
+            }
+        self.finished_at = datetime.now().isoformat()
+
+    def wait(self, timeout=None):
+        """ウォームアップの完了を待つ"""
+        thread = self._thread
+        if thread is not None and self._pid == os.getpid():
+            thread.join(timeout)
+        return self.finished_at is not None
+
+    def init_app(self, app):
+        """最初のリクエスト時にウォームアップを開始するフックを登録
+        （起動スクリプトから start() を呼べない実行方法向けの予備）"""
+        if not self.enabled:
+            return
+
+        @app.before_request
+        def _start_warmup():
+            if self._pid != os.getpid():
+                self.start()
+
+    def status(self):
+        """ウォームアップの実行状況を取得"""
+        return {
+            'enabled': self.enabled,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'tasks': dict(self.results),
+        }
+
+
+# グローバルインスタンス
+warmup = Warmup()
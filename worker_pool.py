@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+CPU負荷の高い処理（支払表PDF生成・総合振込ファイル出力）を別プロセスで実行するワーカープール
+業者検索・一覧取得などの画面操作のリクエストが、重い処理に待たされないようにする
+
+プールのプロセスで計測した処理段階の時間は結果と一緒に返し、呼び出し元のプロセスの /metrics・Server-Timing に記録する
+cProfile で記録中のリクエスト（管理者トークン指定時）は、処理の中身を記録できるようにプールを使わずに実行する
+
+同時に実行・待機できる件数には上限があり、上限を超えた依頼は WorkerPoolBusy で断る
+（ルート側で 503 と Retry-After を返し、クライアントに時間をおいて再試行してもらう）
+
+環境変数:
+    HEAVY_WORKERS      プロセス数（既定: CPU数と2の小さい方。0 の場合はリクエスト処理中のスレッドで実行）
+    HEAVY_QUEUE_DEPTH  実行中以外に待機できる件数（既定: 8）
+    HEAVY_TIMEOUT      1件あたりの最大待ち時間（秒、既定: 120）
+    HEAVY_RETRY_AFTER  混雑時に返す再試行までの秒数（既定: 5）
+"""
+import functools
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from metrics import metrics
+from profiling import request_profiler
+
+
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def _init_worker():
+    """プールのプロセス起動時の初期化（ログ出力の設定）"""
+    from app_logging import logging_manager
+    logging_manager.setup()
+
+
+def _noop():
+    return os.getpid()
+
+
+def _call_with_stages(func, *args):
+    """プールのプロセスで処理を実行し、結果と処理段階の時間を返す
+    （プールのプロセスの計測値は /metrics に出ないため、呼び出し元のプロセスで記録し直す）"""
+    with metrics.capture() as stages:
+        result = func(*args)
+    return result, stages
+
+
+class WorkerPoolBusy(Exception):
+    """実行・待機中の処理が上限に達している"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"処理が混み合っています。{retry_after}秒後に再試行してください")
+        self.retry_after = retry_after
+
+
+class WorkerPoolTimeout(Exception):
+    """処理が時間内に終わらなかった"""
+
+
+class WorkerPool:
+    """別プロセスでの処理実行クラス"""
+
+    def __init__(self, max_workers=None, max_queue=None, timeout=None):
+        self.max_workers = _env_int('HEAVY_WORKERS', min(2, os.cpu_count() or 1)) if max_workers is None else max_workers
+        self.max_queue = _env_int('HEAVY_QUEUE_DEPTH', 8) if max_queue is None else max_queue
+        self.timeout = _env_int('HEAVY_TIMEOUT', 120) if timeout is None else timeout
+        self.retry_after = _env_int('HEAVY_RETRY_AFTER', 5)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self._generation = 0  # プールを作り直した回数（破棄したプールの完了通知を区別する）
+        self._in_flight = 0  # 現在のプールの実行中＋待機中の件数
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.failed = 0
+        self.timed_out = 0
+
+    @property
+    def enabled(self):
+        return self.max_workers > 0
+
+    def _get_executor(self):
+        # fork後の子プロセス（gunicornのワーカー）では親のプールを使えないため、プロセスIDで判定して作成する
+        if self._executor is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._generation += 1
+            self._in_flight = 0
+            # スレッドを持つプロセスからの fork を避けるため spawn で起動する
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+            )
+        return self._executor
+
+    def _discard(self, executor):
+        """プロセスが異常終了したプールを破棄（次回の依頼で作り直す）"""
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _release(self, generation, future):
+        with self._lock:
+            # 破棄したプールの処理は作り直した時点で件数から外しているため、減らさない
+            if generation == self._generation:
+                self._in_flight -= 1
+            if future.cancelled() or future.exception() is not None:
+                self.failed += 1
+            else:
+                self.completed += 1
+
+    def run(self, func, *args):
+        """処理を別プロセスで実行して結果を返す（上限を超えた場合は WorkerPoolBusy、時間切れは WorkerPoolTimeout）
+
+        func はモジュールの関数（pickleできるもの）、引数・戻り値もpickleできるデータに限る
+        """
+        if not self.enabled or request_profiler.is_cprofiling():
+            # cProfile で記録中のリクエストは処理の中身を記録できるようにこのスレッドで実行する
+            return func(*args)
+
+        with self._lock:
+            executor = self._get_executor()
+            if self._in_flight >= self.max_workers + self.max_queue:
+                self.rejected += 1
+                raise WorkerPoolBusy(self.retry_after)
+            self._in_flight += 1
+            self.submitted += 1
+            generation = self._generation
+
+        try:
+            future = executor.submit(_call_with_stages, func, *args)
+        except (BrokenProcessPool, RuntimeError):
+            with self._lock:
+                if generation == self._generation:
+                    self._in_flight -= 1
+                self.failed += 1
+            self._discard(executor)
+            raise
+        future.add_done_callback(functools.partial(self._release, generation))
+
+        try:
+            with metrics.stage('worker_pool'):
+                result, stages = future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            # 実行中の処理は止められないため、終了するまで上限の件数に含めたままにする
+            with self._lock:
+                self.timed_out += 1
+            raise WorkerPoolTimeout(f"処理が{self.timeout}秒以内に終わりませんでした")
+        except BrokenProcessPool:
+            self._discard(executor)
+            raise
+        # プールのプロセスで計測した処理段階（PDF生成・カナ変換など）をこのプロセスの計測値・Server-Timing に記録
+        for name, seconds in stages:
+            metrics.observe_stage(name, seconds)
+        request_profiler.add_stages(stages)
+        return result
+
+    def prestart(self, func=_noop):
+        """プロセスを起動して func を実行しておく（起動直後のウォームアップ用）"""
+        if not self.enabled:
+            return func()
+        with self._lock:
+            executor = self._get_executor()
+        futures = [executor.submit(func) for _ in range(self.max_workers)]
+        return [future.result(timeout=self.timeout) for future in futures]
+
+    def shutdown(self):
+        """プールを停止"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None and self._pid == os.getpid():
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def status(self):
+        """実行状況を取得"""
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'max_workers': self.max_workers,
+                'max_queue': self.max_queue,
+                'in_flight': self._in_flight if self._pid == os.getpid() else 0,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'failed': self.failed,
+                'timed_out': self.timed_out,
+            }
+
+
+# グローバルインスタンス
+worker_pool = WorkerPool()
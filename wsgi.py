@@ -0,0 +1,13 @@
+#!/usr/bin/env python3
+"""
+本番用のWSGIエントリーポイント
+gunicorn -c gunicorn.conf.py wsgi:app
+"""
+from app import app, prepare_data_files
+from static_assets import static_assets
+
+# preload_app の場合はマスタープロセスで1回だけ実行される
+# （アプリケーションは app.py の読み込み時に作成済みのものを使い、create_app を重ねて呼ばない。
+#   静的ファイルのハッシュ・圧縮もここで作成し、fork後のワーカーで共有する）
+prepare_data_files()
+static_assets.build()
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+全銀協フォーマット（総合振込）レコード組み立てユーティリティ
+各フィールドをShift_JISで1回だけエンコードし、バイト幅で桁揃えして出力する
+"""
+
+ENCODING = 'shift_jis'
+RECORD_LENGTH = 120
+
+# フィールド定義: (フィールド名, バイト幅, 種別, 表示名)
+# 種別 'N' = 数字（右寄せ・ゼロ埋め）, 'C' = 文字（左寄せ・スペース埋め）
+HEADER_LAYOUT = [
+    ('data_type', 1, 'N', 'データ区分'),
+    ('type_code', 2, 'N', '種別コード'),
+    ('code_type', 1, 'N', 'コード区分'),
+    ('client_code', 10, 'N', '委託者コード'),
+    ('client_name', 40, 'C', '委託者名'),
+    ('transfer_date', 4, 'N', '取組日'),
+    ('bank_code', 4, 'N', '仕向銀行番号'),
+    ('bank_name', 15, 'C', '仕向銀行名'),
+    ('branch_code', 3, 'N', '仕向支店番号'),
+    ('branch_name', 15, 'C', '仕向支店名'),
+    ('account_type', 1, 'N', '預金種目'),
+    ('account_number', 7, 'N', '口座番号'),
+    ('dummy', 17, 'C', 'ダミー'),
+]
+
+DATA_LAYOUT = [
+    ('data_type', 1, 'N', 'データ区分'),
+    ('bank_code', 4, 'N', '被仕向銀行番号'),
+    ('bank_name', 15, 'C', '被仕向銀行名'),
+    ('branch_code', 3, 'N', '被仕向支店番号'),
+    ('branch_name', 15, 'C', '被仕向支店名'),
+    ('clearing_house', 4, 'N', '手形交換所番号'),
+    ('account_type', 1, 'N', '預金種目'),
+    ('account_number', 7, 'N', '口座番号'),
+    ('account_holder', 30, 'C', '受取人名'),
+    ('amount', 10, 'N', '振込金額'),
+    ('new_code', 1, 'C', '新規コード'),
+    ('customer_code1', 10, 'C', '顧客コード1'),
+    ('customer_code2', 10, 'C', '顧客コード2'),
+    ('transfer_type', 1, 'N', '振込区分'),
+    ('identification', 1, 'C', '識別表示'),
+    ('dummy', 7, 'C', 'ダミー'),
+]
+
+TRAILER_LAYOUT = [
+    ('data_type', 1, 'N', 'データ区分'),
+    ('record_count', 6, 'N', '合計件数'),
+    ('total_amount', 12, 'N', '合計金額'),
+    ('dummy', 101, 'C', 'ダミー'),
+]
+
+END_LAYOUT = [
+    ('data_type', 1, 'N', 'データ区分'),
+    ('dummy', 119, 'C', 'ダミー'),
+]
+
+
+class FieldOverflowError(ValueError):
+    """数字項目（銀行コード・支店コード・口座番号・金額など）が桁数を超えている
+
+    下位桁だけを残すと別の有効な番号・金額になり、誤った口座へ振り込まれるおそれがあるため出力しない
+    """
+
+    def __init__(self, overflows):
+        labels = '、'.join(dict.fromkeys(overflow.get('label') or overflow['value'] for overflow in overflows))
+        super().__init__(f"数字項目が桁数を超えています: {labels}")
+        self.overflows = overflows
+
+
+def _is_lead_byte(byte):
+    """Shift_JISの2バイト文字の第1バイトか判定"""
+    return 0x81 <= byte <= 0x9F or 0xE0 <= byte <= 0xFC
+
+
+def _truncate_bytes(encoded, width):
+    """文字の途中で切れないようにバイト幅で切り詰める"""
+    position = 0
+    while position < width:
+        step = 2 if _is_lead_byte(encoded[position]) else 1
+        if position + step > width:
+            break
+        position += step
+    return encoded[:position]
+
+
+def _encode_text(text, rejections, location):
+    """テキストをShift_JISにエンコード（変換できない文字は半角スペースに置換して記録）"""
+    try:
+        return text.encode(ENCODING)
+    except UnicodeEncodeError:
+        pass
+
+    # 変換できない文字を含むフィールドのみ1文字ずつ処理
+    encoded = bytearray()
+    rejected_chars = []
+    for char in text:
+        try:
+            encoded += char.encode(ENCODING)
+        except UnicodeEncodeError:
+            rejected_chars.append(f"{char} (U+{ord(char):04X})")
+            encoded += b' '
+    if rejections is not None:
+        rejections.append(dict(location, reason='unencodable', value=text, chars=rejected_chars))
+    return bytes(encoded)
+
+
+def encode_field(value, width, kind, rejections=None, location=None):
+    """フィールドをShift_JISバイト列に変換し、バイト幅に揃える"""
+    location = location or {}
+    text = '' if value is None else str(value)
+
+    if kind == 'N':
+        text = text.strip()
+        if not text:
+            return b'0' * width
+        encoded = _encode_text(text, rejections, location)
+        if not encoded.isdigit() and rejections is not None:
+            rejections.append(dict(location, reason='not_numeric', value=text))
+        if len(encoded) > width:
+            # 数字項目は切り詰めない（呼び出し元で出力を中止する。強制出力の場合のみ下位桁を残す）
+            overflow = dict(location, reason='overflow', value=text, byte_length=len(encoded))
+            if rejections is None:
+                raise FieldOverflowError([overflow])
+            rejections.append(overflow)
+            return encoded[-width:]
+        return encoded.rjust(width, b'0')
+
+    if not text:
+        return b' ' * width
+    encoded = _encode_text(text, rejections, location)
+    if len(encoded) > width:
+        if rejections is not None:
+            rejections.append(dict(location, reason='truncated', value=text, byte_length=len(encoded)))
+        encoded = _truncate_bytes(encoded, width)
+    return encoded.ljust(width, b' ')
+
+
+def encode_record(layout, values, rejections=None, record='data', index=0):
+    """レコード定義に従って各フィールドをバイト列に変換"""
+    fields = []
+    for name, width, kind, label in layout:
+        location = {'record': record, 'index': index, 'field': name, 'label': label}
+        fields.append(encode_field(values.get(name), width, kind, rejections, location))
+    return fields
+
+
+def iter_records(header, data_records, trailer):
+    """ヘッダー・データ・トレーラ・エンドの順にレコードを列挙"""
+    yield HEADER_LAYOUT, dict(header, data_type='1'), 'header', 0
+    for index, values in enumerate(data_records):
+        yield DATA_LAYOUT, dict(values, data_type='2'), 'data', index
+    yield TRAILER_LAYOUT, dict(trailer, data_type='8'), 'trailer', 0
+    yield END_LAYOUT, {'data_type': '9'}, 'end', 0
+
+
+def build_csv(header, data_records, trailer, rejections=None):
+    """カンマ区切り形式の振込ファイルをバイト列で組み立て（CR+LF改行）"""
+    lines = []
+    for layout, values, record, index in iter_records(header, data_records, trailer):
+        lines.append(b','.join(encode_record(layout, values, rejections, record, index)))
+    lines.append(b'')
+    return b'\r\n'.join(lines)
+
+
+# 出力形式: 'csv' = カンマ区切り, 'fixed' = 固定長120バイト（改行なし）, 'fixed_crlf' = 固定長120バイト＋CR+LF
+TRANSFER_FORMATS = {
+    'csv': None,
+    'fixed': b'',
+    'fixed_crlf': b'\r\n',
+}
+
+
+def build_fixed_length(header, data_records, trailer, rejections=None, line_separator=b''):
+    """固定長120バイト形式の振込ファイルを事前確保したバッファに直接書き込んで組み立て（bytes で返す）"""
+    stride = RECORD_LENGTH + len(line_separator)
+    buffer = bytearray(stride * (len(data_records) + 3))
+    view = memoryview(buffer)
+    offset = 0
+    for layout, values, record, index in iter_records(header, data_records, trailer):
+        for name, width, kind, label in layout:
+            location = {'record': record, 'index': index, 'field': name, 'label': label}
+            view[offset:offset + width] = encode_field(values.get(name), width, kind, rejections, location)
+            offset += width
+        if line_separator:
+            view[offset:offset + len(line_separator)] = line_separator
+            offset += len(line_separator)
+    view.release()
+    # WSGIサーバーはレスポンス本文に bytes 以外を受け付けないため、bytes にして返す
+    return bytes(buffer)
+
+
+def build_transfer_file(header, data_records, trailer, transfer_format='csv', rejections=None, allow_overflow=False):
+    """指定された出力形式で振込ファイルを組み立て
+
+    数字項目が桁数を超えている場合は FieldOverflowError（allow_overflow=True の場合は下位桁を残して出力）
+    """
+    if transfer_format not in TRANSFER_FORMATS:
+        raise ValueError(f"未対応の出力形式です: {transfer_format}")
+    if rejections is None:
+        rejections = []
+    if transfer_format == 'csv':
+        content = build_csv(header, data_records, trailer, rejections)
+    else:
+        content = build_fixed_length(header, data_records, trailer, rejections, TRANSFER_FORMATS[transfer_format])
+    overflows = [rejection for rejection in rejections if rejection['reason'] == 'overflow']
+    if overflows and not allow_overflow:
+        raise FieldOverflowError(overflows)
+    return content